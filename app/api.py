@@ -1,30 +1,36 @@
 # app/api.py
-import os
+import asyncio
+import json
+import shutil
 import tempfile
 import uuid
 from typing import List, Dict, Any, Optional
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.concurrency import run_in_threadpool
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+from .core.artifacts import ensure_job_excel
 from .core.config import (
     settings,
     load_runtime_overrides,
     save_runtime_overrides,
     get_effective_google_api_key,
-    get_effective_gcp_service_account_json,
 )
-from .core.processing import extract_sheet_id_from_url, process_files
-from .core.excel_template import generate_excel_from_results
+from .core.ingest import InvalidUploadError, UploadTooLargeError, stream_multipart_to_dir
+from .core.jobqueue import job_queue
+from .core.jobs import FINISHED_STATUSES, job_store
+from .core.processing import (
+    extract_sheet_id_from_url,
+    extraction_scheduler,
+    gemini_limiter,
+    normalize_output_format,
+)
+from .worker import wake_local_worker
 
 router = APIRouter(prefix="/api", tags=["quotation"])
 
-# เก็บสถานะงานแบบ in-memory
-jobs: Dict[str, Dict[str, Any]] = {}
-
-
 class SettingsPayload(BaseModel):
     google_api_key: Optional[str] = None
     gcp_service_account_json: Optional[str] = None
@@ -65,127 +71,158 @@ def update_settings(payload: SettingsPayload):
     )
 
 
-async def background_processing_task(
-    job_id: str,
-    file_paths: List[str],
-    sheet_id: str,
-    api_key: str,
-    gcp_json: str,
-    output_format: str,
-) -> None:
-    try:
-        results, errors = await run_in_threadpool(
-            process_files,
-            file_paths,
-            sheet_id,
-            api_key,
-            gcp_json,
-        )
-        jobs[job_id]["status"] = "completed"
-        jobs[job_id]["result"] = {
-            "sheet_id": sheet_id,
-            "results": results,
-            "errors": errors,
-            "output_format": output_format,
-        }
-    except Exception as e:
-        jobs[job_id]["status"] = "failed"
-        jobs[job_id]["error"] = str(e)
-    finally:
-        for path in file_paths:
-            if os.path.exists(path):
-                try:
-                    os.unlink(path)
-                except OSError:
-                    pass
+@router.get("/scheduler")
+def get_scheduler_status():
+    return {
+        "scheduler": extraction_scheduler.snapshot(),
+        "gemini_limiter": gemini_limiter.snapshot(),
+    }
+
+
+def _form_flag(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 @router.post("/process-files-async", response_model=StartJobResponse)
-async def submit_processing_job(
-    background_tasks: BackgroundTasks,
-    files: List[UploadFile] = File(...),
-    sheet_url: str = Form(""),
-    output_format: str = Form("Both"),
-    google_api_key: str = Form(""),
-    gcp_service_account_json: str = Form(""),
-):
-    if not files:
+async def submit_processing_job(request: Request):
+    # อัปโหลดแบบ streaming ลงดิสก์ทีละ chunk แทนการ read() ทั้งไฟล์เข้าหน่วยความจำ
+    temp_dir = tempfile.mkdtemp(dir=settings.upload_dir)
+    try:
+        fields, file_paths = await stream_multipart_to_dir(
+            request.headers,
+            request.stream(),
+            temp_dir,
+            settings.max_upload_file_bytes,
+            settings.max_upload_request_bytes,
+        )
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if isinstance(e, UploadTooLargeError):
+            raise HTTPException(status_code=413, detail=str(e))
+        if isinstance(e, InvalidUploadError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+
+    sheet_url = fields.get("sheet_url", "")
+    output_format = normalize_output_format(fields.get("output_format"))
+    google_api_key = fields.get("google_api_key", "")
+    gcp_service_account_json = fields.get("gcp_service_account_json", "")
+    bypass_cache = _form_flag(fields.get("bypass_cache", ""))
+
+    if not file_paths:
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=400, detail="No files uploaded")
 
     effective_google_api_key = google_api_key.strip() or get_effective_google_api_key()
     if not effective_google_api_key:
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=400, detail="Missing Google API key")
 
-    effective_gcp_json = (
-        gcp_service_account_json.strip()
-        or get_effective_gcp_service_account_json()
-        or ""
-    )
-
-    temp_dir = tempfile.mkdtemp()
-    file_paths: List[str] = []
-    for upload in files:
-        dest = os.path.join(temp_dir, upload.filename)
-        content = await upload.read()
-        with open(dest, "wb") as f:
-            f.write(content)
-        file_paths.append(dest)
-
     sheet_id = extract_sheet_id_from_url(sheet_url) or settings.default_sheet_id
 
     job_id = str(uuid.uuid4())
-    jobs[job_id] = {
-        "status": "processing",
-        "result": None,
-        "error": None,
-        "output_format": output_format,
-    }
-
-    background_tasks.add_task(
-        background_processing_task,
+    await run_in_threadpool(job_store.create, job_id, output_format, bypass_cache, "queued")
+    await run_in_threadpool(
+        job_queue.enqueue,
         job_id,
-        file_paths,
-        sheet_id,
-        effective_google_api_key,
-        effective_gcp_json,
-        output_format,
+        {
+            "file_paths": file_paths,
+            "sheet_id": sheet_id,
+            "output_format": output_format,
+            "bypass_cache": bypass_cache,
+        },
+        # Only keys sent with this request are queued; the configured ones
+        # are looked up by the worker.
+        {
+            "api_key": google_api_key.strip(),
+            "gcp_json": gcp_service_account_json.strip(),
+        },
     )
+    wake_local_worker()
 
-    return StartJobResponse(job_id=job_id, status="processing")
+    return StartJobResponse(job_id=job_id, status="queued")
 
 
 @router.get("/jobs/{job_id}", response_model=JobStatusResponse)
 def get_job_status(job_id: str):
-    job = jobs.get(job_id)
+    job = job_store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    result = job_store.get_result(job_id) if job["status"] == "completed" else None
     return JobStatusResponse(
         job_id=job_id,
         status=job["status"],
-        result=job.get("result"),
+        result=result,
         error=job.get("error"),
     )
 
 
+def _sse(event: str, data: Dict[str, Any], event_id: int | None = None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    if not await run_in_threadpool(job_store.get, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    last_event_id = request.headers.get("last-event-id", "")
+    after_seq = int(last_event_id) if last_event_id.isdigit() else 0
+
+    async def event_stream():
+        nonlocal after_seq
+        idle_polls = 0
+        while not await request.is_disconnected():
+            # อ่านสถานะก่อน event เพื่อไม่ให้พลาด event สุดท้ายที่เขียนก่อนงานเสร็จ
+            job = await run_in_threadpool(job_store.get, job_id)
+            events = await run_in_threadpool(job_store.events_since, job_id, after_seq)
+            for seq, event, data in events:
+                after_seq = seq
+                yield _sse(event, data, seq)
+            if events:
+                idle_polls = 0
+                continue
+            if job is None or job["status"] in FINISHED_STATUSES:
+                status = job["status"] if job else "failed"
+                yield _sse(status, {"status": status, "error": job.get("error") if job else "Job not found"})
+                return
+            idle_polls += 1
+            if idle_polls % 30 == 0:
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(settings.sse_poll_interval)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/jobs/{job_id}/excel")
-def download_job_excel(job_id: str, background_tasks: BackgroundTasks):
-    job = jobs.get(job_id)
+def download_job_excel(job_id: str, request: Request):
+    job = job_store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
     if job.get("status") != "completed":
         raise HTTPException(status_code=400, detail="Job is not completed yet")
 
-    result = job.get("result") or {}
-    results_list = result.get("results") or []
-
-    excel_path = generate_excel_from_results(results_list)
+    # Normally rendered by the worker when the job completed; otherwise this
+    # renders it once and caches it for later downloads.
+    excel_path, etag = ensure_job_excel(job_id)
 
-    background_tasks.add_task(os.unlink, excel_path)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
 
     filename = f"quotation-comparison-{job_id}.xlsx"
     return FileResponse(
         excel_path,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         filename=filename,
-    )
\ No newline at end of file
+        headers=headers,
+    )
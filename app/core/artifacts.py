@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from .cache import artifact_cache
+from .excel_template import generate_excel_from_plan, generate_excel_from_results
+from .jobs import job_store
+
+# Locks stay in place after a render so a late caller cannot create a second
+# lock for the same key; the least recently used idle ones are dropped past
+# _RENDER_LOCKS_MAX.
+_RENDER_LOCKS_MAX = 256
+_render_locks: "OrderedDict[str, threading.Lock]" = OrderedDict()
+_render_locks_guard = threading.Lock()
+
+
+def excel_artifact_key(job_id: str) -> str:
+    return hashlib.sha256(f"excel:{job_id}".encode("utf-8")).hexdigest()
+
+
+def artifact_etag(job_id: str, path: Path) -> str:
+    stat = path.stat()
+    digest = hashlib.sha256(f"{job_id}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _render_lock(key: str) -> threading.Lock:
+    with _render_locks_guard:
+        lock = _render_locks.get(key)
+        if lock is None:
+            lock = _render_locks[key] = threading.Lock()
+        _render_locks.move_to_end(key)
+        excess = len(_render_locks) - _RENDER_LOCKS_MAX
+        for old_key in list(_render_locks)[: max(excess, 0)]:
+            if not _render_locks[old_key].locked():
+                del _render_locks[old_key]
+        return lock
+
+
+def ensure_job_excel(job_id: str, merge_plan: Dict[str, Any] | None = None) -> Tuple[Path, str]:
+    # Renders the job's workbook at most once per process; later calls (and
+    # downloads) are served from the artifact cache until it is evicted. The
+    # cache is local to the host, so an API host that does not share the
+    # worker's cache directory renders its own copy on first download.
+    key = excel_artifact_key(job_id)
+    path = artifact_cache.get(key)
+    if path is None:
+        lock = _render_lock(key)
+        with lock:
+            path = artifact_cache.get(key)
+            if path is None:
+                # Replaying the recorded merge plan needs no Gemini calls and
+                # matches the Google Sheet layout; jobs without a plan fall
+                # back to re-running the merge. The worker passes the plan in
+                # directly because the job is not stored as completed yet.
+                if merge_plan is None:
+                    merge_plan = job_store.get_merge_plan(job_id)
+                if merge_plan is not None:
+                    rendered = generate_excel_from_plan(merge_plan)
+                else:
+                    result = job_store.get_result(job_id) or {}
+                    rendered = generate_excel_from_results(result.get("results") or [])
+                try:
+                    path = artifact_cache.put_file(key, rendered)
+                finally:
+                    if os.path.exists(rendered):
+                        os.unlink(rendered)
+    return path, artifact_etag(job_id, path)
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from .config import settings
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_extraction_key(
+    file_digest: str,
+    prompt_text: str,
+    model_name: str,
+    response_schema: Dict[str, Any] | None = None,
+) -> str:
+    # Structured output changes what the model returns, so the schema (or
+    # its absence, for free-text answers) is part of the key.
+    schema = json.dumps(response_schema, sort_keys=True) if response_schema is not None else "text"
+    digest = hashlib.sha256()
+    for part in (file_digest, model_name, prompt_text, schema):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+_EXTRACTION_SWEEP_SECONDS = 3600.0
+
+
+# One JSON file per key. Entries expire max_age_seconds after they were
+# written; past max_bytes the least recently read entries go first. evict()
+# walks the whole directory, so put() only calls it when a running estimate
+# of the cache size goes over max_bytes, or once per sweep interval to clear
+# out expired entries. The estimate starts from the first sweep and is only
+# corrected by the next one.
+class ExtractionCache:
+    def __init__(self, cache_dir: str, max_bytes: int, max_age_seconds: int, enabled: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._estimated_bytes: int | None = None
+        self._last_sweep = 0.0
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.max_age_seconds > 0 and now - created_at > self.max_age_seconds
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        if not self.enabled:
+            return None
+        path = self._path_for(key)
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            _remove_quietly(path)
+            return None
+
+        if self._is_expired(payload.get("created_at", 0), time.time()):
+            _remove_quietly(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return payload.get("data")
+
+    def put(self, key: str, data: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        body = json.dumps({"created_at": time.time(), "data": data}, ensure_ascii=False).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += len(body) - replaced
+            due = (
+                self._estimated_bytes is None
+                or (self.max_bytes > 0 and self._estimated_bytes > self.max_bytes)
+                or time.time() - self._last_sweep >= _EXTRACTION_SWEEP_SECONDS
+            )
+        if due:
+            self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            now = time.time()
+            entries: List[Tuple[float, int, Path]] = []
+            for path in self.cache_dir.glob("*/*.json"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                # mtime is bumped on every read, ctime only approximates the
+                # write time, so the age check trusts the stored created_at.
+                if self.max_age_seconds > 0 and now - stat.st_mtime > self.max_age_seconds:
+                    try:
+                        created_at = json.loads(path.read_text(encoding="utf-8")).get("created_at", 0)
+                    except (OSError, ValueError):
+                        created_at = 0
+                    if self._is_expired(created_at, now):
+                        _remove_quietly(path)
+                        continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if self.max_bytes > 0 and total > self.max_bytes:
+                entries.sort(key=lambda e: e[0])
+                for _, size, path in entries:
+                    if total <= self.max_bytes:
+                        break
+                    _remove_quietly(path)
+                    total -= size
+            self._estimated_bytes = total
+            self._last_sweep = now
+
+
+# Rendered files (e.g. the job's xlsx), one per key. A file's mtime is its
+# creation time and its atime is set explicitly on every read, so expiry
+# counts from creation while size eviction drops the least recently read
+# files first, independent of how the filesystem is mounted.
+class ArtifactCache:
+    def __init__(self, cache_dir: str, max_bytes: int, max_age_seconds: int, suffix: str = ""):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.suffix = suffix
+        self._lock = threading.Lock()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _is_expired(self, stat: os.stat_result, now: float) -> bool:
+        return self.max_age_seconds > 0 and now - stat.st_mtime > self.max_age_seconds
+
+    def get(self, key: str) -> Path | None:
+        path = self._path_for(key)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if self._is_expired(stat, now):
+            _remove_quietly(path)
+            return None
+        try:
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+        return path
+
+    def put_file(self, key: str, src_path: str) -> Path:
+        # Takes ownership of src_path; it is moved (or copied) into the cache.
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.move(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove_quietly(Path(tmp_path))
+            raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Path | None = None) -> None:
+        with self._lock:
+            now = time.time()
+            entries: List[Tuple[float, int, Path]] = []
+            for path in self.cache_dir.glob(f"*/*{self.suffix}"):
+                if path.suffix == ".tmp":
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if self._is_expired(stat, now):
+                    _remove_quietly(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if self.max_bytes <= 0 or total <= self.max_bytes:
+                return
+            entries.sort(key=lambda e: e[0])
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                _remove_quietly(path)
+                total -= size
+
+
+def _remove_quietly(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+artifact_cache = ArtifactCache(
+    cache_dir=settings.artifact_cache_dir,
+    max_bytes=settings.artifact_cache_max_bytes,
+    max_age_seconds=settings.artifact_cache_max_age_seconds,
+    suffix=".xlsx",
+)
+
+extraction_cache = ExtractionCache(
+    cache_dir=settings.extraction_cache_dir,
+    max_bytes=settings.extraction_cache_max_bytes,
+    max_age_seconds=settings.extraction_cache_max_age_seconds,
+    enabled=settings.extraction_cache_enabled,
+)
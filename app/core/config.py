@@ -39,6 +39,266 @@ class Settings(BaseSettings):
         alias="EXCEL_TEMPLATE_PATH",
     )
 
+    upload_dir: Optional[str] = Field(
+        default=None,
+        alias="UPLOAD_DIR",
+    )
+
+    max_upload_file_bytes: int = Field(
+        default=50 * 1024 * 1024,
+        alias="MAX_UPLOAD_FILE_BYTES",
+    )
+
+    max_upload_request_bytes: int = Field(
+        default=500 * 1024 * 1024,
+        alias="MAX_UPLOAD_REQUEST_BYTES",
+    )
+
+    extraction_engine: str = Field(
+        default="async",
+        alias="EXTRACTION_ENGINE",
+    )
+
+    extraction_concurrency: int = Field(
+        default=32,
+        alias="EXTRACTION_CONCURRENCY",
+    )
+
+    gemini_rpm_per_key: int = Field(
+        default=150,
+        alias="GEMINI_RPM_PER_KEY",
+    )
+
+    gemini_tpm_per_key: int = Field(
+        default=1_000_000,
+        alias="GEMINI_TPM_PER_KEY",
+    )
+
+    scheduler_tokens_per_file: int = Field(
+        default=8_000,
+        alias="SCHEDULER_TOKENS_PER_FILE",
+    )
+
+    adaptive_initial_concurrency: int = Field(
+        default=8,
+        alias="ADAPTIVE_INITIAL_CONCURRENCY",
+    )
+
+    adaptive_min_concurrency: int = Field(
+        default=1,
+        alias="ADAPTIVE_MIN_CONCURRENCY",
+    )
+
+    gemini_retry_attempts: int = Field(
+        default=5,
+        alias="GEMINI_RETRY_ATTEMPTS",
+    )
+
+    gemini_retry_base_delay: float = Field(
+        default=1.0,
+        alias="GEMINI_RETRY_BASE_DELAY",
+    )
+
+    gemini_retry_max_delay: float = Field(
+        default=60.0,
+        alias="GEMINI_RETRY_MAX_DELAY",
+    )
+
+    gemini_structured_output: bool = Field(
+        default=True,
+        alias="GEMINI_STRUCTURED_OUTPUT",
+    )
+
+    inline_file_max_bytes: int = Field(
+        default=4 * 1024 * 1024,
+        alias="INLINE_FILE_MAX_BYTES",
+    )
+
+    file_active_timeout_seconds: float = Field(
+        default=180.0,
+        alias="FILE_ACTIVE_TIMEOUT_SECONDS",
+    )
+
+    job_db_path: str = Field(
+        default=".cache/jobs.sqlite3",
+        alias="JOB_DB_PATH",
+    )
+
+    job_ttl_seconds: int = Field(
+        default=7 * 24 * 60 * 60,
+        alias="JOB_TTL_SECONDS",
+    )
+
+    job_max_count: int = Field(
+        default=1000,
+        alias="JOB_MAX_COUNT",
+    )
+
+    job_queue_path: str = Field(
+        default=".cache/queue.sqlite3",
+        alias="JOB_QUEUE_PATH",
+    )
+
+    job_lease_seconds: float = Field(
+        default=60.0,
+        alias="JOB_LEASE_SECONDS",
+    )
+
+    job_max_attempts: int = Field(
+        default=3,
+        alias="JOB_MAX_ATTEMPTS",
+    )
+
+    embedded_worker: bool = Field(
+        default=True,
+        alias="EMBEDDED_WORKER",
+    )
+
+    worker_job_concurrency: int = Field(
+        default=4,
+        alias="WORKER_JOB_CONCURRENCY",
+    )
+
+    worker_poll_interval: float = Field(
+        default=1.0,
+        alias="WORKER_POLL_INTERVAL",
+    )
+
+    sse_poll_interval: float = Field(
+        default=0.5,
+        alias="SSE_POLL_INTERVAL",
+    )
+
+    gspread_handle_ttl_seconds: float = Field(
+        default=300.0,
+        alias="GSPREAD_HANDLE_TTL_SECONDS",
+    )
+
+    gspread_token_refresh_margin_seconds: float = Field(
+        default=300.0,
+        alias="GSPREAD_TOKEN_REFRESH_MARGIN_SECONDS",
+    )
+
+    gspread_client_idle_seconds: float = Field(
+        default=60 * 60,
+        alias="GSPREAD_CLIENT_IDLE_SECONDS",
+    )
+
+    sheet_lock_lease_seconds: float = Field(
+        default=60.0,
+        alias="SHEET_LOCK_LEASE_SECONDS",
+    )
+
+    sheet_lock_poll_interval: float = Field(
+        default=1.0,
+        alias="SHEET_LOCK_POLL_INTERVAL",
+    )
+
+    sheet_checkpoint_files: int = Field(
+        default=0,
+        alias="SHEET_CHECKPOINT_FILES",
+    )
+
+    excel_streaming_min_cells: int = Field(
+        default=250_000,
+        alias="EXCEL_STREAMING_MIN_CELLS",
+    )
+
+    artifact_cache_dir: str = Field(
+        default=".cache/artifacts",
+        alias="ARTIFACT_CACHE_DIR",
+    )
+
+    artifact_cache_max_bytes: int = Field(
+        default=1024 * 1024 * 1024,
+        alias="ARTIFACT_CACHE_MAX_BYTES",
+    )
+
+    artifact_cache_max_age_seconds: int = Field(
+        default=7 * 24 * 60 * 60,
+        alias="ARTIFACT_CACHE_MAX_AGE_SECONDS",
+    )
+
+    local_match_enabled: bool = Field(
+        default=True,
+        alias="LOCAL_MATCH_ENABLED",
+    )
+
+    local_match_accept_score: float = Field(
+        default=0.9,
+        alias="LOCAL_MATCH_ACCEPT_SCORE",
+    )
+
+    local_match_reject_score: float = Field(
+        default=0.2,
+        alias="LOCAL_MATCH_REJECT_SCORE",
+    )
+
+    local_match_margin: float = Field(
+        default=0.05,
+        alias="LOCAL_MATCH_MARGIN",
+    )
+
+    match_partition_max_tokens: int = Field(
+        default=24_000,
+        alias="MATCH_PARTITION_MAX_TOKENS",
+    )
+
+    match_partition_max_targets: int = Field(
+        default=60,
+        alias="MATCH_PARTITION_MAX_TARGETS",
+    )
+
+    match_partition_concurrency: int = Field(
+        default=4,
+        alias="MATCH_PARTITION_CONCURRENCY",
+    )
+
+    match_mode: str = Field(
+        default="job",
+        alias="MATCH_MODE",
+    )
+
+    match_job_concurrency: int = Field(
+        default=8,
+        alias="MATCH_JOB_CONCURRENCY",
+    )
+
+    match_memo_enabled: bool = Field(
+        default=True,
+        alias="MATCH_MEMO_ENABLED",
+    )
+
+    match_memo_path: str = Field(
+        default=".cache/match_memo.sqlite3",
+        alias="MATCH_MEMO_PATH",
+    )
+
+    match_memo_max_entries: int = Field(
+        default=50_000,
+        alias="MATCH_MEMO_MAX_ENTRIES",
+    )
+
+    extraction_cache_enabled: bool = Field(
+        default=True,
+        alias="EXTRACTION_CACHE_ENABLED",
+    )
+
+    extraction_cache_dir: str = Field(
+        default=".cache/extractions",
+        alias="EXTRACTION_CACHE_DIR",
+    )
+
+    extraction_cache_max_bytes: int = Field(
+        default=256 * 1024 * 1024,
+        alias="EXTRACTION_CACHE_MAX_BYTES",
+    )
+
+    extraction_cache_max_age_seconds: int = Field(
+        default=30 * 24 * 60 * 60,
+        alias="EXTRACTION_CACHE_MAX_AGE_SECONDS",
+    )
+
     model_config = SettingsConfigDict(
         extra="ignore",
         populate_by_name=True,
@@ -3,68 +3,178 @@ from __future__ import annotations
 
 import os
 import tempfile
+import threading
+from copy import copy
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Tuple
 
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import MergedCell, WriteOnlyCell
+from openpyxl.utils.cell import range_boundaries
+
+from .config import settings
 
 from .processing import (
-    COMPANY_NAME_ROW,
-    CONTACT_INFO_ROW,
     HEADER_ROW,
     ITEM_MASTER_LIST_COL,
-    COLUMNS_PER_SUPPLIER,
-    SUMMARY_LABELS,
+    read_sheet_state,
     update_google_sheet_for_single_file,
 )
+from .sheet_mirror import MergePlan
+
+_template_cache: Dict[str, Tuple[float, bytes, List[List[str]]]] = {}
+_layout_cache: Dict[str, Tuple[float, "_TemplateLayout"]] = {}
+_template_lock = threading.Lock()
+
+_STYLE_ATTRS = ("font", "fill", "border", "alignment", "number_format", "protection")
+
+
+def _load_template(template_path: Path) -> Tuple[bytes, List[List[str]]]:
+    # The template file is read and its values parsed once per mtime; every
+    # export then opens its own workbook from the cached bytes.
+    key = str(template_path)
+    mtime = template_path.stat().st_mtime
+    with _template_lock:
+        cached = _template_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+    data = template_path.read_bytes()
+    wb = load_workbook(BytesIO(data), read_only=True)
+    try:
+        values = [["" if v is None else str(v) for v in row] for row in wb.active.iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+    with _template_lock:
+        _template_cache[key] = (mtime, data, values)
+    return data, values
+
+
+def _cell_style(cell) -> Dict[str, Any] | None:
+    if not cell.has_style:
+        return None
+    return {attr: copy(getattr(cell, attr)) for attr in _STYLE_ATTRS}
+
+
+# What the streaming exporter keeps from the template: raw values, the style
+# of every template cell, column widths and the merged ranges inside the
+# header. Parsed once per template mtime. Cells are keyed by their style
+# array, so each distinct style is copied once and rows styled alike share
+# one list of keys.
+class _TemplateLayout:
+    def __init__(self, wb):
+        ws = wb.active
+        self.title = ws.title
+        self.freeze_panes = ws.freeze_panes
+        self.column_widths = {
+            letter: dim.width for letter, dim in ws.column_dimensions.items() if dim.width
+        }
+        self.merged_ranges = [str(r) for r in ws.merged_cells.ranges if r.max_row <= HEADER_ROW]
+        self.covered_cells = {
+            (row, col)
+            for r in ws.merged_cells.ranges
+            if r.max_row <= HEADER_ROW
+            for row, col in r.cells
+            if (row, col) != (r.min_row, r.min_col)
+        }
+        self.values = [list(row) for row in ws.iter_rows(values_only=True)]
+        while self.values and all(v is None or str(v).strip() == "" for v in self.values[-1]):
+            self.values.pop()
+        self.styles: Dict[Tuple[int, ...], Dict[str, Any]] = {}
+        self.row_styles: List[Tuple[Tuple[int, ...] | None, ...]] = []
+        shared_rows: Dict[Tuple[Tuple[int, ...] | None, ...], Tuple[Tuple[int, ...] | None, ...]] = {}
+        for row in ws.iter_rows():
+            keys: List[Tuple[int, ...] | None] = []
+            for cell in row:
+                if not cell.has_style:
+                    keys.append(None)
+                    continue
+                key = tuple(cell._style)
+                if key not in self.styles:
+                    self.styles[key] = _cell_style(cell)
+                keys.append(key)
+            row_keys = tuple(keys)
+            self.row_styles.append(shared_rows.setdefault(row_keys, row_keys))
+
+    def style_key(self, origin: int | None, col: int) -> Tuple[int, ...] | None:
+        # Rows inserted by the merge (origin None) are unstyled, as openpyxl's
+        # insert_rows leaves them in the non-streaming exporter.
+        if origin is None or origin > len(self.row_styles):
+            return None
+        keys = self.row_styles[origin - 1]
+        return keys[col - 1] if col <= len(keys) else None
+
 
+def _load_template_layout(template_path: Path, template_bytes: bytes) -> _TemplateLayout:
+    key = str(template_path)
+    mtime = template_path.stat().st_mtime
+    with _template_lock:
+        cached = _layout_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    layout = _TemplateLayout(load_workbook(BytesIO(template_bytes)))
+
+    with _template_lock:
+        _layout_cache[key] = (mtime, layout)
+    return layout
+
+
+def template_bootstrap_values() -> List[List[str]]:
+    # Same shape as read_bootstrap_values gives for a Google Sheet: the header
+    # rows in full, then only the item-name column.
+    _, values = _load_template(_resolve_template_path())
+    bootstrap = [list(row) for row in values[:HEADER_ROW]]
+    for row in values[HEADER_ROW:]:
+        name = row[ITEM_MASTER_LIST_COL - 1] if len(row) >= ITEM_MASTER_LIST_COL else ""
+        bootstrap.append([""] * (ITEM_MASTER_LIST_COL - 1) + [name] if str(name).strip() else [])
+    while len(bootstrap) > HEADER_ROW and not bootstrap[-1]:
+        bootstrap.pop()
+    return bootstrap
+
+
+# Presents an openpyxl worksheet through the gspread calls used by
+# update_google_sheet_for_single_file. Inserts and writes only touch a local
+# grid; apply() then shifts the template rows with one insert_rows call per
+# distinct insertion point (normally just one) and writes every cell from the
+# accumulated cell map.
 class ExcelWorksheetAdapter:
-    def __init__(self, ws):
+    def __init__(self, ws, values: List[List[str]] | None = None):
+        # ws may be None when the final layout is streamed out with
+        # iter_layout() instead of being applied to a loaded workbook.
         self.ws = ws
+        if values is None:
+            values = [["" if v is None else str(v) for v in row] for row in ws.iter_rows(values_only=True)]
+        self._values: List[List[Any]] = [list(row) for row in values]
+        self._origin: List[int | None] = list(range(1, len(self._values) + 1))
+        self._writes: List[Dict[int, Any] | None] = [None] * len(self._values)
+        self._col_count = ws.max_column if ws is not None else max((len(row) for row in values), default=0)
 
     @property
     def col_count(self) -> int:
-        return self.ws.max_column
-
-    def get_all_values(self) -> List[List[str]]:
-        max_row = self.ws.max_row
-        max_col = self.ws.max_column
-        values: List[List[str]] = []
-        for r in range(1, max_row + 1):
-            row_vals: List[str] = []
-            for c in range(1, max_col + 1):
-                v = self.ws.cell(row=r, column=c).value
-                row_vals.append("" if v is None else str(v))
-            values.append(row_vals)
-        return values
+        return self._col_count
+
+    def get_all_values(self) -> List[List[Any]]:
+        end = len(self._values)
+        while end and not any(str(c).strip() for c in self._values[end - 1]):
+            end -= 1
+        return self._values[:end]
 
     def insert_rows(self, rows: List[List[Any]], row_index: int) -> None:
         count = len(rows)
-        for i in range(count):
-            self.ws.insert_rows(row_index + i)
+        at = row_index - 1
+        if count <= 0 or at >= len(self._values):
+            return
+        self._values[at:at] = [[] for _ in range(count)]
+        self._origin[at:at] = [None] * count
+        self._writes[at:at] = [None] * count
 
     def batch_update(self, batch_requests: List[Dict[str, Any]], value_input_option: str = "USER_ENTERED") -> None:
         for req in batch_requests:
-            rng = req["range"]
-            vals = req["values"]
-            if ":" in rng:
-                start_ref, end_ref = rng.split(":")
-            else:
-                start_ref = rng
-                end_ref = rng
-
-            start_col_letters = "".join(ch for ch in start_ref if ch.isalpha())
-            start_row_digits = "".join(ch for ch in start_ref if ch.isdigit())
-            end_col_letters = "".join(ch for ch in end_ref if ch.isalpha())
-            end_row_digits = "".join(ch for ch in end_ref if ch.isdigit())
-
-            start_col = column_index_from_string(start_col_letters)
-            start_row = int(start_row_digits)
-            end_col = column_index_from_string(end_col_letters)
-            end_row = int(end_row_digits)
-
-            for r_offset, row_vals in enumerate(vals):
+            start_col, start_row, end_col, end_row = range_boundaries(req["range"])
+            for r_offset, row_vals in enumerate(req["values"]):
                 row_idx = start_row + r_offset
                 if row_idx > end_row:
                     break
@@ -72,7 +182,50 @@ class ExcelWorksheetAdapter:
                     col_idx = start_col + c_offset
                     if col_idx > end_col:
                         break
-                    self.ws.cell(row=row_idx, column=col_idx).value = value
+                    self._set(row_idx, col_idx, value)
+
+    def _set(self, row: int, col: int, value: Any) -> None:
+        while len(self._values) < row:
+            self._values.append([])
+            self._origin.append(None)
+            self._writes.append(None)
+        grid_row = self._values[row - 1]
+        while len(grid_row) < col:
+            grid_row.append("")
+        grid_row[col - 1] = "" if value is None else value
+        written = self._writes[row - 1]
+        if written is None:
+            written = self._writes[row - 1] = {}
+        written[col] = value
+        self._col_count = max(self._col_count, col)
+
+    def iter_layout(self) -> Iterator[Tuple[int, int | None, Dict[int, Any]]]:
+        # (final row, template row it came from or None, cells written to it)
+        for row, (origin, written) in enumerate(zip(self._origin, self._writes), start=1):
+            yield row, origin, written or {}
+
+    def apply(self) -> None:
+        # Every template row keeps its order, so its final position only
+        # differs from the original by the rows inserted above it. Each step
+        # up in that offset is one insertion point in template coordinates.
+        insertions: List[Tuple[int, int]] = []
+        shift = 0
+        for final_row, origin in enumerate(self._origin, start=1):
+            if origin is None:
+                continue
+            if final_row - origin > shift:
+                insertions.append((origin, final_row - origin - shift))
+                shift = final_row - origin
+        for origin, amount in reversed(insertions):
+            self.ws.insert_rows(idx=origin, amount=amount)
+
+        for row, written in enumerate(self._writes, start=1):
+            if written:
+                for col, value in written.items():
+                    cell = self.ws.cell(row=row, column=col)
+                    # Covered cells of a merged range are read-only in openpyxl.
+                    if not isinstance(cell, MergedCell):
+                        cell.value = value
 
 def _resolve_template_path() -> Path:
     base_dir = Path(__file__).resolve().parent.parent
@@ -89,35 +242,120 @@ def _resolve_template_path() -> Path:
             return path
     return root_dir / "temp.xlsx"
 
-def generate_excel_from_results(results: List[Dict[str, Any]]) -> str:
-    template_path = _resolve_template_path()
-    wb = load_workbook(template_path)
+def generate_excel_from_results(results: List[Dict[str, Any]], api_key: str | None = None) -> str:
+    template_bytes, template_values = _load_template(_resolve_template_path())
+    wb = load_workbook(BytesIO(template_bytes))
     ws = wb.active
-    adapter = ExcelWorksheetAdapter(ws)
-
-    initial_sheet_values = adapter.get_all_values()
+    adapter = ExcelWorksheetAdapter(ws, template_values)
 
-    live_existing_products: List[Dict[str, Any]] = []
-    for row_idx, row in enumerate(initial_sheet_values[HEADER_ROW:], start=HEADER_ROW + 1):
-        if len(row) >= ITEM_MASTER_LIST_COL:
-            name = row[ITEM_MASTER_LIST_COL - 1].strip()
-            if name and name not in SUMMARY_LABELS:
-                live_existing_products.append({"name": name, "row": row_idx})
-
-    live_existing_suppliers: Dict[str, int] = {}
-    header_row_values = initial_sheet_values[COMPANY_NAME_ROW - 1] if initial_sheet_values else []
-    for col_idx in range(ITEM_MASTER_LIST_COL + 1, len(header_row_values) + 1, COLUMNS_PER_SUPPLIER):
-        supplier_name = header_row_values[col_idx - 1].strip() if (col_idx - 1) < len(header_row_values) else ""
-        if supplier_name:
-            live_existing_suppliers[supplier_name] = col_idx
+    product_index, live_existing_suppliers = read_sheet_state(adapter.get_all_values())
 
     for data in results:
         if data:
-            live_existing_products, live_existing_suppliers = update_google_sheet_for_single_file(
-                adapter, data, live_existing_products, live_existing_suppliers
+            product_index, live_existing_suppliers = update_google_sheet_for_single_file(
+                adapter, data, product_index, live_existing_suppliers, api_key=api_key
             )
 
+    adapter.apply()
+
+    fd, output_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    wb.save(output_path)
+    return output_path
+
+def _plan_cell_count(merge_plan: Dict[str, Any]) -> int:
+    return sum(
+        len(row_vals)
+        for step in merge_plan.get("steps") or []
+        if step[0] == "write"
+        for row_vals in step[3]
+    )
+
+
+def generate_excel_from_plan(merge_plan: Dict[str, Any]) -> str:
+    threshold = settings.excel_streaming_min_cells
+    if threshold > 0 and _plan_cell_count(merge_plan) >= threshold:
+        return generate_excel_streaming_from_plan(merge_plan)
+
+    template_bytes, template_values = _load_template(_resolve_template_path())
+    wb = load_workbook(BytesIO(template_bytes))
+    ws = wb.active
+    adapter = ExcelWorksheetAdapter(ws, template_values)
+
+    MergePlan.from_dict(merge_plan).replay(adapter)
+    adapter.apply()
+
+    fd, output_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    wb.save(output_path)
+    return output_path
+
+
+def generate_excel_streaming_from_plan(merge_plan: Dict[str, Any]) -> str:
+    # Builds the layout on a workbook-less adapter and streams it row by row
+    # through a write_only workbook, so no openpyxl cell objects are kept for
+    # the body. Empty template rows past the last value are not copied.
+    template_path = _resolve_template_path()
+    template_bytes, template_values = _load_template(template_path)
+    layout = _load_template_layout(template_path, template_bytes)
+    adapter = ExcelWorksheetAdapter(None, template_values)
+    MergePlan.from_dict(merge_plan).replay(adapter)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=layout.title)
+    for letter, width in layout.column_widths.items():
+        ws.column_dimensions[letter].width = width
+    if layout.freeze_panes:
+        ws.freeze_panes = layout.freeze_panes
+    for merged in layout.merged_ranges:
+        ws.merged_cells.add(merged)
+
+    # Every row takes the styles of the template row it came from. Registering
+    # a style in the workbook is costly, so do it once per distinct template
+    # style and hand each cell a copy of the resulting style array.
+    style_arrays: Dict[Tuple[int, ...], Any] = {}
+
+    def style_for(origin: int | None, col: int) -> Any:
+        key = layout.style_key(origin, col)
+        if key is None:
+            return None
+        if key not in style_arrays:
+            prototype = WriteOnlyCell(ws)
+            for attr, style_value in layout.styles[key].items():
+                setattr(prototype, attr, style_value)
+            style_arrays[key] = prototype._style
+        return style_arrays[key]
+
+    def template_row(origin: int | None) -> List[Any]:
+        return layout.values[origin - 1] if origin is not None and origin <= len(layout.values) else []
+
+    rows = list(adapter.iter_layout())
+    last_row = HEADER_ROW
+    for row, origin, written in rows:
+        if written or any(v is not None and str(v).strip() for v in template_row(origin)):
+            last_row = max(last_row, row)
+
+    for row, origin, written in rows[:last_row]:
+        base = template_row(origin)
+        header_width = len(layout.row_styles[row - 1]) if row <= min(HEADER_ROW, len(layout.row_styles)) else 0
+        width = max(len(base), max(written, default=0), header_width)
+        cells: List[Any] = []
+        for col in range(1, width + 1):
+            value = written[col] if col in written else (base[col - 1] if col <= len(base) else None)
+            if (row, col) in layout.covered_cells:
+                value = None
+            style_array = style_for(origin, col)
+            if style_array is None:
+                cells.append(value)
+                continue
+            cell = WriteOnlyCell(ws, value=value)
+            cell._style = copy(style_array)
+            cells.append(cell)
+        ws.append(cells)
+    for _ in range(last_row - len(rows)):
+        ws.append([])
+
     fd, output_path = tempfile.mkstemp(suffix=".xlsx")
     os.close(fd)
     wb.save(output_path)
-    return output_path
\ No newline at end of file
+    return output_path
@@ -1,21 +1,126 @@
+import hashlib
 import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Tuple
 
 import gspread
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 
+from .config import settings
+
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive.file",
 ]
 
+
+class _PooledClient:
+    def __init__(self, client: gspread.Client, creds: Credentials):
+        self.client = client
+        self.creds = creds
+        self.last_used = time.monotonic()
+
+
+# One authorized gspread client per service account (keyed by a hash of its
+# JSON), so jobs reuse the same HTTP session and OAuth token. A daemon thread
+# refreshes tokens shortly before they expire, keeping the refresh off the
+# request path. Opened worksheets are cached for handle_ttl_seconds to skip
+# the spreadsheet metadata fetch on back-to-back jobs.
+class GspreadClientPool:
+    def __init__(self, handle_ttl_seconds: float, refresh_margin_seconds: float, idle_seconds: float):
+        self.handle_ttl_seconds = handle_ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.idle_seconds = idle_seconds
+        self._clients: Dict[str, _PooledClient] = {}
+        self._worksheets: Dict[Tuple[str, str], Tuple[gspread.Worksheet, float]] = {}
+        self._lock = threading.Lock()
+        self._refresher: threading.Thread | None = None
+
+    @staticmethod
+    def _key(service_account_json: str) -> str:
+        return hashlib.sha256(service_account_json.encode("utf-8")).hexdigest()
+
+    def client(self, service_account_json: str) -> gspread.Client:
+        key = self._key(service_account_json)
+        with self._lock:
+            pooled = self._clients.get(key)
+            if pooled is None:
+                info = json.loads(service_account_json)
+                creds = Credentials.from_service_account_info(info, scopes=SCOPES)
+                pooled = _PooledClient(gspread.authorize(creds), creds)
+                self._clients[key] = pooled
+            pooled.last_used = time.monotonic()
+            self._ensure_refresher()
+            return pooled.client
+
+    def worksheet(self, sheet_id: str, service_account_json: str) -> gspread.Worksheet:
+        cache_key = (self._key(service_account_json), sheet_id)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._worksheets.get(cache_key)
+            if cached is not None and cached[1] > now:
+                return cached[0]
+        ws = self.client(service_account_json).open_by_key(sheet_id).get_worksheet(0)
+        with self._lock:
+            self._worksheets[cache_key] = (ws, now + self.handle_ttl_seconds)
+        return ws
+
+    def replace(self, sheet_id: str, service_account_json: str, ws: gspread.Worksheet) -> None:
+        with self._lock:
+            self._worksheets[(self._key(service_account_json), sheet_id)] = (
+                ws,
+                time.monotonic() + self.handle_ttl_seconds,
+            )
+
+    def invalidate(self, sheet_id: str, service_account_json: str) -> None:
+        with self._lock:
+            self._worksheets.pop((self._key(service_account_json), sheet_id), None)
+
+    def _ensure_refresher(self) -> None:
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_forever, name="gspread-token-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_forever(self) -> None:
+        interval = max(5.0, min(60.0, self.refresh_margin_seconds / 2))
+        while True:
+            time.sleep(interval)
+            self._maintain()
+
+    def _maintain(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._worksheets = {k: v for k, v in self._worksheets.items() if v[1] > now}
+            idle = [k for k, p in self._clients.items() if now - p.last_used > self.idle_seconds]
+            for key in idle:
+                del self._clients[key]
+                self._worksheets = {k: v for k, v in self._worksheets.items() if k[0] != key}
+            pooled = list(self._clients.values())
+
+        # Credentials.expiry is a naive UTC datetime.
+        utc_now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for p in pooled:
+            expiry = p.creds.expiry
+            if p.creds.token and expiry and (expiry - utc_now).total_seconds() > self.refresh_margin_seconds:
+                continue
+            try:
+                p.creds.refresh(Request())
+            except Exception:
+                # The session refreshes on demand if this attempt failed.
+                pass
+
+
+gspread_pool = GspreadClientPool(
+    handle_ttl_seconds=settings.gspread_handle_ttl_seconds,
+    refresh_margin_seconds=settings.gspread_token_refresh_margin_seconds,
+    idle_seconds=settings.gspread_client_idle_seconds,
+)
+
 def get_gspread_client(service_account_json: str) -> gspread.Client:
-    info = json.loads(service_account_json)
-    creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    return client
+    return gspread_pool.client(service_account_json)
 
 def authenticate_and_open_sheet(sheet_id: str, service_account_json: str):
-    client = get_gspread_client(service_account_json)
-    key = sheet_id
-    sh = client.open_by_key(key)
-    return sh.get_worksheet(0)
\ No newline at end of file
+    return gspread_pool.worksheet(sheet_id, service_account_json)
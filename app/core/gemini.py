@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import json
+import mimetypes
+import pathlib
+import threading
+from typing import Any, Dict, Tuple
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai import protos
+from google.generativeai.types import file_types
+
+from .config import get_effective_google_api_key
+from .ratelimit import api_key_id
+
+
+# Everything the app needs from Gemini for one API key. The SDK's module-level
+# helpers (genai.configure, genai.upload_file, GenerativeModel's default
+# client) all share one global configuration, so concurrent jobs with
+# different keys would overwrite each other's credentials. Each key gets its
+# own _ClientManager instead, and its transports and models are reused
+# across calls. _ClientManager and GenerativeModel._client/_async_client are
+# SDK internals, so requirements.txt pins the SDK version and
+# tests/test_gemini_clients.py checks them.
+class GeminiKeyClients:
+    def __init__(self, api_key: str):
+        self._manager = genai_client._ClientManager()
+        self._manager.configure(api_key=api_key)
+        self._models: Dict[Tuple[str, str, bool], genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, name: str) -> Any:
+        with self._lock:
+            return self._manager.get_default_client(name)
+
+    def model(
+        self,
+        model_name: str,
+        generation_config: Dict[str, Any],
+        safety_settings: Any,
+        use_async: bool = False,
+    ) -> genai.GenerativeModel:
+        # The async client binds to the event loop it is first used on, so
+        # async models should only be requested from the scheduler loop.
+        cache_key = (model_name, json.dumps([generation_config, safety_settings], sort_keys=True, default=str), use_async)
+        with self._lock:
+            model = self._models.get(cache_key)
+            if model is not None:
+                return model
+        model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            safety_settings=safety_settings,
+        )
+        if use_async:
+            model._async_client = self._client("generative_async")
+        else:
+            model._client = self._client("generative")
+        with self._lock:
+            return self._models.setdefault(cache_key, model)
+
+    def upload_file(self, path: str, display_name: str | None = None) -> file_types.File:
+        file_path = pathlib.Path(path)
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if mime_type is None:
+            raise ValueError(f"Could not determine the mime type of {file_path.name}")
+        response = self._client("file").create_file(
+            path=file_path,
+            mime_type=mime_type,
+            name=None,
+            display_name=display_name or file_path.name,
+            resumable=True,
+        )
+        return file_types.File(response)
+
+    def get_file(self, name: str) -> file_types.File:
+        if "/" not in name:
+            name = f"files/{name}"
+        return file_types.File(self._client("file").get_file(name=name))
+
+    def delete_file(self, name: str) -> None:
+        if "/" not in name:
+            name = f"files/{name}"
+        self._client("file").delete_file(request=protos.DeleteFileRequest(name=name))
+
+
+class GeminiClientRegistry:
+    def __init__(self):
+        self._clients: Dict[str, GeminiKeyClients] = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str | None = None) -> GeminiKeyClients:
+        api_key = api_key or get_effective_google_api_key() or ""
+        key_id = api_key_id(api_key)
+        with self._lock:
+            clients = self._clients.get(key_id)
+            if clients is None:
+                clients = GeminiKeyClients(api_key)
+                self._clients[key_id] = clients
+            return clients
+
+
+gemini_clients = GeminiClientRegistry()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import os
+from typing import AsyncIterator, BinaryIO, Dict, List, Mapping, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+FILE_FIELD_NAME = "files"
+MAX_FIELD_BYTES = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class InvalidUploadError(ValueError):
+    pass
+
+
+def _safe_filename(raw_name: str, index: int) -> str:
+    name = os.path.basename(raw_name.replace("\\", "/")).strip()
+    if not name or name in (".", ".."):
+        name = f"upload-{index}"
+    return name
+
+
+def _unique_path(dest_dir: str, file_name: str) -> str:
+    path = os.path.join(dest_dir, file_name)
+    stem, ext = os.path.splitext(file_name)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(dest_dir, f"{stem}-{n}{ext}")
+        n += 1
+    return path
+
+
+class _StreamingFormWriter:
+    def __init__(self, dest_dir: str, charset: str, max_file_bytes: int, max_request_bytes: int):
+        self.dest_dir = dest_dir
+        self.charset = charset
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.fields: Dict[str, str] = {}
+        self.file_paths: List[str] = []
+        self.total_file_bytes = 0
+
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._field_name = ""
+        self._field_data = bytearray()
+        self._file: BinaryIO | None = None
+        self._file_bytes = 0
+        self._pending: List[Tuple[BinaryIO, bytes]] = []
+
+    def _decode(self, value: bytes) -> str:
+        try:
+            return value.decode(self.charset)
+        except UnicodeDecodeError:
+            return value.decode("latin-1")
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._field_name = ""
+        self._field_data = bytearray()
+        self._file = None
+        self._file_bytes = 0
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise InvalidUploadError('Content-Disposition header is missing "name"')
+        self._field_name = self._decode(options[b"name"])
+        if b"filename" in options and self._field_name == FILE_FIELD_NAME:
+            file_name = _safe_filename(self._decode(options[b"filename"]), len(self.file_paths))
+            path = _unique_path(self.dest_dir, file_name)
+            self._file = open(path, "wb")
+            self.file_paths.append(path)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        chunk = data[start:end]
+        if self._file is None:
+            if len(self._field_data) + len(chunk) > MAX_FIELD_BYTES:
+                raise UploadTooLargeError(f"Form field '{self._field_name}' is too large")
+            self._field_data.extend(chunk)
+            return
+        self._file_bytes += len(chunk)
+        self.total_file_bytes += len(chunk)
+        if self._file_bytes > self.max_file_bytes:
+            raise UploadTooLargeError(
+                f"File '{os.path.basename(self.file_paths[-1])}' exceeds {self.max_file_bytes} bytes"
+            )
+        if self.total_file_bytes > self.max_request_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {self.max_request_bytes} bytes in total")
+        self._pending.append((self._file, chunk))
+
+    def on_part_end(self) -> None:
+        if self._file is None:
+            if self._field_name:
+                self.fields[self._field_name] = self._decode(bytes(self._field_data))
+            return
+        # Closed after the pending chunks for it are flushed.
+        self._pending.append((self._file, b""))
+        self._file = None
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def flush(self) -> None:
+        pending, self._pending = self._pending, []
+        for f, chunk in pending:
+            if chunk:
+                f.write(chunk)
+            else:
+                f.close()
+
+    def close_all(self) -> None:
+        for f, _ in self._pending:
+            f.close()
+        self._pending = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def stream_multipart_to_dir(
+    headers: Mapping[str, str],
+    stream: AsyncIterator[bytes],
+    dest_dir: str,
+    max_file_bytes: int,
+    max_request_bytes: int,
+) -> Tuple[Dict[str, str], List[str]]:
+    content_type = headers.get("content-type", "")
+    disposition, params = parse_options_header(content_type)
+    if disposition != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidUploadError("Expected a multipart/form-data request")
+
+    content_length = headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_request_bytes + MAX_FIELD_BYTES:
+        raise UploadTooLargeError(f"Upload exceeds {max_request_bytes} bytes in total")
+
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+    try:
+        charset = codecs.lookup(charset).name
+    except LookupError:
+        charset = "latin-1"
+
+    writer = _StreamingFormWriter(dest_dir, charset, max_file_bytes, max_request_bytes)
+    parser = MultipartParser(
+        params[b"boundary"],
+        {
+            "on_part_begin": writer.on_part_begin,
+            "on_part_data": writer.on_part_data,
+            "on_part_end": writer.on_part_end,
+            "on_header_field": writer.on_header_field,
+            "on_header_value": writer.on_header_value,
+            "on_header_end": writer.on_header_end,
+            "on_headers_finished": writer.on_headers_finished,
+        },
+    )
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            if writer.has_pending:
+                await asyncio.to_thread(writer.flush)
+        parser.finalize()
+        writer.flush()
+    finally:
+        writer.close_all()
+
+    return writer.fields, writer.file_paths
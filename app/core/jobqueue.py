@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from .config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_queue (
+    job_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_job_queue_lease ON job_queue (lease_expires, enqueued_at);
+CREATE TABLE IF NOT EXISTS job_credentials (
+    job_id TEXT PRIMARY KEY,
+    credentials TEXT NOT NULL
+);
+"""
+
+ClaimedJob = Tuple[str, Dict[str, Any], int]
+
+
+class JobQueue(ABC):
+    # credentials holds only keys supplied with the request itself; jobs
+    # that use the configured keys store none and the worker resolves them
+    # when it runs the job. claim() returns them as payload["credentials"].
+    @abstractmethod
+    def enqueue(self, job_id: str, payload: Dict[str, Any], credentials: Dict[str, str] | None = None) -> None:
+        ...
+
+    @abstractmethod
+    def claim(self, worker_id: str, lease_seconds: float) -> ClaimedJob | None:
+        ...
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        ...
+
+    @abstractmethod
+    def ack(self, job_id: str) -> None:
+        ...
+
+
+# A job is claimable while nobody holds an unexpired lease on it. Workers
+# extend the lease with heartbeat() while they run the job and ack() it when
+# done, so a crashed worker's job is picked up again once its lease runs out.
+# Per-request credentials live in their own table, out of the payload, and
+# are deleted together with the job on ack().
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                    try:
+                        conn.execute("PRAGMA journal_mode = WAL")
+                        conn.executescript(SCHEMA)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                    self._initialized = True
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any], credentials: Dict[str, str] | None = None) -> None:
+        credentials = {k: v for k, v in (credentials or {}).items() if v}
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if credentials:
+                conn.execute(
+                    "INSERT INTO job_credentials (job_id, credentials) VALUES (?, ?)",
+                    (job_id, json.dumps(credentials)),
+                )
+            conn.execute(
+                "INSERT INTO job_queue (job_id, payload, enqueued_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str, lease_seconds: float) -> ClaimedJob | None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT job_id, payload, attempts FROM job_queue WHERE lease_expires < ?"
+                " ORDER BY enqueued_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, payload, attempts = row
+            conn.execute(
+                "UPDATE job_queue SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE job_id = ?",
+                (worker_id, now + lease_seconds, job_id),
+            )
+            secret = conn.execute("SELECT credentials FROM job_credentials WHERE job_id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+            payload = json.loads(payload)
+            payload["credentials"] = json.loads(secret[0]) if secret else {}
+            return job_id, payload, attempts + 1
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE job_queue SET lease_expires = ? WHERE job_id = ? AND lease_owner = ?",
+                (time.time() + lease_seconds, job_id, worker_id),
+            )
+            return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    def ack(self, job_id: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM job_credentials WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+job_queue: JobQueue = SQLiteJobQueue(settings.job_queue_path)
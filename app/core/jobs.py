@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from .config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    output_format TEXT NOT NULL DEFAULT 'Both',
+    bypass_cache INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated_at);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT PRIMARY KEY REFERENCES jobs (job_id) ON DELETE CASCADE,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_merge_plans (
+    job_id TEXT PRIMARY KEY REFERENCES jobs (job_id) ON DELETE CASCADE,
+    plan TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    event TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, seq);
+"""
+
+FINISHED_STATUSES = ("completed", "failed")
+
+
+# Job metadata lives in `jobs`; the (potentially large) result payload sits in
+# `job_results` and the sheet merge plan in `job_merge_plans`, and both are
+# only read when a caller asks for them.
+class JobStore:
+    def __init__(self, db_path: str, ttl_seconds: int, max_jobs: int):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        self._ensure_schema()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _ensure_schema(self) -> None:
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SCHEMA)
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def create(self, job_id: str, output_format: str, bypass_cache: bool, status: str = "processing") -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, output_format, bypass_cache, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, status, output_format, int(bypass_cache), now, now),
+            )
+        self.evict()
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT job_id, status, output_format, bypass_cache, error, created_at, updated_at"
+                " FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["bypass_cache"] = bool(job["bypass_cache"])
+        return job
+
+    def get_result(self, job_id: str) -> Dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload FROM job_results WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def set_status(self, job_id: str, status: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, time.time(), job_id),
+            )
+
+    def get_merge_plan(self, job_id: str) -> Dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT plan FROM job_merge_plans WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row["plan"]) if row else None
+
+    def complete(self, job_id: str, result: Dict[str, Any], merge_plan: Dict[str, Any] | None = None) -> None:
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, payload) VALUES (?, ?)",
+                (job_id, payload),
+            )
+            if merge_plan is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO job_merge_plans (job_id, plan) VALUES (?, ?)",
+                    (job_id, json.dumps(merge_plan, ensure_ascii=False)),
+                )
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', error = NULL, updated_at = ? WHERE job_id = ?",
+                (time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE job_id = ?",
+                (error, time.time(), job_id),
+            )
+
+    def start_attempt(self, job_id: str, attempt: int) -> None:
+        # A re-claimed job runs again from the start, so the events of the
+        # abandoned attempt are dropped and followers are told to reset.
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'processing', updated_at = ? WHERE job_id = ?",
+                (now, job_id),
+            )
+            if attempt > 1:
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                conn.execute(
+                    "INSERT INTO job_events (job_id, event, payload, created_at) VALUES (?, ?, ?, ?)",
+                    (job_id, "restarted", json.dumps({"attempt": attempt}), now),
+                )
+
+    def add_event(self, job_id: str, event: str, payload: Dict[str, Any]) -> None:
+        self.add_events(job_id, [(event, payload)])
+
+    def add_events(self, job_id: str, events: List[Tuple[str, Dict[str, Any]]]) -> None:
+        if not events:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO job_events (job_id, event, payload, created_at) VALUES (?, ?, ?, ?)",
+                [(job_id, event, json.dumps(payload, ensure_ascii=False), now) for event, payload in events],
+            )
+
+    def events_since(self, job_id: str, after_seq: int, limit: int = 500) -> List[Tuple[int, str, Dict[str, Any]]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, event, payload FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after_seq, limit),
+            ).fetchall()
+        return [(row["seq"], row["event"], json.loads(row["payload"])) for row in rows]
+
+    def evict(self) -> None:
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self._connect() as conn:
+            if self.ttl_seconds > 0:
+                conn.execute(
+                    f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                    (*FINISHED_STATUSES, time.time() - self.ttl_seconds),
+                )
+            if self.max_jobs > 0:
+                conn.execute(
+                    f"DELETE FROM jobs WHERE status IN ({placeholders}) AND job_id NOT IN"
+                    " (SELECT job_id FROM jobs ORDER BY updated_at DESC LIMIT ?)",
+                    (*FINISHED_STATUSES, self.max_jobs),
+                )
+
+
+job_store = JobStore(
+    db_path=settings.job_db_path,
+    ttl_seconds=settings.job_ttl_seconds,
+    max_jobs=settings.job_max_count,
+)
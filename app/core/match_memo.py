@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from .config import settings
+from .matching import LocalProductMatcher, normalize_product_text
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS match_memo (
+    scope TEXT NOT NULL,
+    target TEXT NOT NULL,
+    reference_set TEXT NOT NULL,
+    reference TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (scope, target, reference_set)
+);
+CREATE INDEX IF NOT EXISTS idx_match_memo_last_used ON match_memo (last_used);
+CREATE TABLE IF NOT EXISTS match_memo_reference_names (
+    reference_set TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (reference_set, name)
+);
+"""
+
+# Matched decisions are stored under an empty reference_set: they stay valid
+# for as long as the reference row they point at still exists.
+_ANY_REFERENCE_SET = ""
+_LOOKUP_CHUNK = 500
+
+
+def _normalized_names(names: List[str]) -> List[str]:
+    return sorted({normalize_product_text(name) for name in names} - {""})
+
+
+def reference_set_id(names: List[str]) -> str:
+    return hashlib.sha256("\0".join(_normalized_names(names)).encode("utf-8")).hexdigest()
+
+
+class MemoLookup:
+    def __init__(self):
+        self.matched: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        self.unique: List[Dict[str, Any]] = []
+        self.missing: List[Dict[str, Any]] = []
+
+
+# Matching decisions (target name -> reference name, or "unique") returned by
+# match_products_with_gemini, remembered across jobs per scope (the sheet id)
+# so repeat quotations from the same suppliers skip the LLM. A matched
+# decision is dropped as soon as its reference row is no longer in the item
+# list. A unique decision keeps the item list it was made against (every
+# reference name of the sheet, not just the rows still free for the
+# supplier); rows added since then might be the match, so it only holds
+# while the target is still clearly unlike each of them. Past max_entries
+# the least recently used decisions are evicted.
+class MatchMemo:
+    def __init__(self, db_path: str, max_entries: int, reject_score: float, enabled: bool = True):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.reject_score = reject_score
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        self._ensure_schema()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _ensure_schema(self) -> None:
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SCHEMA)
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def lookup(
+        self,
+        scope: str,
+        targets: List[Dict[str, Any]],
+        references: List[Dict[str, Any]],
+        item_names: List[str],
+    ) -> MemoLookup:
+        # references: the rows the targets may still be matched to;
+        # item_names: every reference name in the sheet's item list.
+        result = MemoLookup()
+        if not self.enabled or not targets:
+            result.missing.extend(targets)
+            return result
+
+        by_reference: Dict[str, Dict[str, Any]] = {}
+        for ref in references:
+            by_reference.setdefault(normalize_product_text(ref.get("name")), ref)
+        current_names = set(_normalized_names(item_names))
+        keys = sorted({normalize_product_text(t.get("name")) for t in targets})
+
+        decisions: Dict[str, Tuple[str, str | None]] = {}
+        stale: List[Tuple[str, str]] = []
+        # Per recorded item list: a matcher over the names added since, or
+        # None when nothing was added.
+        added_by_set: Dict[str, LocalProductMatcher | None] = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[i : i + _LOOKUP_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = conn.execute(
+                    f"SELECT target, reference_set, reference FROM match_memo"
+                    f" WHERE scope = ? AND target IN ({placeholders})",
+                    (scope, *chunk),
+                ).fetchall()
+                for row in rows:
+                    target, ref_set = row["target"], row["reference_set"]
+                    if ref_set == _ANY_REFERENCE_SET:
+                        if row["reference"] in by_reference:
+                            decisions[target] = (ref_set, row["reference"])
+                        elif row["reference"] not in current_names:
+                            stale.append((target, ref_set))
+                        # Otherwise the row exists but is taken for this
+                        # supplier: the target is looked up afresh and the
+                        # decision kept for later jobs.
+                        continue
+                    if ref_set not in added_by_set:
+                        recorded = {
+                            r["name"]
+                            for r in conn.execute(
+                                "SELECT name FROM match_memo_reference_names WHERE reference_set = ?", (ref_set,)
+                            )
+                        }
+                        added = [{"name": name} for name in sorted(current_names - recorded)]
+                        added_by_set[ref_set] = (
+                            LocalProductMatcher(added, reject_score=self.reject_score) if added else None
+                        )
+                    matcher = added_by_set[ref_set]
+                    if matcher is None or matcher.match([{"name": target}]).unique:
+                        decisions.setdefault(target, (ref_set, None))
+                    else:
+                        stale.append((target, ref_set))
+
+            if stale:
+                conn.executemany(
+                    "DELETE FROM match_memo WHERE scope = ? AND target = ? AND reference_set = ?",
+                    [(scope, target, ref_set) for target, ref_set in stale],
+                )
+            if decisions:
+                conn.executemany(
+                    "UPDATE match_memo SET last_used = ? WHERE scope = ? AND target = ? AND reference_set = ?",
+                    [(time.time(), scope, target, rs) for target, (rs, _) in decisions.items()],
+                )
+
+        for target in targets:
+            decision = decisions.get(normalize_product_text(target.get("name")))
+            if decision is None:
+                result.missing.append(target)
+            elif decision[1] is None:
+                result.unique.append(target)
+            else:
+                result.matched.append((target, by_reference[decision[1]]))
+        return result
+
+    def record(
+        self,
+        scope: str,
+        decisions: List[Tuple[str, str | None]],
+        item_names: List[str],
+    ) -> None:
+        # decisions: (target name, matched reference name or None for unique);
+        # item_names: every reference name in the sheet's item list.
+        if not self.enabled or not decisions:
+            return
+        now = time.time()
+        rows = []
+        ref_set = None
+        for target_name, reference_name in decisions:
+            target = normalize_product_text(target_name)
+            if not target:
+                continue
+            if reference_name is None:
+                ref_set = ref_set or reference_set_id(item_names)
+                rows.append((scope, target, ref_set, None, now, now))
+            else:
+                rows.append((scope, target, _ANY_REFERENCE_SET, normalize_product_text(reference_name), now, now))
+        if not rows:
+            return
+        with self._connect() as conn:
+            # One decision per target: a new one replaces whatever was there.
+            conn.executemany(
+                "DELETE FROM match_memo WHERE scope = ? AND target = ?",
+                [(scope, row[1]) for row in rows],
+            )
+            conn.executemany(
+                "INSERT INTO match_memo (scope, target, reference_set, reference, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if ref_set is not None:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO match_memo_reference_names (reference_set, name) VALUES (?, ?)",
+                    [(ref_set, name) for name in _normalized_names(item_names)],
+                )
+            over_limit = (
+                self.max_entries > 0
+                and conn.execute("SELECT COUNT(*) FROM match_memo").fetchone()[0] > self.max_entries
+            )
+        if over_limit:
+            self.evict()
+
+    def evict(self) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM match_memo WHERE rowid NOT IN"
+                " (SELECT rowid FROM match_memo ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            conn.execute(
+                "DELETE FROM match_memo_reference_names WHERE reference_set NOT IN"
+                " (SELECT DISTINCT reference_set FROM match_memo)"
+            )
+
+
+match_memo = MatchMemo(
+    db_path=settings.match_memo_path,
+    max_entries=settings.match_memo_max_entries,
+    reject_score=settings.local_match_reject_score,
+    enabled=settings.match_memo_enabled,
+)
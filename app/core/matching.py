@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import unicodedata
+from typing import Any, Dict, List, Tuple
+
+# Thai and Latin spellings of the units that show up in quotation lines,
+# longest first so "มม." is not read as "ม." followed by a stray "ม".
+_UNIT_ALIASES: List[Tuple[str, str]] = [
+    (r"ตร\.?\s*ม\.?|ตารางเมตร|sq\.?\s*m\.?|sqm\.?|m2|m²", " m2 "),
+    (r"มิลลิเมตร|มม\.?|mm\.?", " mm "),
+    (r"เซนติเมตร|ซม\.?|cm\.?", " cm "),
+    (r"เมตร|ม\.(?![ก-๙])|(?<=\d)\s*ม(?![ก-๙])|(?<=\d)\s*m\.?(?![a-z0-9])", " m "),
+    (r"กิโลกรัม|กก\.?|kg\.?", " kg "),
+    (r"นิ้ว|inch(?:es)?|\"", " in "),
+]
+_DIMENSION_SEPARATOR = re.compile(r"(?<=\d)\s*[x×*]\s*(?=\d)")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_GROUP_SEPARATOR = re.compile(r"\s+[-–—:]\s+")
+_NGRAM_SIZES = (2, 3, 4)
+
+
+def normalize_product_text(text: str | None) -> str:
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"^\s*\d+[\.\)\-]\s*", "", text)
+    text = re.sub(r"(?<=\d),(?=\d{3})", "", text)
+    text = _DIMENSION_SEPARATOR.sub("x", text)
+    for pattern, replacement in _UNIT_ALIASES:
+        text = re.sub(pattern, replacement, text)
+    text = re.sub(r"(?<=\d)\.0+(?!\d)", "", text)
+    # Keep Thai combining vowels and tone marks; \w does not cover all of them.
+    text = "".join(" " if unicodedata.category(ch)[0] in "PS" and ch not in ".+" else ch for ch in text)
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def split_group(name: str | None) -> Tuple[str, str]:
+    # Names carry their parent category or room group before the first
+    # " - " ("1BR+2BR(57-70sqm.) - Hood - EL 60", "งานพื้นตก - กระจก...").
+    parts = _GROUP_SEPARATOR.split(name or "", maxsplit=1)
+    if len(parts) == 2:
+        return normalize_product_text(parts[0]), normalize_product_text(parts[1])
+    return "", normalize_product_text(name)
+
+
+def _numbers(text: str) -> frozenset:
+    return frozenset(_NUMBER.findall(text))
+
+
+def _ngrams(text: str) -> Dict[str, int]:
+    # Character n-grams need no word segmentation, which Thai text lacks.
+    padded = f" {text} "
+    counts: Dict[str, int] = {}
+    for n in _NGRAM_SIZES:
+        for i in range(len(padded) - n + 1):
+            gram = padded[i : i + n]
+            counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+class _TfidfSpace:
+    def __init__(self, documents: List[str]):
+        counts = [_ngrams(doc) for doc in documents]
+        df: Dict[str, int] = {}
+        for grams in counts:
+            for gram in grams:
+                df[gram] = df.get(gram, 0) + 1
+        total = len(documents)
+        self._idf = {gram: math.log((1 + total) / (1 + d)) + 1.0 for gram, d in df.items()}
+        self._default_idf = math.log(1 + total) + 1.0
+        self.vectors = [self.vector_from_counts(grams) for grams in counts]
+
+    def vector_from_counts(self, counts: Dict[str, int]) -> Dict[str, float]:
+        vector = {gram: (1.0 + math.log(c)) * self._idf.get(gram, self._default_idf) for gram, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {gram: w / norm for gram, w in vector.items()}
+
+    def vector(self, text: str) -> Dict[str, float]:
+        return self.vector_from_counts(_ngrams(text))
+
+
+def _cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(gram, 0.0) for gram, w in a.items())
+
+
+class LocalMatchResult:
+    def __init__(self):
+        self.matched: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        self.unique: List[Dict[str, Any]] = []
+        self.ambiguous: List[Dict[str, Any]] = []
+
+
+# Resolves the easy part of product matching without an LLM call. Reference
+# entries (ProductIndex rows without a product code) and target products are
+# normalized (units, dimensions, thousands separators) and compared by cosine
+# similarity of TF-IDF weighted character n-grams, with the group prefix
+# scored separately because a match across groups is never valid. Targets
+# scoring above accept_score with a clear margin over the runner-up are
+# matched, targets below reject_score against every reference are unique,
+# and everything in between is left for match_products_with_gemini.
+class LocalProductMatcher:
+    def __init__(
+        self,
+        references: List[Dict[str, Any]],
+        accept_score: float = 0.9,
+        reject_score: float = 0.2,
+        margin: float = 0.05,
+    ):
+        self.references = references
+        self.accept_score = accept_score
+        self.reject_score = reject_score
+        self.margin = margin
+        self._split = [split_group(ref.get("name")) for ref in references]
+        self._full = [" ".join(part for part in parts if part) for parts in self._split]
+        self._space = _TfidfSpace(self._full)
+        self._postings = self._build_postings(self._space.vectors)
+        # Group names vary between suppliers ("1 BEDROOM" for "1BR+2BR"), so
+        # a product is only called unique if its description without the
+        # group is also unlike every reference description.
+        self._rest_postings = self._build_postings([self._space.vector(rest) for _, rest in self._split])
+        self._exact: Dict[str, List[int]] = {}
+        for idx, text in enumerate(self._full):
+            self._exact.setdefault(text, []).append(idx)
+
+    @staticmethod
+    def _build_postings(vectors: List[Dict[str, float]]) -> Dict[str, List[Tuple[int, float]]]:
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for idx, vector in enumerate(vectors):
+            for gram, weight in vector.items():
+                postings.setdefault(gram, []).append((idx, weight))
+        return postings
+
+    def _scores(self, text: str, postings: Dict[str, List[Tuple[int, float]]]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for gram, weight in self._space.vector(text).items():
+            for idx, ref_weight in postings.get(gram, ()):
+                scores[idx] = scores.get(idx, 0.0) + weight * ref_weight
+        return scores
+
+    def _group_compatible(self, target_group: str, idx: int) -> bool:
+        ref_group = self._split[idx][0]
+        if not target_group or not ref_group or target_group == ref_group:
+            return True
+        similarity = _cosine(self._space.vector(target_group), self._space.vector(ref_group))
+        return similarity >= self.accept_score
+
+    def match(self, targets: List[Dict[str, Any]]) -> LocalMatchResult:
+        result = LocalMatchResult()
+        if not self.references:
+            result.unique.extend(targets)
+            return result
+
+        proposals: List[Tuple[float, int, int]] = []
+        for t_idx, target in enumerate(targets):
+            group, rest = split_group(target.get("name"))
+            text = " ".join(part for part in (group, rest) if part)
+            exact = self._exact.get(text)
+            if exact:
+                proposals.extend((1.0, t_idx, idx) for idx in exact)
+                continue
+
+            ranked = sorted(self._scores(text, self._postings).items(), key=lambda item: item[1], reverse=True)
+            best = ranked[0][1] if ranked else 0.0
+            if best < self.reject_score and max(self._scores(rest, self._rest_postings).values(), default=0.0) < self.reject_score:
+                result.unique.append(target)
+                continue
+            runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+            idx = ranked[0][0]
+            if (
+                best >= self.accept_score
+                and best - runner_up >= self.margin
+                and _numbers(text) == _numbers(self._full[idx])
+                and self._group_compatible(group, idx)
+            ):
+                proposals.append((best, t_idx, idx))
+            else:
+                result.ambiguous.append(target)
+
+        # One-to-one: a reference row takes at most one product per supplier.
+        # The stronger claim wins; the weaker one goes to the LLM instead.
+        claimed: set[int] = set()
+        resolved: set[int] = set()
+        deferred: set[int] = set()
+        for _, t_idx, idx in sorted(proposals, key=lambda p: p[0], reverse=True):
+            if t_idx in resolved:
+                continue
+            if idx in claimed:
+                deferred.add(t_idx)
+                continue
+            claimed.add(idx)
+            resolved.add(t_idx)
+            result.matched.append((targets[t_idx], self.references[idx]))
+        result.ambiguous.extend(targets[t_idx] for t_idx in sorted(deferred - resolved))
+        return result
+
+
+def estimate_tokens(items: List[Dict[str, Any]]) -> int:
+    # Rough and on the high side: Thai text runs close to one token per two
+    # characters, Latin text well under that.
+    return len(json.dumps(items, ensure_ascii=False)) // 2 + 1
+
+
+# Splits one matching request into smaller ones that can run in parallel.
+# The matching prompt never matches across groups, so targets are sent only
+# with the references of their own group. A target whose group is missing or
+# not recognisably one of the reference groups ("1 BEDROOM" for "1BR+2BR")
+# keeps the full reference list so no candidate is lost. Targets are then
+# chunked so that each request stays within max_tokens (references plus
+# targets) and max_targets, which also bounds the size of each response.
+# When the references alone use up most of max_tokens, the targets still get
+# min_target_share of it; splitting them finer would only repeat the same
+# oversized reference list in more calls.
+def partition_for_matching(
+    targets: List[Dict[str, Any]],
+    references: List[Dict[str, Any]],
+    max_tokens: int,
+    max_targets: int,
+    group_similarity: float = 0.5,
+    min_target_share: float = 0.25,
+) -> List[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    refs_by_group: Dict[str, List[Dict[str, Any]]] = {}
+    for ref in references:
+        refs_by_group.setdefault(split_group(ref.get("name"))[0], []).append(ref)
+    groups = [group for group in refs_by_group if group]
+    space = _TfidfSpace(groups) if groups else None
+
+    targets_by_group: Dict[str | None, List[Dict[str, Any]]] = {}
+    for target in targets:
+        group = split_group(target.get("name"))[0]
+        key: str | None = None
+        if group and group in refs_by_group:
+            key = group
+        elif group and space is not None:
+            vector = space.vector(group)
+            score, best = max((_cosine(vector, v), g) for g, v in zip(groups, space.vectors))
+            if score >= group_similarity:
+                key = best
+        targets_by_group.setdefault(key, []).append(target)
+
+    partitions: List[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]] = []
+    for key, group_targets in targets_by_group.items():
+        group_refs = references if key is None else refs_by_group[key]
+        budget = max(max_tokens - estimate_tokens(group_refs), int(max_tokens * min_target_share))
+        chunk: List[Dict[str, Any]] = []
+        chunk_tokens = 0
+        for target in group_targets:
+            tokens = estimate_tokens([target])
+            if chunk and (chunk_tokens + tokens > budget or len(chunk) >= max_targets):
+                partitions.append((chunk, group_refs))
+                chunk, chunk_tokens = [], 0
+            chunk.append(target)
+            chunk_tokens += tokens
+        if chunk:
+            partitions.append((chunk, group_refs))
+    return partitions
@@ -1,22 +1,68 @@
 from __future__ import annotations
 
+import asyncio
 import concurrent.futures
 import json
+import logging
 import mimetypes
 import os
 import re
-import tempfile
+import threading
 import time
-from typing import Any, Dict, List, Tuple
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
 
 import google.generativeai as genai
 from openpyxl.utils import get_column_letter
 
-from .config import settings
-from .gcp import authenticate_and_open_sheet
+from .cache import extraction_cache, file_sha256, make_extraction_key
+from .config import get_effective_google_api_key, settings
+from .gcp import authenticate_and_open_sheet, gspread_pool
+from .gemini import GeminiKeyClients, gemini_clients
+from .match_memo import match_memo
+from .matching import LocalProductMatcher, normalize_product_text, partition_for_matching
+from .ratelimit import (
+    AdaptiveConcurrencyLimiter,
+    KeyRateLimiter,
+    KeyRateLimiterRegistry,
+    backoff_delay,
+    is_rate_limited,
+    is_retryable,
+    retry_call,
+    retry_call_async,
+)
+from .sheet_lock import SheetLease, sheet_locks
+from .sheet_mirror import MergePlan, SheetMirror, read_bootstrap_values
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+def _raise_if_cancelled(cancel: threading.Event | None) -> None:
+    # process_files runs on a plain thread that the caller cannot interrupt;
+    # it stops at the next file boundary or flush once cancel is set.
+    if cancel is not None and cancel.is_set():
+        raise JobCancelledError("Job was cancelled")
 
 DEFAULT_SHEET_ID = settings.default_sheet_id
 
+EXTRACTION_MODEL = "gemini-2.5-flash"
+EXTRACTION_FALLBACK_MODEL = "gemini-2.5-pro"
+
+OUTPUT_FORMAT_EXCEL = "Excel"
+OUTPUT_FORMAT_SHEET = "Google Sheet"
+OUTPUT_FORMAT_BOTH = "Both"
+
+MATCH_MODE_FILE = "file"
+MATCH_MODE_JOB = "job"
+
+# Match memo scope for Excel-only jobs, whose item list starts from the template.
+EXCEL_TEMPLATE_MEMO_SCOPE = "excel-template"
+
 COMPANY_NAME_ROW = 1
 CONTACT_INFO_ROW = 2
 HEADER_ROW = 3
@@ -33,6 +79,14 @@ SUMMARY_LABELS = [
     "อื่น ๆ",
 ]
 
+gemini_limiter = AdaptiveConcurrencyLimiter(
+    initial=settings.adaptive_initial_concurrency,
+    min_limit=settings.adaptive_min_concurrency,
+    max_limit=settings.extraction_concurrency,
+)
+
+key_rate_limiters = KeyRateLimiterRegistry(settings.gemini_rpm_per_key, settings.gemini_tpm_per_key)
+
 SAFETY_SETTINGS = {
     "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
     "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
@@ -41,6 +95,45 @@ SAFETY_SETTINGS = {
 }
 
 
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def _emit(progress: ProgressCallback | None, event: str, **payload: Any) -> None:
+    # Progress is best-effort telemetry and must never fail the extraction.
+    if progress is None:
+        return
+    try:
+        progress(event, payload)
+    except Exception:
+        pass
+
+
+def _file_progress(progress: ProgressCallback | None, file_index: int, file_name: str) -> ProgressCallback | None:
+    if progress is None:
+        return None
+
+    def emit(event: str, payload: Dict[str, Any]) -> None:
+        progress(event, {"file_index": file_index, "file_name": file_name, **payload})
+
+    return emit
+
+
+def normalize_output_format(value: str | None) -> str:
+    v = (value or "").strip().lower().replace(" ", "").replace("_", "")
+    if v == "excel":
+        return OUTPUT_FORMAT_EXCEL
+    if v in ("sheet", "googlesheet", "googlesheets"):
+        return OUTPUT_FORMAT_SHEET
+    return OUTPUT_FORMAT_BOTH
+
+
+def normalize_match_mode(value: str | None) -> str:
+    v = (value or "").strip().lower()
+    if v == MATCH_MODE_FILE:
+        return MATCH_MODE_FILE
+    return MATCH_MODE_JOB
+
+
 def extract_sheet_id_from_url(url: str | None) -> str | None:
     if not url:
         return None
@@ -68,6 +161,32 @@ def extract_json_from_text(text: str | None) -> Dict[str, Any] | None:
     return None
 
 
+def _response_json(response: Any) -> Dict[str, Any] | None:
+    # Returns None instead of raising when there is nothing usable, so the
+    # caller can decide whether that is worth a fallback.
+    try:
+        text = response.text or ""
+    except ValueError:
+        # No candidate parts, e.g. the response was blocked or cut off.
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Free-text answers (structured output disabled) may wrap the JSON in
+        # code fences or prose.
+        try:
+            data = extract_json_from_text(text)
+        except ValueError:
+            return None
+    return data if isinstance(data, dict) else None
+
+
+def _generation_config(base: Dict[str, Any], response_schema: Dict[str, Any]) -> Dict[str, Any]:
+    if not settings.gemini_structured_output:
+        return base
+    return {**base, "response_mime_type": "application/json", "response_schema": response_schema}
+
+
 def extract_contact_info(text: str | None) -> str:
     if not text:
         return ""
@@ -195,36 +314,178 @@ def extract_product_code(name: str | None) -> str | None:
     return None
 
 
+# Rows of the item master list, indexed by product code and by cleaned name so
+# each file can look products up without rescanning the whole list. Entries
+# are shared between the maps, so shifting a row updates every lookup at once.
+class ProductIndex:
+    def __init__(self, products: List[Dict[str, Any]] | None = None):
+        self.products: List[Dict[str, Any]] = []
+        self.products_no_code: List[Dict[str, Any]] = []
+        self._by_code: Dict[str, Dict[str, Any]] = {}
+        self._by_clean_name: Dict[str, Dict[str, Any]] = {}
+        self._no_code_by_name: Dict[str, List[Dict[str, Any]]] = {}
+        self._max_row = 0
+        for p in products or []:
+            self.add(p["name"], p["row"])
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def add(self, name: str, row: int) -> None:
+        entry = {"name": name, "row": row}
+        self.products.append(entry)
+        code = extract_product_code(name)
+        if code:
+            self._by_code[code] = entry
+        else:
+            self.products_no_code.append(entry)
+            self._no_code_by_name.setdefault(name, []).append(entry)
+        self._by_clean_name.setdefault(clean_product_name(name), entry)
+        self._max_row = max(self._max_row, row)
+
+    def row_for_code(self, code: str | None) -> int | None:
+        entry = self._by_code.get(code) if code else None
+        return entry["row"] if entry else None
+
+    def rows_without_code(self, name: str) -> List[int]:
+        return [entry["row"] for entry in self._no_code_by_name.get(name, [])]
+
+    def contains_name(self, name: str | None) -> bool:
+        return clean_product_name(name) in self._by_clean_name
+
+    def rows_for_labels(self, labels: List[str]) -> Dict[str, int]:
+        rows: Dict[str, int] = {}
+        for label in labels:
+            entries = self._no_code_by_name.get(label)
+            if entries:
+                rows[label] = entries[-1]["row"]
+        return rows
+
+    def shift_rows(self, index: int, count: int) -> None:
+        # Mirrors inserting `count` blank rows before row `index` in the sheet.
+        if count <= 0 or index > self._max_row:
+            return
+        for entry in self.products:
+            if entry["row"] >= index:
+                entry["row"] += count
+        self._max_row += count
+
+
 def match_products_with_gemini(
     target_products: List[Dict[str, Any]],
     reference_products: List[Dict[str, Any]],
+    api_key: str | None = None,
 ) -> Dict[str, Any]:
     if not target_products:
         return {"matchedItems": [], "uniqueItems": []}
     if not reference_products:
         return {"matchedItems": [], "uniqueItems": target_products}
 
+    partitions = partition_for_matching(
+        target_products,
+        reference_products,
+        settings.match_partition_max_tokens,
+        settings.match_partition_max_targets,
+    )
+    if len(partitions) == 1:
+        return _match_partition_with_gemini(*partitions[0], api_key)
+
+    workers = max(1, min(settings.match_partition_concurrency, len(partitions)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_match_partition_with_gemini, targets, refs, api_key) for targets, refs in partitions]
+        partition_results = [(targets, future.result()) for (targets, _), future in zip(partitions, futures)]
+
+    # Partitions answer independently, so two of them (chunks of the same
+    # group) can claim the same reference row. Each name takes as many
+    # matches as it has rows; later claims become unique products again.
+    capacity: Dict[str, int] = {}
+    for ref in reference_products:
+        capacity[ref["name"]] = capacity.get(ref["name"], 0) + 1
+    merged: Dict[str, Any] = {"matchedItems": [], "uniqueItems": []}
+    for targets, result in partition_results:
+        claimed: set[int] = set()
+        for item in result.get("matchedItems", []):
+            name = item.get("name", "")
+            if not item.get("targetName"):
+                logger.warning("Match for %r has no targetName; tracing it by its figures", name)
+            # Accepted matches claim their target too, so an over-claim is
+            # traced to a target no earlier match in the partition took.
+            target = _target_for_match(targets, item, claimed)
+            if capacity.get(name, 0) > 0:
+                capacity[name] -= 1
+                merged["matchedItems"].append(item)
+                continue
+            if target is None:
+                # Not traceable to one target: keep the product under the
+                # name Gemini gave for it rather than dropping it.
+                target = {k: v for k, v in item.items() if k != "targetName"}
+                target["name"] = item.get("targetName") or name
+            merged["uniqueItems"].append(target)
+        merged["uniqueItems"].extend(result.get("uniqueItems", []))
+    return merged
+
+
+def _target_for_match(
+    targets: List[Dict[str, Any]],
+    item: Dict[str, Any],
+    claimed: set[int] | None = None,
+) -> Dict[str, Any] | None:
+    # Structured responses name the target of each match (targetName). Free
+    # text answers only echo its quantity and prices, so a match is traced
+    # back to the target with the same figures, and only when unambiguous.
+    # Several targets can share a name (the same product in two rooms):
+    # claimed holds id() of targets already traced by earlier matches of the
+    # same response, and each match takes the first one not in it.
+    if claimed is None:
+        claimed = set()
+    free = [t for t in targets if id(t) not in claimed]
+    target = None
+    target_name = normalize_product_text(item.get("targetName"))
+    if target_name:
+        named = [t for t in free if normalize_product_text(t.get("name")) == target_name]
+        if named:
+            target = named[0]
+    if target is None:
+        figures = (item.get("quantity"), item.get("unit"), item.get("pricePerUnit"), item.get("totalPrice"))
+        candidates = [
+            t for t in free if (t.get("quantity"), t.get("unit"), t.get("pricePerUnit"), t.get("totalPrice")) == figures
+        ]
+        if len(candidates) == 1:
+            target = candidates[0]
+    if target is not None:
+        claimed.add(id(target))
+    return target
+
+
+def _match_partition_with_gemini(
+    target_products: List[Dict[str, Any]],
+    reference_products: List[Dict[str, Any]],
+    api_key: str | None = None,
+) -> Dict[str, Any]:
     match_prompt_formatted = matching_prompt.format(
         target_products=json.dumps(target_products, ensure_ascii=False),
         reference_products=json.dumps(reference_products, ensure_ascii=False),
     )
 
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-pro",
-        generation_config={"temperature": 0.0, "top_p": 0.95},
-        safety_settings=SAFETY_SETTINGS,
+    model = gemini_clients.get(api_key).model(
+        "gemini-2.5-pro",
+        _generation_config({"temperature": 0.0, "top_p": 0.95}, MATCH_RESPONSE_SCHEMA),
+        SAFETY_SETTINGS,
+    )
+    def generate() -> Any:
+        # Holds a slot of the shared adaptive limit for the request only,
+        # not for rate-limit waits or retry backoff.
+        with gemini_limiter.slot():
+            return model.generate_content(match_prompt_formatted)
+
+    response = _gemini_call(
+        generate,
+        _rate_limiter(api_key),
+        len(match_prompt_formatted) // 2 + 1,
     )
-    response = model.generate_content(match_prompt_formatted)
-    match_text = (response.text or "").strip()
-    match_data = extract_json_from_text(match_text)
+    match_data = _response_json(response)
 
     if not match_data:
-        start = match_text.find("{")
-        end = match_text.rfind("}") + 1
-        if start >= 0 and end > start:
-            match_data = json.loads(match_text[start:end])
-
-    if not match_data or not isinstance(match_data, dict):
         return {"matchedItems": [], "uniqueItems": target_products}
     if "matchedItems" not in match_data or not isinstance(match_data["matchedItems"], list):
         match_data["matchedItems"] = []
@@ -316,25 +577,266 @@ def _batch_update(ws, batch_requests: List[Dict[str, Any]]) -> None:
                 ws.cell(row=start_row + r, column=start_col + c, value=v)
 
 
+def _gemini_match_decisions(
+    targets: List[Dict[str, Any]],
+    match_results: Dict[str, Any],
+) -> List[Tuple[str, str | None]]:
+    by_name = {normalize_product_text(t.get("name")): t.get("name", "") for t in targets}
+    decisions: List[Tuple[str, str | None]] = []
+    claimed: set[int] = set()
+    for item in match_results.get("matchedItems", []):
+        target = _target_for_match(targets, item, claimed)
+        if target is not None and item.get("name"):
+            decisions.append((target.get("name", ""), item["name"]))
+    for item in match_results.get("uniqueItems", []):
+        name = by_name.get(normalize_product_text(item.get("name")))
+        if name:
+            decisions.append((name, None))
+    return decisions
+
+
+def _supplier_row_request(col_idx: int, row: int, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "range": f"{get_column_letter(col_idx)}{row}:{get_column_letter(col_idx + COLUMNS_PER_SUPPLIER - 1)}{row}",
+        "values": [
+            [
+                item.get("quantity", 1),
+                item.get("unit", "ชิ้น"),
+                item.get("pricePerUnit", 0),
+                item.get("totalPrice", 0),
+            ]
+        ],
+    }
+
+
+# Where a supplier's uncoded products go: `matched` pairs the values to write
+# with the item-list name whose row receives them, `unique` holds products
+# that need a new row. `products` are the inputs the decisions cover.
+class MatchResolution:
+    def __init__(self, products: List[Dict[str, Any]] | None = None):
+        self.products: List[Dict[str, Any]] = list(products or [])
+        self.matched: List[Tuple[Dict[str, Any], str]] = []
+        self.unique: List[Dict[str, Any]] = []
+
+
+def resolve_product_matches(
+    products: List[Dict[str, Any]],
+    references: List[Dict[str, Any]],
+    progress: ProgressCallback | None = None,
+    api_key: str | None = None,
+    memo_scope: str | None = None,
+    item_names: List[str] | None = None,
+) -> MatchResolution:
+    # references are the unclaimed ProductIndex rows without a product code;
+    # item_names are all of them, claimed or not (defaults to references).
+    resolution = MatchResolution(products)
+    if item_names is None:
+        item_names = [p["name"] for p in references]
+    pending = list(products)
+    claimed: set[int] = set()
+
+    if pending and settings.local_match_enabled:
+        # Settle confident matches and clearly new products locally so only
+        # the ambiguous remainder costs a Gemini call.
+        local = LocalProductMatcher(
+            [p for p in references if p["name"] not in SUMMARY_LABELS],
+            accept_score=settings.local_match_accept_score,
+            reject_score=settings.local_match_reject_score,
+            margin=settings.local_match_margin,
+        ).match(pending)
+        for product, entry in local.matched:
+            resolution.matched.append((product, entry["name"]))
+            claimed.add(entry["row"])
+        resolution.unique.extend(local.unique)
+        pending = local.ambiguous
+        _emit(
+            progress,
+            "prematched",
+            matched=len(local.matched),
+            unique=len(local.unique),
+            ambiguous=len(local.ambiguous),
+        )
+
+    if pending and memo_scope:
+        available = [p for p in references if p["row"] not in claimed]
+        remembered = match_memo.lookup(memo_scope, pending, available, item_names)
+        pending = remembered.missing
+        free_rows: Dict[str, List[int]] = {}
+        for entry in available:
+            free_rows.setdefault(entry["name"], []).append(entry["row"])
+        for product, entry in remembered.matched:
+            rows = free_rows.get(entry["name"])
+            if not rows:
+                pending.append(product)
+                continue
+            claimed.add(rows.pop(0))
+            resolution.matched.append((product, entry["name"]))
+        resolution.unique.extend(remembered.unique)
+        _emit(
+            progress,
+            "memo_matched",
+            matched=len(remembered.matched),
+            unique=len(remembered.unique),
+            missing=len(pending),
+        )
+
+    if pending:
+        reference_data = [{"name": p["name"]} for p in references if p["row"] not in claimed]
+        match_results = match_products_with_gemini(pending, reference_data, api_key)
+        if memo_scope:
+            match_memo.record(memo_scope, _gemini_match_decisions(pending, match_results), item_names)
+        _emit(
+            progress,
+            "matched",
+            matched=len(match_results.get("matchedItems", [])),
+            unique=len(match_results.get("uniqueItems", [])),
+        )
+        resolution.matched.extend((item, item.get("name", "")) for item in match_results.get("matchedItems", []))
+        resolution.unique.extend(match_results.get("uniqueItems", []))
+    return resolution
+
+
+def _link_new_products(
+    new_items: List[Dict[str, Any]],
+    earlier_names: List[str],
+    api_key: str | None = None,
+) -> Dict[int, str]:
+    # Which of a file's new products are the same item as a product first
+    # seen in an earlier file of the job, keyed by id() of the item.
+    links: Dict[int, str] = {}
+    pending = new_items
+    references = [{"name": name, "row": i} for i, name in enumerate(earlier_names)]
+    if settings.local_match_enabled:
+        local = LocalProductMatcher(
+            references,
+            accept_score=settings.local_match_accept_score,
+            reject_score=settings.local_match_reject_score,
+            margin=settings.local_match_margin,
+        ).match(pending)
+        links.update((id(item), entry["name"]) for item, entry in local.matched)
+        pending = local.ambiguous
+    if pending:
+        match_results = match_products_with_gemini(pending, [{"name": name} for name in earlier_names], api_key)
+        claimed: set[int] = set()
+        for item in match_results.get("matchedItems", []):
+            target = _target_for_match(pending, item, claimed)
+            if target is not None and item.get("name") in earlier_names:
+                links[id(target)] = item["name"]
+    return links
+
+
+def resolve_job_matches(
+    files: List[Tuple[int, Dict[str, Any]]],
+    product_index: ProductIndex,
+    progress: ProgressCallback | None = None,
+    api_key: str | None = None,
+    memo_scope: str | None = None,
+) -> Dict[int, MatchResolution]:
+    # Match every file's uncoded products before any sheet write, instead of
+    # one file at a time in the merge loop. files are (file_index, result)
+    # pairs in merge order. Two rounds of concurrent calls:
+    #   1. each file against the item list as it stands (one call per file
+    #      keeps the one-to-one rule per supplier);
+    #   2. each file's new products against the new products of earlier
+    #      files, so the same new item from several suppliers shares a row.
+    # Products whose code first appears in an earlier file are left out; the
+    # merge matches them by code or resolves them per file as before.
+    targets: List[List[Dict[str, Any]]] = []
+    seen_codes: set[str] = set()
+    for _, result in files:
+        file_targets = []
+        file_codes = set()
+        for product in result["data"].get("products", []):
+            code = extract_product_code(product.get("name", ""))
+            if code:
+                file_codes.add(code)
+                if product_index.row_for_code(code) is not None or code in seen_codes:
+                    continue
+            file_targets.append(product)
+        seen_codes |= file_codes
+        targets.append(file_targets)
+
+    references = list(product_index.products_no_code)
+    workers = max(1, min(settings.match_job_concurrency, len(files)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        resolutions = list(
+            executor.map(
+                lambda i: resolve_product_matches(
+                    targets[i],
+                    references,
+                    _file_progress(progress, files[i][0], files[i][1].get("file_name", "")),
+                    api_key,
+                    memo_scope,
+                ),
+                range(len(files)),
+            )
+        )
+
+        new_items = [[item for item in r.unique if not extract_product_code(item.get("name", ""))] for r in resolutions]
+        earlier: List[List[str]] = []
+        names: List[str] = []
+        seen_names: set[str] = set()
+        for items in new_items:
+            earlier.append(list(names))
+            for item in items:
+                name = clean_product_name(item.get("name"))
+                if name not in seen_names:
+                    seen_names.add(name)
+                    names.append(name)
+        link_futures = [
+            executor.submit(_link_new_products, items, earlier[i], api_key) if items and earlier[i] else None
+            for i, items in enumerate(new_items)
+        ]
+        links = [f.result() if f is not None else {} for f in link_futures]
+
+    # Follow links in file order so a chain (file 3 -> file 2 -> file 1)
+    # ends at the row that is actually created.
+    canonical: Dict[str, str] = {}
+    linked = 0
+    for resolution, items, file_links in zip(resolutions, new_items, links):
+        moved: set[int] = set()
+        for item in items:
+            name = clean_product_name(item.get("name"))
+            target = file_links.get(id(item))
+            if target is None:
+                canonical.setdefault(name, name)
+                continue
+            target = canonical.get(target, target)
+            canonical.setdefault(name, target)
+            resolution.matched.append((item, target))
+            moved.add(id(item))
+        resolution.unique = [item for item in resolution.unique if id(item) not in moved]
+        linked += len(moved)
+
+    _emit(
+        progress,
+        "job_matched",
+        files=len(files),
+        matched=sum(len(r.matched) for r in resolutions) - linked,
+        linked=linked,
+        unique=sum(len(r.unique) for r in resolutions),
+    )
+    return {idx: resolution for (idx, _), resolution in zip(files, resolutions)}
+
+
 def update_google_sheet_for_single_file(
     ws,
     data: Dict[str, Any],
-    existing_products: List[Dict[str, Any]],
+    product_index: ProductIndex,
     existing_suppliers: Dict[str, int],
-) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    progress: ProgressCallback | None = None,
+    api_key: str | None = None,
+    memo_scope: str | None = None,
+    resolved: MatchResolution | None = None,
+) -> Tuple[ProductIndex, Dict[str, int]]:
     start_row = HEADER_ROW + 1
 
-    summary_row_map: Dict[str, int] = {}
-    first_summary_row = -1
-    for p in existing_products:
-        if p["name"] in SUMMARY_LABELS:
-            if first_summary_row == -1:
-                first_summary_row = p["row"]
-            summary_row_map[p["name"]] = p["row"]
+    summary_row_map = product_index.rows_for_labels(SUMMARY_LABELS)
+    first_summary_row = min(summary_row_map.values(), default=-1)
 
     products = data.get("products", [])
     if not products:
-        return existing_products, existing_suppliers
+        return product_index, existing_suppliers
 
     company_name = data.get("company", "Unknown Company")
     col_idx = existing_suppliers.get(company_name, find_next_available_column(ws))
@@ -351,76 +853,59 @@ def update_google_sheet_for_single_file(
         },
     ]
 
-    code_to_row_map = {
-        extract_product_code(p["name"]): p["row"]
-        for p in existing_products
-        if extract_product_code(p["name"])
-    }
-    products_no_code = [p for p in existing_products if not extract_product_code(p["name"])]
-
     products_for_gemini: List[Dict[str, Any]] = []
     new_products: List[Dict[str, Any]] = []
     populated_rows: set[int] = set()
 
     for product in products:
-        code = extract_product_code(product.get("name", ""))
-        if code and code in code_to_row_map:
-            row_to_update = code_to_row_map[code]
+        row_to_update = product_index.row_for_code(extract_product_code(product.get("name", "")))
+        if row_to_update is not None:
             if row_to_update not in populated_rows:
-                batch_requests.append(
-                    {
-                        "range": f"{get_column_letter(col_idx)}{row_to_update}:{get_column_letter(col_idx + COLUMNS_PER_SUPPLIER - 1)}{row_to_update}",
-                        "values": [
-                            [
-                                product.get("quantity", 1),
-                                product.get("unit", "ชิ้น"),
-                                product.get("pricePerUnit", 0),
-                                product.get("totalPrice", 0),
-                            ]
-                        ],
-                    }
-                )
+                batch_requests.append(_supplier_row_request(col_idx, row_to_update, product))
                 populated_rows.add(row_to_update)
         else:
             products_for_gemini.append(product)
 
-    if products_for_gemini:
-        reference_data = [{"name": p["name"]} for p in products_no_code]
-        match_results = match_products_with_gemini(products_for_gemini, reference_data)
-
-        for item in match_results.get("matchedItems", []):
-            for existing in products_no_code:
-                if existing["name"] == item.get("name", "") and existing["row"] not in populated_rows:
-                    batch_requests.append(
-                        {
-                            "range": f"{get_column_letter(col_idx)}{existing['row']}:{get_column_letter(col_idx + COLUMNS_PER_SUPPLIER - 1)}{existing['row']}",
-                            "values": [
-                                [
-                                    item.get("quantity", 1),
-                                    item.get("unit", "ชิ้น"),
-                                    item.get("pricePerUnit", 0),
-                                    item.get("totalPrice", 0),
-                                ]
-                            ],
-                        }
-                    )
-                    populated_rows.add(existing["row"])
+    def apply_resolution(resolution: MatchResolution) -> None:
+        for item, reference_name in resolution.matched:
+            for existing_row in product_index.rows_without_code(reference_name):
+                if existing_row not in populated_rows:
+                    batch_requests.append(_supplier_row_request(col_idx, existing_row, item))
+                    populated_rows.add(existing_row)
                     break
-        new_products.extend(match_results.get("uniqueItems", []))
+        new_products.extend(resolution.unique)
 
-    insertion_row = first_summary_row if first_summary_row > 0 else (start_row + len(existing_products))
+    if resolved is not None:
+        # Decisions made up front for the whole job (see resolve_job_matches).
+        # They only stand if the products they cover still lack a code match.
+        resolved_ids = {id(p) for p in resolved.products}
+        if resolved_ids <= {id(p) for p in products_for_gemini}:
+            apply_resolution(resolved)
+            products_for_gemini = [p for p in products_for_gemini if id(p) not in resolved_ids]
+
+    if products_for_gemini:
+        apply_resolution(
+            resolve_product_matches(
+                products_for_gemini,
+                [p for p in product_index.products_no_code if p["row"] not in populated_rows],
+                progress,
+                api_key,
+                memo_scope,
+                [p["name"] for p in product_index.products_no_code],
+            )
+        )
+
+    insertion_row = first_summary_row if first_summary_row > 0 else (start_row + len(product_index))
 
     if new_products:
         final_new_products: List[Dict[str, Any]] = []
         for item in new_products:
-            if not any(
-                clean_product_name(existing["name"]) == clean_product_name(item.get("name"))
-                for existing in existing_products
-            ):
+            if not product_index.contains_name(item.get("name")):
                 final_new_products.append(item)
 
         if final_new_products:
             _insert_blank_rows(ws, len(final_new_products), insertion_row)
+            product_index.shift_rows(insertion_row, len(final_new_products))
             for i, product in enumerate(final_new_products):
                 row = insertion_row + i
                 product_name = clean_product_name(product.get("name", "Unknown Product"))
@@ -430,20 +915,8 @@ def update_google_sheet_for_single_file(
                         "values": [[product_name]],
                     }
                 )
-                batch_requests.append(
-                    {
-                        "range": f"{get_column_letter(col_idx)}{row}:{get_column_letter(col_idx + COLUMNS_PER_SUPPLIER - 1)}{row}",
-                        "values": [
-                            [
-                                product.get("quantity", 1),
-                                product.get("unit", "ชิ้น"),
-                                product.get("pricePerUnit", 0),
-                                product.get("totalPrice", 0),
-                            ]
-                        ],
-                    }
-                )
-                existing_products.append({"name": product_name, "row": row})
+                batch_requests.append(_supplier_row_request(col_idx, row, product))
+                product_index.add(product_name, row)
 
     if company_name not in existing_suppliers:
         existing_suppliers[company_name] = col_idx
@@ -488,8 +961,9 @@ def update_google_sheet_for_single_file(
 
     if batch_requests:
         _batch_update(ws, batch_requests)
+    _emit(progress, "written", company=company_name, column=col_idx)
 
-    return existing_products, existing_suppliers
+    return product_index, existing_suppliers
 
 
 def get_file_type(file_path: str) -> str:
@@ -507,63 +981,750 @@ def get_file_type(file_path: str) -> str:
     return "unknown"
 
 
-def _wait_for_file_active(uploaded_file, timeout: int = 180, poll: float = 1.0):
-    start = time.time()
-    name = getattr(uploaded_file, "name", None)
-    if not name:
-        return uploaded_file
-    while time.time() - start < timeout:
-        f2 = genai.get_file(name)
-        state = getattr(f2, "state", None)
+def _rate_limiter(api_key: str | None) -> KeyRateLimiter:
+    return key_rate_limiters.get(api_key or get_effective_google_api_key() or "")
+
+
+# Generation requests pass the key's rate limiter and their estimated token
+# count; every attempt, retries included, is charged to the key's RPM and
+# TPM budget before it is sent. File API calls have their own quota and pass
+# no limiter.
+def _gemini_call(
+    make_call: Callable[[], Any],
+    rate_limiter: KeyRateLimiter | None = None,
+    tokens: int = 0,
+) -> Any:
+    def call() -> Any:
+        if rate_limiter is not None:
+            rate_limiter.acquire(1, tokens)
+        return make_call()
+
+    return retry_call(
+        gemini_limiter,
+        call,
+        settings.gemini_retry_attempts,
+        settings.gemini_retry_base_delay,
+        settings.gemini_retry_max_delay,
+    )
+
+
+async def _gemini_call_async(
+    make_call: Callable[[], Awaitable[Any]],
+    rate_limiter: KeyRateLimiter | None = None,
+    tokens: int = 0,
+) -> Any:
+    async def call() -> Any:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(1, tokens)
+        return await make_call()
+
+    return await retry_call_async(
+        gemini_limiter,
+        call,
+        settings.gemini_retry_attempts,
+        settings.gemini_retry_base_delay,
+        settings.gemini_retry_max_delay,
+    )
+
+
+# File API calls are retried but do not feed the adaptive limit, which
+# tracks generation capacity; a burst of status polls would otherwise grow it.
+def _file_api_call(make_call: Callable[[], Any], retryable: Callable[[BaseException], bool] = is_retryable) -> Any:
+    return retry_call(
+        None,
+        make_call,
+        settings.gemini_retry_attempts,
+        settings.gemini_retry_base_delay,
+        settings.gemini_retry_max_delay,
+        retryable,
+    )
+
+
+def _upload_file(clients: GeminiKeyClients, file_path: str, file_name: str) -> Any:
+    # Only retried when refused outright: after a 5xx or a dropped connection
+    # the upload may have gone through, and a retry would leave a duplicate.
+    return _file_api_call(lambda: clients.upload_file(file_path, display_name=file_name), is_rate_limited)
+
+
+def _file_state_name(gemini_file) -> str:
+    # File.state is a proto enum, so compare by name rather than against a str.
+    state = getattr(gemini_file, "state", None)
+    return str(getattr(state, "name", state) or "")
+
+
+class _PendingUpload:
+    __slots__ = ("uploaded_file", "clients", "future", "deadline", "next_check", "delay", "errors")
+
+    def __init__(self, uploaded_file, clients: GeminiKeyClients, deadline: float, delay: float):
+        self.uploaded_file = uploaded_file
+        self.clients = clients
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.deadline = deadline
+        self.delay = delay
+        self.next_check = time.monotonic() + delay
+        self.errors = 0
+
+
+# Waits for uploaded files to leave PROCESSING. A single daemon thread checks
+# every pending upload when its next check is due; the first delay grows with
+# the file size and later delays back off geometrically. A failed status
+# check is retried as a later check rather than by sleeping on the thread,
+# which would hold up every other pending upload.
+class FileActivationWaiter:
+    def __init__(self, timeout: float, min_delay: float = 0.25, max_delay: float = 10.0):
+        self.timeout = timeout
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._pending: List[_PendingUpload] = []
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def _initial_delay(self, size_bytes: int) -> float:
+        size_mb = size_bytes / (1024 * 1024)
+        return min(5.0, max(self.min_delay, 0.25 + 0.2 * size_mb))
+
+    def submit(self, uploaded_file, size_bytes: int, clients: GeminiKeyClients) -> concurrent.futures.Future:
+        name = getattr(uploaded_file, "name", None)
+        if not name or _file_state_name(uploaded_file) == "ACTIVE":
+            done: concurrent.futures.Future = concurrent.futures.Future()
+            done.set_result(uploaded_file)
+            return done
+        entry = _PendingUpload(
+            uploaded_file,
+            clients,
+            deadline=time.monotonic() + self.timeout,
+            delay=self._initial_delay(size_bytes),
+        )
+        with self._cond:
+            self._pending.append(entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gemini-file-waiter", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return entry.future
+
+    def wait(self, uploaded_file, size_bytes: int, clients: GeminiKeyClients):
+        return self.submit(uploaded_file, size_bytes, clients).result()
+
+    async def wait_async(self, uploaded_file, size_bytes: int, clients: GeminiKeyClients):
+        return await asyncio.wrap_future(self.submit(uploaded_file, size_bytes, clients))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [e for e in self._pending if e.next_check <= now]
+                if not due:
+                    self._cond.wait(timeout=min(e.next_check for e in self._pending) - now)
+                    continue
+            finished = [e for e in due if self._check(e)]
+            if finished:
+                with self._cond:
+                    self._pending = [e for e in self._pending if e not in finished]
+
+    def _check(self, entry: _PendingUpload) -> bool:
+        name = entry.uploaded_file.name
+        try:
+            current = entry.clients.get_file(name)
+        except Exception as e:
+            entry.errors += 1
+            now = time.monotonic()
+            if not is_retryable(e) or entry.errors >= settings.gemini_retry_attempts or now >= entry.deadline:
+                entry.future.set_exception(e)
+                return True
+            delay = backoff_delay(entry.errors - 1, settings.gemini_retry_base_delay, settings.gemini_retry_max_delay)
+            entry.next_check = min(entry.deadline, now + max(self.min_delay, delay))
+            return False
+        entry.errors = 0
+        state = _file_state_name(current)
         if state == "ACTIVE":
-            return f2
-        time.sleep(poll)
-    return uploaded_file
+            entry.future.set_result(current)
+            return True
+        if state == "FAILED":
+            entry.future.set_exception(RuntimeError(f"Gemini could not process uploaded file {name}"))
+            return True
+        now = time.monotonic()
+        if now >= entry.deadline:
+            entry.future.set_result(entry.uploaded_file)
+            return True
+        entry.delay = min(self.max_delay, entry.delay * 1.6)
+        entry.next_check = min(entry.deadline, now + entry.delay)
+        return False
 
 
-def process_file(file_path: str) -> Dict[str, Any]:
-    file_name = os.path.basename(file_path)
-    tmp_file_path = None
-    uploaded_gemini_file = None
+file_activation_waiter = FileActivationWaiter(timeout=settings.file_active_timeout_seconds)
+
+
+def _inline_mime_type(file_path: str) -> str | None:
+    file_type = get_file_type(file_path)
+    if file_type == "pdf":
+        return "application/pdf"
+    if file_type == "image":
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if mime_type and mime_type.startswith("image/"):
+            return mime_type
+        return "image/png" if file_path.lower().endswith(".png") else "image/jpeg"
+    return None
 
-    with open(file_path, "rb") as src:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file_name)[1]) as tmp_file:
-            tmp_file.write(src.read())
-            tmp_file_path = tmp_file.name
 
-    uploaded_gemini_file = genai.upload_file(path=tmp_file_path, display_name=file_name)
-    uploaded_gemini_file = _wait_for_file_active(uploaded_gemini_file)
+def _read_inline_part(file_path: str) -> Dict[str, Any] | None:
+    mime_type = _inline_mime_type(file_path)
+    if not mime_type or os.path.getsize(file_path) > settings.inline_file_max_bytes:
+        return None
+    with open(file_path, "rb") as f:
+        return {"mime_type": mime_type, "data": f.read()}
+
+
+def _file_part_for_generation(
+    file_path: str, file_name: str, clients: GeminiKeyClients, progress: ProgressCallback | None = None
+) -> Tuple[Any, Any]:
+    inline_part = _read_inline_part(file_path)
+    if inline_part is not None:
+        _emit(progress, "uploaded", inline=True)
+        return inline_part, None
+    uploaded = _upload_file(clients, file_path, file_name)
+    _emit(progress, "uploaded", inline=False)
+    try:
+        part = file_activation_waiter.wait(uploaded, os.path.getsize(file_path), clients)
+    except BaseException:
+        clients.delete_file(uploaded.name)
+        raise
+    _emit(progress, "active")
+    return part, uploaded
+
+
+async def _file_part_for_generation_async(
+    file_path: str, file_name: str, clients: GeminiKeyClients, progress: ProgressCallback | None = None
+) -> Tuple[Any, Any]:
+    inline_part = await asyncio.to_thread(_read_inline_part, file_path)
+    if inline_part is not None:
+        _emit(progress, "uploaded", inline=True)
+        return inline_part, None
+    uploaded = await asyncio.to_thread(_upload_file, clients, file_path, file_name)
+    _emit(progress, "uploaded", inline=False)
+    try:
+        part = await file_activation_waiter.wait_async(uploaded, os.path.getsize(file_path), clients)
+    except BaseException:
+        await asyncio.to_thread(clients.delete_file, uploaded.name)
+        raise
+    _emit(progress, "active")
+    return part, uploaded
+
+
+def _extraction_model(clients: GeminiKeyClients, model_name: str, use_async: bool = False) -> genai.GenerativeModel:
+    return clients.model(
+        model_name,
+        _generation_config({"temperature": 0.1, "top_p": 0.95}, EXTRACTION_RESPONSE_SCHEMA),
+        SAFETY_SETTINGS,
+        use_async=use_async,
+    )
 
+
+def _prepare_extraction(file_path: str, use_cache: bool) -> Tuple[str, str | None, Dict[str, Any] | None]:
     file_type = get_file_type(file_path)
     prompt_to_use = image_prompt if file_type == "image" else prompt
 
-    model_flash = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        generation_config={"temperature": 0.1, "top_p": 0.95},
-        safety_settings=SAFETY_SETTINGS,
-    )
-    resp = model_flash.generate_content([prompt_to_use, uploaded_gemini_file])
-    d = extract_json_from_text(getattr(resp, "text", "") or "")
-
-    if not d or not d.get("products"):
-        model_pro = genai.GenerativeModel(
-            model_name="gemini-2.5-pro",
-            generation_config={"temperature": 0.1, "top_p": 0.95},
-            safety_settings=SAFETY_SETTINGS,
+    cache_key = None
+    cached = None
+    if extraction_cache.enabled:
+        cache_key = make_extraction_key(
+            file_sha256(file_path),
+            prompt_to_use,
+            f"{EXTRACTION_MODEL}|{EXTRACTION_FALLBACK_MODEL}",
+            EXTRACTION_RESPONSE_SCHEMA if settings.gemini_structured_output else None,
         )
-        resp_pro = model_pro.generate_content([prompt_to_use, uploaded_gemini_file])
-        d = extract_json_from_text(getattr(resp_pro, "text", "") or "")
+        if use_cache:
+            cached = extraction_cache.get(cache_key)
+    return prompt_to_use, cache_key, cached
 
+
+def _finish_extraction(d: Dict[str, Any] | None, cache_key: str | None) -> Dict[str, Any] | None:
     d = validate_json_data(d) if d else None
 
-    result = {"file_name": file_name, "data": d}
+    # Only successful extractions are cached so an empty answer gets retried next time.
+    if cache_key and d and d.get("products"):
+        extraction_cache.put(cache_key, d)
+    return d
+
+
+def process_file(
+    file_path: str,
+    use_cache: bool = True,
+    progress: ProgressCallback | None = None,
+    api_key: str | None = None,
+) -> Dict[str, Any]:
+    file_name = os.path.basename(file_path)
+
+    prompt_to_use, cache_key, cached = _prepare_extraction(file_path, use_cache)
+    if cached is not None:
+        _emit(progress, "extracted", cached=True, data=cached)
+        return {"file_name": file_name, "data": cached}
+
+    clients = gemini_clients.get(api_key)
+    file_part, uploaded_gemini_file = _file_part_for_generation(file_path, file_name, clients, progress)
+    try:
+        contents = [prompt_to_use, file_part]
+
+        rate_limiter = _rate_limiter(api_key)
+        resp = _gemini_call(
+            lambda: _extraction_model(clients, EXTRACTION_MODEL).generate_content(contents),
+            rate_limiter,
+            settings.scheduler_tokens_per_file,
+        )
+        d = _response_json(resp)
+        _emit(progress, "flash_done", products=len((d or {}).get("products") or []))
+
+        if not d or not d.get("products"):
+            _emit(progress, "pro_fallback", reason="no_products" if d else "no_json")
+            resp_pro = _gemini_call(
+                lambda: _extraction_model(clients, EXTRACTION_FALLBACK_MODEL).generate_content(contents),
+                rate_limiter,
+                settings.scheduler_tokens_per_file,
+            )
+            d = _response_json(resp_pro)
+    finally:
+        if uploaded_gemini_file:
+            clients.delete_file(uploaded_gemini_file.name)
+
+    d = _finish_extraction(d, cache_key)
+    _emit(progress, "extracted", cached=False, data=d)
+    return {"file_name": file_name, "data": d}
+
+
+async def process_file_async(
+    file_path: str,
+    use_cache: bool = True,
+    progress: ProgressCallback | None = None,
+    api_key: str | None = None,
+) -> Dict[str, Any]:
+    file_name = os.path.basename(file_path)
+
+    prompt_to_use, cache_key, cached = await asyncio.to_thread(_prepare_extraction, file_path, use_cache)
+    if cached is not None:
+        _emit(progress, "extracted", cached=True, data=cached)
+        return {"file_name": file_name, "data": cached}
+
+    # The File API has no async variant in the SDK, so upload/get/delete run on
+    # the default executor; generation uses the native async client.
+    clients = gemini_clients.get(api_key)
+    file_part, uploaded_gemini_file = await _file_part_for_generation_async(file_path, file_name, clients, progress)
+    try:
+        contents = [prompt_to_use, file_part]
+
+        rate_limiter = _rate_limiter(api_key)
+        resp = await _gemini_call_async(
+            lambda: _extraction_model(clients, EXTRACTION_MODEL, use_async=True).generate_content_async(contents),
+            rate_limiter,
+            settings.scheduler_tokens_per_file,
+        )
+        d = _response_json(resp)
+        _emit(progress, "flash_done", products=len((d or {}).get("products") or []))
+
+        if not d or not d.get("products"):
+            _emit(progress, "pro_fallback", reason="no_products" if d else "no_json")
+            resp_pro = await _gemini_call_async(
+                lambda: _extraction_model(clients, EXTRACTION_FALLBACK_MODEL, use_async=True).generate_content_async(contents),
+                rate_limiter,
+                settings.scheduler_tokens_per_file,
+            )
+            d = _response_json(resp_pro)
+    finally:
+        if uploaded_gemini_file:
+            await asyncio.to_thread(clients.delete_file, uploaded_gemini_file.name)
+
+    d = await asyncio.to_thread(_finish_extraction, d, cache_key)
+    _emit(progress, "extracted", cached=False, data=d)
+    return {"file_name": file_name, "data": d}
+
+
+class _ScheduledTask:
+    __slots__ = ("job_id", "api_key", "fn", "args", "tokens", "future")
+
+    def __init__(self, job_id: str, api_key: str, fn: Callable[..., Any], args: tuple, tokens: int):
+        self.job_id = job_id
+        self.api_key = api_key
+        self.fn = fn
+        self.args = args
+        self.tokens = tokens
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+# Process-wide queue for file extraction tasks. It runs its own event loop on
+# a daemon thread so both the async engine and the thread fallback share one
+# adaptive concurrency limit, one rate limiter per API key, and round-robin
+# dispatch across jobs.
+class ExtractionScheduler:
+    def __init__(
+        self,
+        max_concurrency: int,
+        rate_limiters: KeyRateLimiterRegistry,
+        limiter: AdaptiveConcurrencyLimiter | None = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limiter = limiter
+        self.limiters = rate_limiters
+        self._queues: Dict[str, Deque[_ScheduledTask]] = {}
+        self._rotation: Deque[str] = deque()
+        self._active = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                ready = threading.Event()
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_concurrency, thread_name_prefix="extraction"
+                )
+
+                def run() -> None:
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    self._wake = asyncio.Event()
+                    self._loop = loop
+                    ready.set()
+                    loop.run_until_complete(self._dispatch_forever())
+
+                threading.Thread(target=run, name="extraction-scheduler", daemon=True).start()
+                ready.wait()
+                if self.limiter is not None:
+                    # Matching calls share the limiter; wake up when they
+                    # hand a slot back.
+                    loop = self._loop
+                    self.limiter.add_release_listener(lambda: loop.call_soon_threadsafe(self._wake.set))
+            return self._loop
+
+    def submit(
+        self,
+        job_id: str,
+        api_key: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        tokens: int | None = None,
+    ) -> concurrent.futures.Future:
+        task = _ScheduledTask(
+            job_id,
+            api_key,
+            fn,
+            args,
+            settings.scheduler_tokens_per_file if tokens is None else tokens,
+        )
+        loop = self._ensure_started()
+        loop.call_soon_threadsafe(self._enqueue, task)
+        return task.future
+
+    def cancel_job(self, job_id: str) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._drop_job, job_id)
+
+    @property
+    def concurrency_limit(self) -> int:
+        if self.limiter is None:
+            return self.max_concurrency
+        return min(self.max_concurrency, self.limiter.limit)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "concurrency_limit": self.concurrency_limit,
+            "active": self._active,
+            "queued": {job_id: len(q) for job_id, q in list(self._queues.items())},
+        }
 
-    if tmp_file_path:
-        os.unlink(tmp_file_path)
-    if uploaded_gemini_file:
-        genai.delete_file(uploaded_gemini_file.name)
+    def _enqueue(self, task: _ScheduledTask) -> None:
+        queue = self._queues.get(task.job_id)
+        if queue is None:
+            queue = self._queues[task.job_id] = deque()
+            self._rotation.append(task.job_id)
+        queue.append(task)
+        self._wake.set()
+
+    def _drop_job(self, job_id: str) -> None:
+        queue = self._queues.pop(job_id, None)
+        if queue is None:
+            return
+        self._rotation.remove(job_id)
+        for task in queue:
+            task.future.cancel()
+
+    def _next_task(self) -> Tuple[_ScheduledTask | None, float]:
+        min_wait = 0.0
+        for _ in range(len(self._rotation)):
+            job_id = self._rotation[0]
+            self._rotation.rotate(-1)
+            queue = self._queues[job_id]
+            task = queue[0]
+            # Only checks the key's budget; each Gemini request charges it
+            # when sent, so a task is not started just to block on it.
+            wait = self.limiters.get(task.api_key).wait_time(1, task.tokens)
+            if wait > 0:
+                min_wait = wait if min_wait == 0 else min(min_wait, wait)
+                continue
+            queue.popleft()
+            if not queue:
+                del self._queues[job_id]
+                self._rotation.remove(job_id)
+            return task, 0.0
+        return None, min_wait
+
+    async def _dispatch_forever(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._rotation and self._active < self.max_concurrency:
+                # Extraction tasks and matching calls draw from the same
+                # adaptive limit; a slot is taken before a task is picked.
+                if self.limiter is not None and not self.limiter.try_acquire():
+                    break
+                task, wait = self._next_task()
+                if task is None or not task.future.set_running_or_notify_cancel():
+                    # Handing back a slot that was never used must not wake
+                    # this loop again through the release listener.
+                    self._release_slot(notify_listeners=False)
+                    if task is None:
+                        if wait > 0:
+                            self._loop.call_later(wait, self._wake.set)
+                        break
+                    continue
+                self._active += 1
+                self._loop.create_task(self._run(task))
+
+    def _release_slot(self, notify_listeners: bool = True) -> None:
+        if self.limiter is not None:
+            self.limiter.release(notify_listeners)
+
+    async def _run(self, task: _ScheduledTask) -> None:
+        try:
+            if asyncio.iscoroutinefunction(task.fn):
+                result = await task.fn(*task.args)
+            else:
+                result = await self._loop.run_in_executor(self._executor, task.fn, *task.args)
+            task.future.set_result(result)
+        except BaseException as e:
+            task.future.set_exception(e)
+        finally:
+            self._active -= 1
+            self._release_slot()
+            self._wake.set()
+
+
+extraction_scheduler = ExtractionScheduler(
+    max_concurrency=settings.extraction_concurrency,
+    rate_limiters=key_rate_limiters,
+    limiter=gemini_limiter,
+)
+
+
+def read_sheet_state(sheet_values: List[List[Any]]) -> Tuple[ProductIndex, Dict[str, int]]:
+    product_index = ProductIndex()
+    for row_idx, row in enumerate(sheet_values[HEADER_ROW:], start=HEADER_ROW + 1):
+        if len(row) >= ITEM_MASTER_LIST_COL:
+            name = str(row[ITEM_MASTER_LIST_COL - 1] or "").strip()
+            if name and name not in SUMMARY_LABELS:
+                product_index.add(name, row_idx)
+
+    live_existing_suppliers: Dict[str, int] = {}
+    header_row_values = sheet_values[COMPANY_NAME_ROW - 1] if sheet_values else []
+    for col_idx in range(ITEM_MASTER_LIST_COL + 1, len(header_row_values) + 1, COLUMNS_PER_SUPPLIER):
+        supplier_name = str(header_row_values[col_idx - 1] or "").strip()
+        if supplier_name:
+            live_existing_suppliers[supplier_name] = col_idx
+
+    return product_index, live_existing_suppliers
+
+
+# Merges extraction results into the worksheet strictly in file order, so the
+# supplier column layout matches the upload order, while accepting results in
+# whatever order they finish. A file is merged as soon as every earlier file
+# has been merged or has failed. With a SheetMirror the merge only touches the
+# local grid; flush() sends it to Google Sheets, every `checkpoint_files`
+# merged files and once at the end of the job.
+class OrderedSheetMerger:
+    def __init__(
+        self,
+        ws,
+        progress: ProgressCallback | None = None,
+        checkpoint_files: int = 0,
+        api_key: str | None = None,
+        memo_scope: str | None = None,
+        match_mode: str = MATCH_MODE_JOB,
+        lease: SheetLease | None = None,
+        cancel: threading.Event | None = None,
+    ):
+        self.ws = ws
+        self.cancel = cancel
+        # Held from the bootstrap read until the last flush so no other job
+        # writes to the same sheet from a stale snapshot in between.
+        self.lease = lease
+        self.progress = progress
+        self.checkpoint_files = checkpoint_files
+        self.api_key = api_key
+        self.memo_scope = memo_scope
+        # In job mode files are only collected by offer(); matching and sheet
+        # writes for all of them happen together in finish(), with one
+        # matching call per partition instead of one per file. File mode
+        # merges while later files are still extracting, at the cost of
+        # those extra calls.
+        self.match_mode = normalize_match_mode(match_mode)
+        self.product_index, self.existing_suppliers = read_sheet_state(ws.get_all_values())
+        self.results: List[Dict[str, Any]] = []
+        self._pending: Dict[int, Dict[str, Any] | None] = {}
+        self._next_index = 0
+        self._unflushed_files = 0
+
+    @property
+    def merge_plan(self) -> Dict[str, Any] | None:
+        plan = getattr(self.ws, "plan", None)
+        return plan.to_dict() if plan is not None else None
+
+    def offer(self, idx: int, file_result: Dict[str, Any] | None) -> None:
+        self._pending[idx] = file_result
+        if self.match_mode != MATCH_MODE_JOB:
+            self._merge_ready()
+
+    def finish(self) -> None:
+        if self.match_mode != MATCH_MODE_JOB or not self._pending:
+            return
+        files = [(idx, r) for idx, r in sorted(self._pending.items()) if r and "data" in r and r["data"]]
+        try:
+            resolved = resolve_job_matches(files, self.product_index, self.progress, self.api_key, self.memo_scope)
+        except Exception as e:
+            # Fall back to matching file by file so one failed call does not
+            # cost the whole job's output; checkpoints still apply below.
+            _emit(self.progress, "job_match_failed", error=str(e))
+            resolved = None
+        self._merge_ready(resolved)
+
+    def _merge_ready(self, resolved: Dict[int, MatchResolution] | None = None) -> None:
+        while self._next_index in self._pending:
+            r = self._pending.pop(self._next_index)
+            if r and "data" in r and r["data"]:
+                self.product_index, self.existing_suppliers = update_google_sheet_for_single_file(
+                    self.ws,
+                    r["data"],
+                    self.product_index,
+                    self.existing_suppliers,
+                    _file_progress(self.progress, self._next_index, r.get("file_name", "")),
+                    self.api_key,
+                    self.memo_scope,
+                    (resolved or {}).get(self._next_index),
+                )
+                self.results.append(r["data"])
+                self._unflushed_files += 1
+                if self.checkpoint_files > 0 and self._unflushed_files >= self.checkpoint_files:
+                    self.flush()
+            self._next_index += 1
+
+    def flush(self) -> None:
+        _raise_if_cancelled(self.cancel)
+        if isinstance(self.ws, SheetMirror):
+            if self.lease is not None and self.ws.pending_requests:
+                self.lease.ensure_held()
+            sent = self.ws.flush()
+            if sent:
+                _emit(self.progress, "sheet_flushed", requests=sent, files=self._unflushed_files)
+        self._unflushed_files = 0
+
+    def close(self) -> None:
+        if self.lease is not None:
+            self.lease.release()
+
+
+def _open_sheet_merger(
+    sheet_id: str | None,
+    gcp_service_account_json: str,
+    progress: ProgressCallback | None = None,
+    api_key: str | None = None,
+    output_format: str = OUTPUT_FORMAT_BOTH,
+    cancel: threading.Event | None = None,
+) -> OrderedSheetMerger:
+    if output_format == OUTPUT_FORMAT_EXCEL:
+        # Excel-only jobs never touch Google Sheets: the merge starts from the
+        # Excel template and only the merge plan is kept. Imported here since
+        # excel_template itself imports this module.
+        from .excel_template import template_bootstrap_values
+
+        values = template_bootstrap_values()
+        return OrderedSheetMerger(
+            SheetMirror(None, values, plan=MergePlan(values, header_rows=HEADER_ROW, name_col=ITEM_MASTER_LIST_COL)),
+            progress,
+            0,
+            api_key,
+            EXCEL_TEMPLATE_MEMO_SCOPE,
+            settings.match_mode,
+            cancel=cancel,
+        )
 
-    return result
+    target_sheet_id = extract_sheet_id_from_url(sheet_id) or DEFAULT_SHEET_ID
+    lease = sheet_locks.acquire(target_sheet_id)
+    try:
+        ws = authenticate_and_open_sheet(target_sheet_id, gcp_service_account_json)
+        try:
+            values = read_bootstrap_values(ws, HEADER_ROW, ITEM_MASTER_LIST_COL)
+        except Exception:
+            # The pooled handle may point at a sheet that was renamed or deleted.
+            gspread_pool.invalidate(target_sheet_id, gcp_service_account_json)
+            ws = authenticate_and_open_sheet(target_sheet_id, gcp_service_account_json)
+            values = read_bootstrap_values(ws, HEADER_ROW, ITEM_MASTER_LIST_COL)
+        mirror = SheetMirror(
+            ws,
+            values,
+            plan=MergePlan(values, header_rows=HEADER_ROW, name_col=ITEM_MASTER_LIST_COL),
+            on_refresh=lambda fresh: gspread_pool.replace(target_sheet_id, gcp_service_account_json, fresh),
+        )
+        return OrderedSheetMerger(
+            mirror,
+            progress,
+            settings.sheet_checkpoint_files,
+            api_key,
+            target_sheet_id,
+            settings.match_mode,
+            lease,
+            cancel,
+        )
+    except BaseException:
+        lease.release()
+        raise
+
+
+def _close_merger_when_opened(merger_future: Any) -> None:
+    # Works for both concurrent.futures.Future and asyncio tasks; if the
+    # merger is still being opened, it is closed as soon as it exists.
+    def close(future: Any) -> None:
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    merger_future.add_done_callback(close)
+
+
+def _finish_merge(
+    merger: OrderedSheetMerger,
+    output_format: str,
+    render_excel: Callable[[Dict[str, Any]], Any] | None,
+    progress: ProgressCallback | None = None,
+) -> None:
+    merger.finish()
+    # The sheet write and the xlsx render both come from the same merge plan,
+    # so for "Both" they run side by side.
+    merge_plan = merger.merge_plan
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        flush_future = executor.submit(merger.flush) if output_format != OUTPUT_FORMAT_EXCEL else None
+        render_future = None
+        if render_excel is not None and merge_plan is not None and output_format != OUTPUT_FORMAT_SHEET:
+            render_future = executor.submit(render_excel, merge_plan)
+        if render_future is not None:
+            try:
+                render_future.result()
+                _emit(progress, "excel_rendered")
+            except Exception as e:
+                # The download endpoint renders it again on demand.
+                _emit(progress, "excel_failed", error=str(e))
+        if flush_future is not None:
+            flush_future.result()
 
 
 def process_files(
@@ -571,53 +1732,128 @@ def process_files(
     sheet_id: str | None,
     google_api_key: str,
     gcp_service_account_json: str,
-) -> Tuple[List[Dict[str, Any]], List[str]]:
-    genai.configure(api_key=google_api_key)
-    data_by_index: Dict[int, Dict[str, Any]] = {}
+    use_cache: bool = True,
+    job_id: str | None = None,
+    progress: ProgressCallback | None = None,
+    output_format: str = OUTPUT_FORMAT_BOTH,
+    render_excel: Callable[[Dict[str, Any]], Any] | None = None,
+    cancel: threading.Event | None = None,
+) -> Tuple[List[Dict[str, Any]], List[str], Dict[str, Any] | None]:
     errors: List[str] = []
     total_files = len(file_paths)
 
     if total_files == 0:
-        return [], []
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(total_files, 8)) as executor:
-        future_to_index = {executor.submit(process_file, path): idx for idx, path in enumerate(file_paths)}
-        for future in concurrent.futures.as_completed(future_to_index):
-            idx = future_to_index[future]
-            result = future.result()
-            data_by_index[idx] = result
-
-    results: List[Dict[str, Any]] = []
-    if data_by_index:
-        target_sheet_id = extract_sheet_id_from_url(sheet_id) or DEFAULT_SHEET_ID
-        ws = authenticate_and_open_sheet(target_sheet_id, gcp_service_account_json)
-        initial_sheet_values = ws.get_all_values()
-
-        live_existing_products: List[Dict[str, Any]] = []
-        for row_idx, row in enumerate(initial_sheet_values[HEADER_ROW:], start=HEADER_ROW + 1):
-            if (
-                len(row) >= ITEM_MASTER_LIST_COL
-                and row[ITEM_MASTER_LIST_COL - 1].strip()
-                and row[ITEM_MASTER_LIST_COL - 1].strip() not in SUMMARY_LABELS
-            ):
-                live_existing_products.append({"name": row[ITEM_MASTER_LIST_COL - 1].strip(), "row": row_idx})
-
-        live_existing_suppliers: Dict[str, int] = {}
-        header_row_values = initial_sheet_values[COMPANY_NAME_ROW - 1] if initial_sheet_values else []
-        for col_idx in range(ITEM_MASTER_LIST_COL + 1, len(header_row_values) + 1, COLUMNS_PER_SUPPLIER):
-            supplier_name = header_row_values[col_idx - 1].strip() if (col_idx - 1) < len(header_row_values) else ""
-            if supplier_name:
-                live_existing_suppliers[supplier_name] = col_idx
-
-        for i, idx in enumerate(sorted(data_by_index.keys())):
-            r = data_by_index[idx]
-            if r and "data" in r and r["data"]:
-                live_existing_products, live_existing_suppliers = update_google_sheet_for_single_file(
-                    ws, r["data"], live_existing_products, live_existing_suppliers
-                )
-                results.append(r["data"])
+        return [], [], None
+
+    job_id = job_id or str(uuid.uuid4())
+    future_to_index = {
+        extraction_scheduler.submit(
+            job_id,
+            google_api_key,
+            process_file,
+            path,
+            use_cache,
+            _file_progress(progress, idx, os.path.basename(path)),
+            google_api_key,
+        ): idx
+        for idx, path in enumerate(file_paths)
+    }
+    # The sheet is opened and read while the first files are still extracting.
+    sheet_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    merger_future = sheet_executor.submit(
+        _open_sheet_merger, sheet_id, gcp_service_account_json, progress, google_api_key, output_format, cancel
+    )
+    sheet_executor.shutdown(wait=False)
+    try:
+        try:
+            for future in concurrent.futures.as_completed(future_to_index):
+                _raise_if_cancelled(cancel)
+                idx = future_to_index[future]
+                try:
+                    file_result = future.result()
+                except Exception as e:
+                    file_result = None
+                    errors.append(f"{os.path.basename(file_paths[idx])}: {e}")
+                    _emit(progress, "file_failed", file_index=idx, file_name=os.path.basename(file_paths[idx]), error=str(e))
+                merger_future.result().offer(idx, file_result)
+        finally:
+            extraction_scheduler.cancel_job(job_id)
+
+        merger = merger_future.result()
+        _raise_if_cancelled(cancel)
+        _finish_merge(merger, output_format, render_excel, progress)
+        return merger.results, errors, merger.merge_plan
+    finally:
+        _close_merger_when_opened(merger_future)
+
+
+async def process_files_async(
+    file_paths: List[str],
+    sheet_id: str | None,
+    google_api_key: str,
+    gcp_service_account_json: str,
+    use_cache: bool = True,
+    job_id: str | None = None,
+    progress: ProgressCallback | None = None,
+    output_format: str = OUTPUT_FORMAT_BOTH,
+    render_excel: Callable[[Dict[str, Any]], Any] | None = None,
+) -> Tuple[List[Dict[str, Any]], List[str], Dict[str, Any] | None]:
+    errors: List[str] = []
 
-    return results, errors
+    if not file_paths:
+        return [], [], None
+
+    job_id = job_id or str(uuid.uuid4())
+    futures = [
+        extraction_scheduler.submit(
+            job_id,
+            google_api_key,
+            process_file_async,
+            path,
+            use_cache,
+            _file_progress(progress, idx, os.path.basename(path)),
+            google_api_key,
+        )
+        for idx, path in enumerate(file_paths)
+    ]
+
+    async def indexed(idx: int, future: concurrent.futures.Future) -> Tuple[int, Any]:
+        try:
+            return idx, await asyncio.wrap_future(future)
+        except Exception as e:
+            return idx, e
+
+    # The sheet is opened and read while the first files are still extracting.
+    # The task is never cancelled: the thread behind it may be about to take
+    # the sheet lease, which has to be released once it has. Merges run in
+    # threads too, so a cancelled job sets cancel to stop their sheet writes.
+    cancel = threading.Event()
+    merger_task = asyncio.ensure_future(
+        asyncio.to_thread(
+            _open_sheet_merger, sheet_id, gcp_service_account_json, progress, google_api_key, output_format, cancel
+        )
+    )
+    try:
+        try:
+            for completed in asyncio.as_completed([indexed(idx, f) for idx, f in enumerate(futures)]):
+                idx, result = await completed
+                if isinstance(result, BaseException):
+                    errors.append(f"{os.path.basename(file_paths[idx])}: {result}")
+                    _emit(progress, "file_failed", file_index=idx, file_name=os.path.basename(file_paths[idx]), error=str(result))
+                    result = None
+                merger = await asyncio.shield(merger_task)
+                await asyncio.to_thread(merger.offer, idx, result)
+        finally:
+            extraction_scheduler.cancel_job(job_id)
+
+        merger = await asyncio.shield(merger_task)
+        await asyncio.to_thread(_finish_merge, merger, output_format, render_excel, progress)
+        return merger.results, errors, merger.merge_plan
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+    finally:
+        _close_merger_when_opened(merger_task)
 
 
 prompt = """# System Message for Product List Extraction (PDF/Text Table Processing)
@@ -957,6 +2193,7 @@ All three products are mapped to the canonical name `1BR+2BR(57-70sqm.) - Hood -
   "matchedItems": [
     {{
       "name": "The canonical reference name this product matched to.",
+      "targetName": "The target product's name exactly as given in target_products.",
       "quantity": "target quantity",
       "unit": "target unit",
       "pricePerUnit": "target price per unit",
@@ -980,3 +2217,66 @@ All three products are mapped to the canonical name `1BR+2BR(57-70sqm.) - Hood -
 ## Reference Products:
 {reference_products}
 """
+
+
+_PRICED_ITEM_PROPERTIES = {
+    "quantity": {"type": "number"},
+    "unit": {"type": "string"},
+    "pricePerUnit": {"type": "number"},
+    "totalPrice": {"type": "number"},
+}
+
+# Response schemas for Gemini's structured output mode. They mirror the JSON
+# shapes described in `prompt`/`image_prompt` and `matching_prompt`.
+EXTRACTION_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "company": {"type": "string"},
+        "vat": {"type": "boolean"},
+        "name": {"type": "string", "nullable": True},
+        "contact": {"type": "string", "nullable": True},
+        "priceGuaranteeDay": {"type": "number", "nullable": True},
+        "deliveryTime": {"type": "string"},
+        "paymentTerms": {"type": "string"},
+        "otherNotes": {"type": "string"},
+        "products": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, **_PRICED_ITEM_PROPERTIES},
+                "required": ["name", "quantity", "unit", "pricePerUnit", "totalPrice"],
+            },
+        },
+        "totalPrice": {"type": "number"},
+        "totalVat": {"type": "number"},
+        "totalPriceIncludeVat": {"type": "number"},
+    },
+    "required": ["company", "products"],
+}
+
+MATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "matchedItems": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "The canonical reference name this product matched to."},
+                    "targetName": {"type": "string", "description": "The target product's name exactly as given."},
+                    **_PRICED_ITEM_PROPERTIES,
+                },
+                "required": ["name", "targetName", "quantity", "unit", "pricePerUnit", "totalPrice"],
+            },
+        },
+        "uniqueItems": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, **_PRICED_ITEM_PROPERTIES},
+                "required": ["name", "quantity", "unit", "pricePerUnit", "totalPrice"],
+            },
+        },
+    },
+    "required": ["matchedItems", "uniqueItems"],
+}
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple, Type, TypeVar
+
+try:
+    from requests import exceptions as requests_exceptions
+except ImportError:  # only present through the google-api-core transport
+    requests_exceptions = None
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_per_second)
+            self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= amount:
+                return 0.0
+            return (amount - self._tokens) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+
+# RPM and TPM buckets for one API key; a limit of 0 disables that bucket.
+# try_acquire checks and charges both buckets under one lock, so two callers
+# cannot both see enough budget and overdraw it together.
+class KeyRateLimiter:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60.0) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, tpm / 60.0) if tpm > 0 else None
+        self._lock = threading.Lock()
+
+    def wait_time(self, requests: int = 1, tokens: int = 0) -> float:
+        waits = [
+            bucket.wait_time(amount)
+            for bucket, amount in ((self.requests, requests), (self.tokens, tokens))
+            if bucket is not None
+        ]
+        return max(waits, default=0.0)
+
+    def try_acquire(self, requests: int = 1, tokens: int = 0) -> float:
+        with self._lock:
+            wait = self.wait_time(requests, tokens)
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.consume(requests)
+            if self.tokens is not None:
+                self.tokens.consume(tokens)
+            return 0.0
+
+    def acquire(self, requests: int = 1, tokens: int = 0) -> None:
+        while True:
+            wait = self.try_acquire(requests, tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, requests: int = 1, tokens: int = 0) -> None:
+        while True:
+            wait = self.try_acquire(requests, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def api_key_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class KeyRateLimiterRegistry:
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._limiters: Dict[str, KeyRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str) -> KeyRateLimiter:
+        key_id = api_key_id(api_key)
+        with self._lock:
+            limiter = self._limiters.get(key_id)
+            if limiter is None:
+                limiter = KeyRateLimiter(self.rpm, self.tpm)
+                self._limiters[key_id] = limiter
+            return limiter
+
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+OVERLOAD_STATUS_CODES = {429, 503}
+
+# The File API goes through requests, whose connection errors and timeouts
+# are not subclasses of the builtin ones.
+RETRYABLE_EXCEPTIONS: Tuple[Type[BaseException], ...] = (ConnectionError, TimeoutError)
+if requests_exceptions is not None:
+    RETRYABLE_EXCEPTIONS += (requests_exceptions.ConnectionError, requests_exceptions.Timeout)
+
+
+def error_status(exc: BaseException) -> int | None:
+    # google.api_core errors carry the HTTP status in .code; the discovery-based
+    # File API raises googleapiclient HttpError with it in .resp.status.
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    if status is None:
+        status = getattr(exc, "status_code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, RETRYABLE_EXCEPTIONS):
+        return True
+    return error_status(exc) in RETRYABLE_STATUS_CODES
+
+
+def is_overload(exc: BaseException) -> bool:
+    return error_status(exc) in OVERLOAD_STATUS_CODES
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    # A 429 is refused before any work is done, so even a non-idempotent call
+    # such as a file upload can be sent again.
+    return error_status(exc) == 429
+
+
+# Additive-increase / multiplicative-decrease limit on in-flight work. Work
+# takes a slot with try_acquire()/acquire() (or slot()) and gives it back
+# with release(). A success grows the limit by 1/limit (about +1 per full
+# window of calls), but only while in-flight work is at or near the limit,
+# so an idle or lightly used limiter does not drift up to max_limit. A
+# 429/503 cuts it by decrease_factor, at most once per cooldown so a single
+# burst of rejections only counts once. Blocked acquire() callers go before
+# try_acquire() ones, and release listeners let a dispatcher that only polls
+# with try_acquire() know a slot is free again.
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial: float,
+        min_limit: float,
+        max_limit: float,
+        decrease_factor: float = 0.5,
+        cooldown_seconds: float = 2.0,
+    ):
+        self.min_limit = max(1.0, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self._limit = min(self.max_limit, max(self.min_limit, initial))
+        self._last_decrease = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def add_release_listener(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self._listeners.append(callback)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._waiting or self._in_flight >= int(self._limit):
+                return False
+            self._in_flight += 1
+            return True
+
+    def acquire(self) -> None:
+        with self._changed:
+            self._waiting += 1
+            try:
+                while self._in_flight >= int(self._limit):
+                    self._changed.wait()
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+
+    def release(self, notify_listeners: bool = True) -> None:
+        with self._changed:
+            self._in_flight -= 1
+            self._changed.notify()
+            listeners = list(self._listeners) if notify_listeners else []
+        for callback in listeners:
+            callback()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self) -> None:
+        with self._changed:
+            if self._in_flight < self._limit - 1:
+                return
+            previous = int(self._limit)
+            self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            if int(self._limit) > previous:
+                self._changed.notify_all()
+
+    def on_overload(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown_seconds:
+                return
+            self._last_decrease = now
+            self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+        }
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    return random.uniform(0, min(max_delay, base_delay * (2**attempt)))
+
+
+# limiter is None for calls that should not steer the adaptive concurrency
+# limit (File API polls, uploads); retryable decides which errors are worth
+# another attempt.
+def retry_call(
+    limiter: AdaptiveConcurrencyLimiter | None,
+    make_call: Callable[[], T],
+    attempts: int,
+    base_delay: float,
+    max_delay: float,
+    retryable: Callable[[BaseException], bool] = is_retryable,
+) -> T:
+    for attempt in range(attempts):
+        try:
+            result = make_call()
+        except Exception as e:
+            if limiter is not None and is_overload(e):
+                limiter.on_overload()
+            if attempt == attempts - 1 or not retryable(e):
+                raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        if limiter is not None:
+            limiter.on_success()
+        return result
+    raise RuntimeError("retry_call needs at least one attempt")
+
+
+async def retry_call_async(
+    limiter: AdaptiveConcurrencyLimiter | None,
+    make_call: Callable[[], Awaitable[T]],
+    attempts: int,
+    base_delay: float,
+    max_delay: float,
+    retryable: Callable[[BaseException], bool] = is_retryable,
+) -> T:
+    for attempt in range(attempts):
+        try:
+            result = await make_call()
+        except Exception as e:
+            if limiter is not None and is_overload(e):
+                limiter.on_overload()
+            if attempt == attempts - 1 or not retryable(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        if limiter is not None:
+            limiter.on_success()
+        return result
+    raise RuntimeError("retry_call_async needs at least one attempt")
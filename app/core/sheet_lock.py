@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from .config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_leases (
+    sheet_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SheetLease:
+    def __init__(self, locks: "SheetLockRegistry", sheet_id: str, owner: str):
+        self._locks = locks
+        self.sheet_id = sheet_id
+        self.owner = owner
+        self.lost = False
+        self._released = threading.Event()
+        self._renewer = threading.Thread(target=self._renew_forever, name=f"sheet-lease-{sheet_id[:8]}", daemon=True)
+        self._renewer.start()
+
+    def _renew_forever(self) -> None:
+        interval = max(1.0, self._locks.lease_seconds / 3)
+        while not self._released.wait(interval):
+            try:
+                if not self._locks._renew(self.sheet_id, self.owner):
+                    self.lost = True
+                    return
+            except sqlite3.Error:
+                # Try again next round; the lease only lapses after lease_seconds.
+                pass
+
+    def ensure_held(self) -> None:
+        if self.lost:
+            raise RuntimeError(f"Lost the write lease on sheet {self.sheet_id}; another job may be writing to it")
+
+    def release(self) -> None:
+        if self._released.is_set():
+            return
+        self._released.set()
+        self._locks._release(self.sheet_id, self.owner)
+
+
+# One writer per Google Sheet at a time, across threads, worker processes and
+# hosts that share the queue database. A merge reads the sheet's supplier
+# columns and item rows when it starts and writes them back at checkpoints
+# and at the end; without this, two jobs on the same sheet would pick the same
+# free column and insertion rows and the later flush would overwrite the
+# earlier one. Leases are renewed while held and expire if the holder dies.
+class SheetLockRegistry:
+    def __init__(self, db_path: str, lease_seconds: float, poll_interval: float):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                    try:
+                        conn.execute("PRAGMA journal_mode = WAL")
+                        conn.executescript(SCHEMA)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                    self._initialized = True
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _try_acquire(self, sheet_id: str, owner: str) -> bool:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("DELETE FROM sheet_leases WHERE sheet_id = ? AND expires_at < ?", (sheet_id, now))
+            conn.execute(
+                "INSERT OR IGNORE INTO sheet_leases (sheet_id, owner, expires_at) VALUES (?, ?, ?)",
+                (sheet_id, owner, now + self.lease_seconds),
+            )
+            row = conn.execute("SELECT owner FROM sheet_leases WHERE sheet_id = ?", (sheet_id,)).fetchone()
+            conn.execute("COMMIT")
+            return row is not None and row[0] == owner
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _renew(self, sheet_id: str, owner: str) -> bool:
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE sheet_leases SET expires_at = ? WHERE sheet_id = ? AND owner = ?",
+                (time.time() + self.lease_seconds, sheet_id, owner),
+            )
+            return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    def _release(self, sheet_id: str, owner: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM sheet_leases WHERE sheet_id = ? AND owner = ?", (sheet_id, owner))
+        finally:
+            conn.close()
+
+    def acquire(self, sheet_id: str) -> SheetLease:
+        # Blocks until the sheet is free; callers run this off the event loop.
+        owner = uuid.uuid4().hex
+        while not self._try_acquire(sheet_id, owner):
+            time.sleep(self.poll_interval)
+        return SheetLease(self, sheet_id, owner)
+
+
+sheet_locks = SheetLockRegistry(
+    db_path=settings.job_queue_path,
+    lease_seconds=settings.sheet_lock_lease_seconds,
+    poll_interval=settings.sheet_lock_poll_interval,
+)
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, Dict, List
+
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+
+_NUMERIC_TEXT = re.compile(r"^[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?(?:[eE][+-]?\d+)?%?$")
+
+
+def _cell_data(value: Any) -> Dict[str, Any]:
+    # updateCells stores values as given, so text is parsed here the way a
+    # USER_ENTERED values.update parses it: numbers (with thousands
+    # separators or a percent sign), TRUE/FALSE, formulas, and a leading
+    # apostrophe to force text. Dates are not parsed: nothing in the merge
+    # writes them as dates, and USER_ENTERED reads "01/02/2025" by the
+    # spreadsheet's locale, so text such as a delivery date stays text
+    # rather than becoming a locale-dependent serial number.
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    text = str(value)
+    if text.startswith("'"):
+        return {"userEnteredValue": {"stringValue": text[1:]}}
+    if text.startswith("="):
+        return {"userEnteredValue": {"formulaValue": text}}
+    stripped = text.strip()
+    if stripped.upper() in ("TRUE", "FALSE"):
+        return {"userEnteredValue": {"boolValue": stripped.upper() == "TRUE"}}
+    if any(ch.isdigit() for ch in stripped) and _NUMERIC_TEXT.match(stripped):
+        number = float(stripped.rstrip("%").replace(",", ""))
+        if stripped.endswith("%"):
+            number /= 100
+        elif number.is_integer() and "." not in stripped and "e" not in stripped.lower():
+            number = int(number)
+        return {"userEnteredValue": {"numberValue": number}}
+    return {"userEnteredValue": {"stringValue": text}}
+
+
+def read_bootstrap_values(ws, header_rows: int, name_col: int) -> List[List[Any]]:
+    # Only the header rows and the item-name column are needed to start a
+    # merge, so fetch those two ranges instead of the whole value matrix. The
+    # column range is open-ended because the worksheet handle may be cached
+    # and its gridProperties row count slightly stale.
+    col_letter = rowcol_to_a1(1, name_col).rstrip("0123456789")
+    name_range = f"{col_letter}{header_rows + 1}:{col_letter}"
+    header_values, name_values = ws.batch_get([f"1:{header_rows}", name_range])
+
+    values: List[List[Any]] = [list(row) for row in header_values]
+    while len(values) < header_rows:
+        values.append([])
+    for row in name_values:
+        values.append([""] * (name_col - 1) + list(row[:1]) if row else [])
+    return values
+
+
+# The sheet operations a job performed, in order, plus the header rows and
+# item column it started from. Replaying it onto another worksheet-like
+# object (the Excel adapter) reproduces the Google Sheet layout without
+# re-running product matching. Supplier headers already in the sheet are
+# left out of the replay, since their prices are not part of the plan; only
+# the label columns up to name_col and the columns this job wrote keep
+# their header cells.
+class MergePlan:
+    def __init__(
+        self,
+        base_values: List[List[Any]] | None = None,
+        steps: List[List[Any]] | None = None,
+        header_rows: int = 0,
+        name_col: int = 0,
+    ):
+        self.base_values = [list(row) for row in base_values or []]
+        self.steps: List[List[Any]] = steps if steps is not None else []
+        self.header_rows = header_rows
+        self.name_col = name_col
+
+    def record_insert(self, row: int, count: int) -> None:
+        self.steps.append(["insert", row, count])
+
+    def record_write(self, row: int, col: int, values: List[List[Any]]) -> None:
+        self.steps.append(["write", row, col, values])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": 1,
+            "base": self.base_values,
+            "steps": self.steps,
+            "header_rows": self.header_rows,
+            "name_col": self.name_col,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MergePlan":
+        # Plans stored before header_rows was recorded replay every base cell.
+        return cls(data.get("base") or [], data.get("steps") or [], data.get("header_rows", 0), data.get("name_col", 0))
+
+    def _written_columns(self) -> set[int]:
+        columns: set[int] = set()
+        for step in self.steps:
+            if step[0] == "write":
+                _, _, col, values = step
+                columns.update(range(col, col + max((len(r) for r in values), default=1)))
+        return columns
+
+    def _base_requests(self) -> List[Dict[str, Any]]:
+        written = self._written_columns()
+        requests: List[Dict[str, Any]] = []
+        for r, row in enumerate(self.base_values, start=1):
+            if r > self.header_rows:
+                if any(str(v).strip() for v in row):
+                    requests.append({"range": f"{rowcol_to_a1(r, 1)}:{rowcol_to_a1(r, len(row))}", "values": [row]})
+                continue
+            start = None
+            for c in range(1, len(row) + 2):
+                keep = c <= len(row) and (c <= self.name_col or c in written) and str(row[c - 1]).strip()
+                if keep and start is None:
+                    start = c
+                elif not keep and start is not None:
+                    cell_range = f"{rowcol_to_a1(r, start)}:{rowcol_to_a1(r, c - 1)}"
+                    requests.append({"range": cell_range, "values": [row[start - 1 : c - 1]]})
+                    start = None
+        return requests
+
+    def replay(self, ws) -> None:
+        base_requests = self._base_requests()
+        if base_requests:
+            ws.batch_update(base_requests)
+        for step in self.steps:
+            if step[0] == "insert":
+                _, row, count = step
+                ws.insert_rows([[] for _ in range(count)], row)
+            else:
+                _, row, col, values = step
+                width = max((len(r) for r in values), default=1)
+                end = rowcol_to_a1(row + len(values) - 1, col + width - 1)
+                ws.batch_update([{"range": f"{rowcol_to_a1(row, col)}:{end}", "values": values}])
+
+
+# Stands in for a gspread Worksheet during a job. Row insertions and value
+# writes are applied to a local copy of the grid and recorded as
+# spreadsheets.batchUpdate requests, so the whole job (or everything since the
+# last checkpoint) reaches Google Sheets in a single API call from flush().
+# Requests are replayed in the order they were made, which keeps row numbers
+# in later writes valid after earlier insertions.
+class SheetMirror:
+    def __init__(
+        self,
+        ws,
+        values: List[List[Any]],
+        row_count: int | None = None,
+        col_count: int | None = None,
+        plan: MergePlan | None = None,
+        on_refresh: Callable[[Any], None] | None = None,
+    ):
+        # ws may be None for a purely local merge whose only output is the plan.
+        # on_refresh receives the re-fetched worksheet after the grid grew, so
+        # a pooled handle can be replaced with one that has the new size.
+        self.ws = ws
+        self.plan = plan
+        self.on_refresh = on_refresh
+        self.sheet_id = ws.id if ws is not None else 0
+        if row_count is None:
+            row_count = ws.row_count if ws is not None else len(values)
+        if col_count is None:
+            col_count = ws.col_count if ws is not None else max((len(row) for row in values), default=0)
+        self.row_count = row_count
+        self._col_count = col_count
+        self._values: List[List[Any]] = [list(row) for row in values]
+        self._requests: List[Dict[str, Any]] = []
+
+    @property
+    def col_count(self) -> int:
+        return self._col_count
+
+    @property
+    def pending_requests(self) -> int:
+        return len(self._requests)
+
+    def get_all_values(self) -> List[List[Any]]:
+        values = [list(row) for row in self._values]
+        for row in values:
+            while row and str(row[-1]).strip() == "":
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def insert_rows(self, values: List[List[Any]], row: int = 1, value_input_option: str = "USER_ENTERED") -> None:
+        count = len(values)
+        if count == 0:
+            return
+        self._requests.append(
+            {
+                "insertDimension": {
+                    "range": {
+                        "sheetId": self.sheet_id,
+                        "dimension": "ROWS",
+                        "startIndex": row - 1,
+                        "endIndex": row - 1 + count,
+                    },
+                    "inheritFromBefore": False,
+                }
+            }
+        )
+        self.row_count += count
+        if self.plan is not None:
+            self.plan.record_insert(row, count)
+        if row - 1 < len(self._values):
+            self._values[row - 1 : row - 1] = [[] for _ in range(count)]
+        if any(any(str(v).strip() for v in r) for r in values):
+            self._write(row, 1, values)
+            if self.plan is not None:
+                self.plan.record_write(row, 1, values)
+
+    def batch_update(self, batch_requests: List[Dict[str, Any]], value_input_option: str = "USER_ENTERED") -> None:
+        writes = [(*a1_to_rowcol(request["range"].split(":")[0]), request["values"]) for request in batch_requests]
+        # Grow the grid once for the whole batch rather than once per range.
+        if writes:
+            self._ensure_grid(
+                max(row + len(values) - 1 for row, _, values in writes),
+                max(col + max((len(r) for r in values), default=1) - 1 for _, col, values in writes),
+            )
+        for start_row, start_col, values in writes:
+            self._write(start_row, start_col, values)
+            if self.plan is not None:
+                self.plan.record_write(start_row, start_col, values)
+
+    def _write(self, start_row: int, start_col: int, values: List[List[Any]]) -> None:
+        last_row = start_row + len(values) - 1
+        last_col = start_col + max((len(r) for r in values), default=1) - 1
+        self._ensure_grid(last_row, last_col)
+
+        for r_offset, row_vals in enumerate(values):
+            row_idx = start_row - 1 + r_offset
+            while len(self._values) <= row_idx:
+                self._values.append([])
+            row = self._values[row_idx]
+            for c_offset, value in enumerate(row_vals):
+                col_idx = start_col - 1 + c_offset
+                while len(row) <= col_idx:
+                    row.append("")
+                row[col_idx] = "" if value is None else value
+
+        self._requests.append(
+            {
+                "updateCells": {
+                    "start": {"sheetId": self.sheet_id, "rowIndex": start_row - 1, "columnIndex": start_col - 1},
+                    "rows": [{"values": [_cell_data(v) for v in row_vals]} for row_vals in values],
+                    "fields": "userEnteredValue",
+                }
+            }
+        )
+
+    def _ensure_grid(self, last_row: int, last_col: int) -> None:
+        for dimension, needed, current in (("ROWS", last_row, self.row_count), ("COLUMNS", last_col, self._col_count)):
+            if needed > current:
+                self._requests.append(
+                    {"appendDimension": {"sheetId": self.sheet_id, "dimension": dimension, "length": needed - current}}
+                )
+        self.row_count = max(self.row_count, last_row)
+        self._col_count = max(self._col_count, last_col)
+
+    def flush(self) -> int:
+        if self.ws is None:
+            self._requests = []
+            return 0
+        if not self._requests:
+            return 0
+        requests, self._requests = self._requests, []
+        try:
+            self.ws.spreadsheet.batch_update({"requests": requests})
+        except Exception:
+            self._requests = requests + self._requests
+            raise
+        if any("appendDimension" in request or "insertDimension" in request for request in requests):
+            # Appended and inserted rows or columns leave the handle's row
+            # and column counts stale; re-read them from the spreadsheet
+            # metadata.
+            self.ws = self.ws.spreadsheet.get_worksheet_by_id(self.sheet_id)
+            self.row_count = max(self.row_count, self.ws.row_count)
+            self._col_count = max(self._col_count, self.ws.col_count)
+            if self.on_refresh is not None:
+                self.on_refresh(self.ws)
+        return len(requests)
@@ -1,12 +1,29 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
 from .api import router as api_router
+from .core.config import settings
+from .worker import worker_loop
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # รัน worker ใน process เดียวกับ API (ค่าเริ่มต้น) หรือปิดด้วย EMBEDDED_WORKER=false แล้วรัน `python -m app.worker` แยก
+    stop = asyncio.Event()
+    worker_task = asyncio.create_task(worker_loop(stop)) if settings.embedded_worker else None
+    yield
+    stop.set()
+    if worker_task is not None:
+        await worker_task
+
 
-app = FastAPI(title="Quotation Processor API", version="1.0.0")
+app = FastAPI(title="Quotation Processor API", version="1.0.0", lifespan=lifespan)
 
 # CORS config (ยังคงไว้เผื่อ Local Dev, แต่บน Prod จะเป็น Origin เดียวกัน)
 app.add_middleware(
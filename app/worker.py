@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import socket
+import threading
+import uuid
+from typing import Any, Dict, Set
+
+from .core.artifacts import ensure_job_excel
+from .core.config import get_effective_gcp_service_account_json, get_effective_google_api_key, settings
+from .core.jobqueue import job_queue
+from .core.jobs import job_store
+from .core.processing import normalize_output_format, process_files, process_files_async
+
+logger = logging.getLogger(__name__)
+
+_local_wakeup: asyncio.Event | None = None
+
+
+def wake_local_worker() -> None:
+    # เรียกจาก API หลัง enqueue เพื่อให้ worker ใน process เดียวกันเริ่มงานทันทีโดยไม่ต้องรอรอบ poll
+    if _local_wakeup is not None:
+        _local_wakeup.set()
+
+
+async def _write_events(job_id: str, events: asyncio.Queue) -> None:
+    # Progress callbacks fire from the scheduler loop and from merge
+    # threads; they only enqueue, and this task writes to the job store in
+    # batches off the loop. None marks the end of the job.
+    while True:
+        batch = [await events.get()]
+        while not events.empty():
+            batch.append(events.get_nowait())
+        try:
+            await asyncio.to_thread(job_store.add_events, job_id, [item for item in batch if item is not None])
+        except Exception:
+            # Progress events are best effort; the job itself carries on.
+            logger.warning("Writing events for job %s failed", job_id, exc_info=True)
+        if None in batch:
+            return
+
+
+async def run_job(job_id: str, payload: Dict[str, Any]) -> None:
+    file_paths = payload["file_paths"]
+    sheet_id = payload["sheet_id"]
+    output_format = normalize_output_format(payload.get("output_format"))
+    use_cache = not payload.get("bypass_cache", False)
+    # Payloads queued before credentials moved out of them still carry the keys.
+    credentials = payload.get("credentials") or {}
+    api_key = credentials.get("api_key") or payload.get("api_key") or get_effective_google_api_key()
+    gcp_json = credentials.get("gcp_json") or payload.get("gcp_json") or get_effective_gcp_service_account_json() or ""
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    writer = asyncio.create_task(_write_events(job_id, events))
+
+    def progress(event: str, data: Dict[str, Any]) -> None:
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+        except RuntimeError:
+            # A merge thread outliving a cancelled job after the loop closed.
+            pass
+
+    def render_excel(merge_plan: Dict[str, Any]) -> None:
+        ensure_job_excel(job_id, merge_plan)
+
+    try:
+        if not api_key:
+            raise ValueError("Missing Google API key")
+        if settings.extraction_engine == "thread":
+            # Cancelling the await does not stop the thread behind it, so a
+            # lost lease or shutdown also sets cancel for process_files to
+            # stop before its next sheet write.
+            cancel = threading.Event()
+            try:
+                results, errors, merge_plan = await asyncio.to_thread(
+                    process_files,
+                    file_paths,
+                    sheet_id,
+                    api_key,
+                    gcp_json,
+                    use_cache,
+                    job_id,
+                    progress,
+                    output_format,
+                    render_excel,
+                    cancel,
+                )
+            except asyncio.CancelledError:
+                cancel.set()
+                raise
+        else:
+            results, errors, merge_plan = await process_files_async(
+                file_paths,
+                sheet_id,
+                api_key,
+                gcp_json,
+                use_cache,
+                job_id,
+                progress,
+                output_format,
+                render_excel,
+            )
+        await _close_events(events, writer)
+        await asyncio.to_thread(
+            job_store.complete,
+            job_id,
+            {
+                "sheet_id": sheet_id,
+                "results": results,
+                "errors": errors,
+                "output_format": output_format,
+            },
+            merge_plan,
+        )
+    except Exception as e:
+        await _close_events(events, writer)
+        await asyncio.to_thread(job_store.fail, job_id, str(e))
+    finally:
+        writer.cancel()
+
+    # Not in a finally block: a cancelled job keeps its uploads so the worker
+    # that re-claims it after the lease expires can still read them.
+    for path in file_paths:
+        if os.path.exists(path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    if file_paths:
+        shutil.rmtree(os.path.dirname(file_paths[0]), ignore_errors=True)
+
+
+async def _close_events(events: asyncio.Queue, writer: asyncio.Task) -> None:
+    # Lets the writer drain before the job's final status is stored, so
+    # followers see every event before completed/failed.
+    events.put_nowait(None)
+    await writer
+
+
+async def _keep_lease(job_id: str, worker_id: str, job: asyncio.Task) -> None:
+    interval = max(1.0, settings.job_lease_seconds / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            held = await asyncio.to_thread(job_queue.heartbeat, job_id, worker_id, settings.job_lease_seconds)
+        except Exception:
+            # Try again next round; the lease only lapses after job_lease_seconds.
+            logger.warning("Heartbeat for job %s failed", job_id, exc_info=True)
+            continue
+        if not held:
+            # Another worker may already have re-claimed the job, so running
+            # on would write the same sheet and results twice.
+            logger.warning("Lost the lease on job %s; stopping it", job_id)
+            job.cancel()
+            return
+
+
+async def _run_claimed(job_id: str, payload: Dict[str, Any], attempts: int, worker_id: str) -> None:
+    if attempts > settings.job_max_attempts:
+        await asyncio.to_thread(job_store.fail, job_id, "Job was abandoned by its worker too many times")
+        await asyncio.to_thread(job_queue.ack, job_id)
+        return
+
+    await asyncio.to_thread(job_store.start_attempt, job_id, attempts)
+    job = asyncio.create_task(run_job(job_id, payload))
+    lease = asyncio.create_task(_keep_lease(job_id, worker_id, job))
+    try:
+        await job
+    except asyncio.CancelledError:
+        if not lease.done():
+            raise
+        # The lease was lost; whoever holds it now finishes and acks the job.
+        return
+    finally:
+        lease.cancel()
+    await asyncio.to_thread(job_queue.ack, job_id)
+
+
+async def _acquire_slot(slots: asyncio.Semaphore, stop: asyncio.Event) -> bool:
+    # Waits for a free slot or for stop, whichever comes first.
+    acquire = asyncio.ensure_future(slots.acquire())
+    stopping = asyncio.ensure_future(stop.wait())
+    try:
+        await asyncio.wait([acquire, stopping], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopping.cancel()
+        if not acquire.done():
+            acquire.cancel()
+    if not acquire.done() or acquire.cancelled():
+        return False
+    if stop.is_set():
+        slots.release()
+        return False
+    return True
+
+
+async def worker_loop(stop: asyncio.Event, concurrency: int | None = None) -> None:
+    global _local_wakeup
+    _local_wakeup = asyncio.Event()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    slots = asyncio.Semaphore(concurrency or settings.worker_job_concurrency)
+    running: Set[asyncio.Task] = set()
+
+    try:
+        while not stop.is_set():
+            if not await _acquire_slot(slots, stop):
+                break
+            _local_wakeup.clear()
+            claimed = await asyncio.to_thread(job_queue.claim, worker_id, settings.job_lease_seconds)
+            if claimed is None:
+                slots.release()
+                waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(_local_wakeup.wait())]
+                await asyncio.wait(waiters, timeout=settings.worker_poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                for w in waiters:
+                    w.cancel()
+                continue
+
+            job_id, payload, attempts = claimed
+            task = asyncio.create_task(_run_claimed(job_id, payload, attempts, worker_id))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        # งานที่ค้างอยู่จะถูกยกเลิก แล้ว worker ตัวอื่นรับต่อเมื่อ lease หมดอายุ
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        _local_wakeup = None
+
+
+def main() -> None:
+    async def run() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        await worker_loop(stop)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -64,6 +64,7 @@ interface ApiResponse {
   sheet_id: string;
   results: ProcessResultItem[];
   errors: string[];
+  output_format?: Format;
 }
 
 // --- Helpers ---
@@ -90,9 +91,10 @@ const App: React.FC = () => {
   const [view, setView] = useState<View>("dashboard");
   const [files, setFiles] = useState<File[]>([]);
   const [sheetLink, setSheetLink] = useState("https://docs.google.com/spreadsheets/d/17tMHStXQYXaIQHQIA4jdUyHaYt_tuoNCEEuJCstWEuw/edit?gid=553601935#gid=553601935");
-  const [outputFormat, setOutputFormat] = useState<Format>("Excel");
+  const [outputFormat, setOutputFormat] = useState<Format>("Both");
   const [errorMessage, setErrorMessage] = useState("");
   const [lastSheetId, setLastSheetId] = useState<string | null>(null);
+  const [lastOutputFormat, setLastOutputFormat] = useState<Format>("Both");
   const [resultsCount, setResultsCount] = useState(0);
   const [lastJobId, setLastJobId] = useState<string | null>(null);
 
@@ -103,9 +105,12 @@ const App: React.FC = () => {
   const [mobileOpen, setMobileOpen] = useState(false);
   const [processingRemaining, setProcessingRemaining] = useState(0);
   const [stepIndex, setStepIndex] = useState(0);
+  const [filesDone, setFilesDone] = useState(0);
+  const [liveCompanies, setLiveCompanies] = useState<string[]>([]);
 
   const fileInputRef = useRef<HTMLInputElement>(null);
   const timerRef = useRef<number | null>(null);
+  const eventSourceRef = useRef<EventSource | null>(null);
 
   useEffect(() => {
     let interval: number;
@@ -166,6 +171,9 @@ const App: React.FC = () => {
 
     // Set initial remaining time for UI display
     setProcessingRemaining(estimatedSec);
+    setStepIndex(0);
+    setFilesDone(0);
+    setLiveCompanies([]);
 
     const formData = new FormData();
     formData.append("sheet_url", sheetLink || "");
@@ -184,43 +192,18 @@ const App: React.FC = () => {
       const { job_id } = submitRes.data;
       setLastJobId(job_id);
 
-      // 2. เริ่มวน Loop เช็คสถานะ (Polling) ทุก 3 วินาที
+      // 2. รับความคืบหน้าแบบ real-time ผ่าน SSE ถ้าใช้ไม่ได้จะกลับไป Polling
       if (timerRef.current) clearInterval(timerRef.current);
+      if (eventSourceRef.current) eventSourceRef.current.close();
 
-      timerRef.current = window.setInterval(async () => {
-        try {
-          const statusRes = await axios.get(`${API_BASE_URL}/api/jobs/${job_id}`);
-          const { status, result, error } = statusRes.data;
-
-          if (status === "completed") {
-            // ทำงานเสร็จแล้ว
-            if (timerRef.current) clearInterval(timerRef.current);
-
-            const data = result as ApiResponse;
-            setLastSheetId(data.sheet_id);
-            setResultsCount(data.results.length);
-
-            if (data.errors && data.errors.length) {
-              setErrorMessage(data.errors.join("\n"));
-            }
-
-            setStepIndex(4);
-            setView("success");
-          } else if (status === "failed") {
-            // ทำงานล้มเหลว
-            if (timerRef.current) clearInterval(timerRef.current);
-            setErrorMessage(error || "Unknown error occurred during background processing.");
-            setView("error");
-          } else {
-            // กำลังทำงาน (status === "processing")
-            console.log(`Job ${job_id} is processing...`);
-          }
-        } catch (pollErr) {
-          console.error("Polling error:", pollErr);
-        }
-      }, 3000);
+      if (typeof EventSource !== "undefined") {
+        followJobEvents(job_id);
+      } else {
+        startPolling(job_id);
+      }
     } catch (err: unknown) {
       if (timerRef.current) clearInterval(timerRef.current);
+      if (eventSourceRef.current) eventSourceRef.current.close();
       let msg = "Unknown error";
 
       if (axios.isAxiosError(err)) {
@@ -237,6 +220,93 @@ const App: React.FC = () => {
     }
   };
 
+  const checkJobStatus = async (jobId: string): Promise<boolean> => {
+    const statusRes = await axios.get(`${API_BASE_URL}/api/jobs/${jobId}`);
+    const { status, result, error } = statusRes.data;
+
+    if (status === "completed") {
+      // ทำงานเสร็จแล้ว
+      const data = result as ApiResponse;
+      setLastSheetId(data.sheet_id);
+      setLastOutputFormat(data.output_format ?? outputFormat);
+      setResultsCount(data.results.length);
+
+      if (data.errors && data.errors.length) {
+        setErrorMessage(data.errors.join("\n"));
+      }
+
+      setStepIndex(4);
+      setView("success");
+      return true;
+    }
+    if (status === "failed") {
+      // ทำงานล้มเหลว
+      setErrorMessage(error || "Unknown error occurred during background processing.");
+      setView("error");
+      return true;
+    }
+    // กำลังทำงาน (status === "queued" | "processing")
+    console.log(`Job ${jobId} is ${status}...`);
+    return false;
+  };
+
+  const startPolling = (jobId: string) => {
+    // Polling ทุก 3 วินาที
+    timerRef.current = window.setInterval(async () => {
+      try {
+        if (await checkJobStatus(jobId) && timerRef.current) clearInterval(timerRef.current);
+      } catch (pollErr) {
+        console.error("Polling error:", pollErr);
+      }
+    }, 3000);
+  };
+
+  const followJobEvents = (jobId: string) => {
+    const source = new EventSource(`${API_BASE_URL}/api/jobs/${jobId}/events`);
+    eventSourceRef.current = source;
+
+    const parse = (e: Event) => JSON.parse((e as MessageEvent).data);
+
+    source.addEventListener("uploaded", () => setStepIndex((prev) => Math.max(prev, 1)));
+    source.addEventListener("active", () => setStepIndex((prev) => Math.max(prev, 1)));
+    source.addEventListener("flash_done", () => setStepIndex((prev) => Math.max(prev, 2)));
+    source.addEventListener("extracted", (e) => {
+      const payload = parse(e);
+      setStepIndex((prev) => Math.max(prev, 2));
+      setFilesDone((prev) => prev + 1);
+      if (payload.data?.company) {
+        setLiveCompanies((prev) => [...prev, payload.data.company]);
+      }
+    });
+    source.addEventListener("file_failed", () => setFilesDone((prev) => prev + 1));
+    source.addEventListener("written", () => setStepIndex((prev) => Math.max(prev, 3)));
+    // The job was picked up again by another worker and starts over.
+    source.addEventListener("restarted", () => {
+      setStepIndex(1);
+      setFilesDone(0);
+      setLiveCompanies([]);
+    });
+
+    const finish = async () => {
+      source.close();
+      try {
+        await checkJobStatus(jobId);
+      } catch (statusErr) {
+        console.error("Status error:", statusErr);
+        startPolling(jobId);
+      }
+    };
+    source.addEventListener("completed", finish);
+    source.addEventListener("failed", finish);
+
+    source.onerror = () => {
+      // Proxy บางตัวไม่รองรับ SSE ให้กลับไปใช้ Polling
+      if (source.readyState === EventSource.CLOSED) {
+        startPolling(jobId);
+      }
+    };
+  };
+
   const handleDownloadExcel = async () => {
     if (!lastJobId) {
       alert("Job not found. Please run processing again.");
@@ -264,11 +334,14 @@ const App: React.FC = () => {
   };
 
   const resetAll = () => {
+    if (timerRef.current) clearInterval(timerRef.current);
+    if (eventSourceRef.current) eventSourceRef.current.close();
     setFiles([]);
     setSheetLink("https://docs.google.com/spreadsheets/d/17tMHStXQYXaIQHQIA4jdUyHaYt_tuoNCEEuJCstWEuw/edit?gid=553601935#gid=553601935");
-    setOutputFormat("Excel");
+    setOutputFormat("Both");
     setErrorMessage("");
     setLastSheetId(null);
+    setLastOutputFormat("Both");
     setResultsCount(0);
     setLastJobId(null);
     setView("dashboard");
@@ -679,6 +752,9 @@ const App: React.FC = () => {
                         Processing your files
                       </h2>
                       <p className="text-sm text-slate-500 mt-1">~ {processingRemaining}s remaining</p>
+                      <p className="text-sm text-slate-500 mt-1">
+                        {filesDone} / {files.length} files extracted
+                      </p>
                     </div>
                     <div className="max-w-xl mx-auto text-left">
                       <ol className="grid grid-cols-1 sm:grid-cols-4 gap-3">
@@ -714,6 +790,16 @@ const App: React.FC = () => {
                         })}
                       </ol>
                     </div>
+                    {liveCompanies.length > 0 && (
+                      <ul className="max-w-xl mx-auto text-left text-sm text-slate-600 space-y-1">
+                        {liveCompanies.map((company, idx) => (
+                          <li key={idx} className="flex items-center gap-2">
+                            <CheckCircle2 className="w-4 h-4 text-emerald-500" />
+                            <span>{company}</span>
+                          </li>
+                        ))}
+                      </ul>
+                    )}
                     <div className="text-xs text-slate-500">
                       This may take a moment depending on file sizes.
                     </div>
@@ -750,12 +836,15 @@ const App: React.FC = () => {
                       >
                         <ExternalLink className="w-4.5 h-4.5" /> <span>Download Excel</span>
                       </button>
-                      <button
-                        onClick={() => window.open(sheetUrlResolved, "_blank")}
-                        className="inline-flex items-center gap-2 px-5 py-3 rounded-xl text-sm font-medium text-[#1E3A8A] border border-[#3B82F6]/40 hover:bg-[#3B82F6]/5 hover:border-[#3B82F6]/60 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-[#3B82F6]/60 transition"
-                      >
-                        <ExternalLink className="w-4.5 h-4.5" /> <span>Open Google Sheet</span>
-                      </button>
+                      {/* Excel-only jobs never write to the Google Sheet. */}
+                      {lastOutputFormat !== "Excel" && (
+                        <button
+                          onClick={() => window.open(sheetUrlResolved, "_blank")}
+                          className="inline-flex items-center gap-2 px-5 py-3 rounded-xl text-sm font-medium text-[#1E3A8A] border border-[#3B82F6]/40 hover:bg-[#3B82F6]/5 hover:border-[#3B82F6]/60 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-[#3B82F6]/60 transition"
+                        >
+                          <ExternalLink className="w-4.5 h-4.5" /> <span>Open Google Sheet</span>
+                        </button>
+                      )}
                     </div>
                     <div>
                       <button
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Lets `pytest` run from the repository root without installing the app.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
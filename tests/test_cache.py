@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from app.core import cache as cache_module
+from app.core.cache import ExtractionCache, make_extraction_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Starts at the real time since eviction compares it with file mtimes.
+    now = [time.time()]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    return now
+
+
+def _count_sweeps(cache, monkeypatch):
+    sweeps = []
+    evict = cache.evict
+
+    def counting_evict():
+        sweeps.append(1)
+        evict()
+
+    monkeypatch.setattr(cache, "evict", counting_evict)
+    return sweeps
+
+
+def test_put_and_get_round_trip(tmp_path, clock):
+    cache = ExtractionCache(str(tmp_path), max_bytes=10**6, max_age_seconds=60)
+
+    cache.put("ab" * 32, {"products": [{"name": "Hood"}]})
+
+    assert cache.get("ab" * 32) == {"products": [{"name": "Hood"}]}
+    assert cache.get("cd" * 32) is None
+
+
+def test_entries_expire_after_max_age(tmp_path, clock):
+    cache = ExtractionCache(str(tmp_path), max_bytes=10**6, max_age_seconds=60)
+    cache.put("ab" * 32, {"products": []})
+
+    clock[0] += 61
+
+    assert cache.get("ab" * 32) is None
+
+
+def test_put_only_sweeps_when_the_estimate_crosses_the_limit(tmp_path, clock, monkeypatch):
+    cache = ExtractionCache(str(tmp_path), max_bytes=2000, max_age_seconds=0)
+    sweeps = _count_sweeps(cache, monkeypatch)
+    entry = {"products": [{"name": "x" * 150}]}
+
+    for i in range(20):
+        cache.put(f"{i:02d}" * 32, entry)
+
+    # The first put establishes the estimate; after that a sweep only runs
+    # when the estimate goes past max_bytes.
+    assert 1 < len(sweeps) < 20
+    assert cache._estimated_bytes <= 2000
+    assert sum(p.stat().st_size for p in tmp_path.glob("*/*.json")) <= 2000
+
+
+def test_put_sweeps_expired_entries_once_per_interval(tmp_path, clock, monkeypatch):
+    cache = ExtractionCache(str(tmp_path), max_bytes=0, max_age_seconds=60)
+    sweeps = _count_sweeps(cache, monkeypatch)
+    cache.put("aa" * 32, {"products": []})
+    cache.put("bb" * 32, {"products": []})
+    assert len(sweeps) == 1
+
+    clock[0] += cache_module._EXTRACTION_SWEEP_SECONDS
+    cache.put("cc" * 32, {"products": []})
+
+    assert len(sweeps) == 2
+    assert sorted(p.name[:2] for p in tmp_path.glob("*/*.json")) == ["cc"]
+
+
+def test_extraction_key_depends_on_the_response_schema():
+    schema = {"type": "object", "properties": {"company": {"type": "string"}}}
+
+    text = make_extraction_key("digest", "prompt", "flash|pro")
+    structured = make_extraction_key("digest", "prompt", "flash|pro", schema)
+    changed = make_extraction_key("digest", "prompt", "flash|pro", {**schema, "required": ["company"]})
+
+    assert len({text, structured, changed}) == 3
+    assert structured == make_extraction_key("digest", "prompt", "flash|pro", dict(reversed(list(schema.items()))))
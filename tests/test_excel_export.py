@@ -0,0 +1,97 @@
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
+
+from app.core import excel_template
+from app.core.excel_template import (
+    generate_excel_from_plan,
+    generate_excel_streaming_from_plan,
+    template_bootstrap_values,
+)
+from app.core.processing import HEADER_ROW, ITEM_MASTER_LIST_COL
+from app.core.sheet_mirror import MergePlan, SheetMirror
+
+FILLS = {4: "FFFF0000", 5: "FF00FF00", 6: "FF0000FF"}
+
+
+@pytest.fixture
+def template(tmp_path, monkeypatch):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Compare"
+    ws["A1"], ws["B1"], ws["C1"] = "No.", "Item", "Supplier"
+    ws.merge_cells("C1:F1")
+    for col in range(1, 7):
+        ws.cell(row=1, column=col).font = Font(bold=True)
+    ws.column_dimensions["B"].width = 40
+    for row, color in FILLS.items():
+        ws.cell(row=row, column=ITEM_MASTER_LIST_COL, value=f"Item {row}")
+        for col in range(1, 7):
+            ws.cell(row=row, column=col).fill = PatternFill("solid", fgColor=color)
+    path = tmp_path / "template.xlsx"
+    wb.save(path)
+    monkeypatch.setattr(excel_template, "_resolve_template_path", lambda: path)
+    return path
+
+
+def _plan():
+    # A merge that fills in Item 4, inserts a new product above Item 5 and
+    # writes a supplier header.
+    values = template_bootstrap_values()
+    mirror = SheetMirror(None, values, plan=MergePlan(values, header_rows=HEADER_ROW, name_col=ITEM_MASTER_LIST_COL))
+    mirror.batch_update([{"range": "C1", "values": [["ACME"]]}])
+    mirror.batch_update([{"range": "C4:F4", "values": [[2, "pcs", 100, 200]]}])
+    mirror.insert_rows([["", "New item", 1, "set", 50, 50]], row=5)
+    return mirror.plan.to_dict()
+
+
+def _read(path):
+    ws = load_workbook(path).active
+    values = [[c.value for c in row] for row in ws.iter_rows(min_row=1, max_row=7, max_col=6)]
+    fills = {row: ws.cell(row=row, column=ITEM_MASTER_LIST_COL).fill.fgColor.rgb for row in range(4, 8)}
+    return ws, values, fills
+
+
+EXPECTED_VALUES = [
+    ["No.", "Item", "ACME", None, None, None],
+    [None] * 6,
+    [None] * 6,
+    [None, "Item 4", 2, "pcs", 100, 200],
+    [None, "New item", 1, "set", 50, 50],
+    [None, "Item 5", None, None, None, None],
+    [None, "Item 6", None, None, None, None],
+]
+
+
+def test_generate_excel_from_plan_replays_the_merge_onto_the_template(template):
+    ws, values, fills = _read(generate_excel_from_plan(_plan()))
+
+    assert values == EXPECTED_VALUES
+    assert fills[4] == FILLS[4] and fills[6] == FILLS[5] and fills[7] == FILLS[6]
+    assert ws.cell(row=1, column=1).font.b
+
+
+def test_streaming_export_matches_the_regular_export(template):
+    plan = _plan()
+    regular_ws, regular_values, regular_fills = _read(generate_excel_from_plan(plan))
+    streamed_ws, streamed_values, streamed_fills = _read(generate_excel_streaming_from_plan(plan))
+
+    assert streamed_values == regular_values
+    # Each row keeps the style of the template row it came from; the
+    # inserted row has none in either exporter.
+    assert streamed_fills == regular_fills
+    assert streamed_ws.title == "Compare"
+    assert streamed_ws.column_dimensions["B"].width == 40
+    assert "C1:F1" in {str(r) for r in streamed_ws.merged_cells.ranges}
+    assert streamed_ws.cell(row=1, column=1).font.b
+
+
+def test_large_plans_switch_to_the_streaming_exporter(template, monkeypatch):
+    calls = []
+    monkeypatch.setattr(excel_template.settings, "excel_streaming_min_cells", 5)
+    monkeypatch.setattr(
+        excel_template, "generate_excel_streaming_from_plan", lambda plan: calls.append(plan) or "streamed.xlsx"
+    )
+
+    assert generate_excel_from_plan(_plan()) == "streamed.xlsx"
+    assert len(calls) == 1
@@ -0,0 +1,89 @@
+# GeminiKeyClients relies on google-generativeai internals (_ClientManager
+# and GenerativeModel._client/_async_client). These tests fail if the pinned
+# SDK version changes them.
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from google.generativeai import protos  # noqa: E402
+
+from app.core.gemini import GeminiKeyClients  # noqa: E402
+
+
+def _response(text):
+    return protos.GenerateContentResponse(
+        candidates=[protos.Candidate(content=protos.Content(parts=[protos.Part(text=text)], role="model"))]
+    )
+
+
+class FakeGenerativeClient:
+    def __init__(self):
+        self.requests = []
+
+    def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        return _response("ok")
+
+
+class FakeAsyncGenerativeClient(FakeGenerativeClient):
+    async def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        return _response("ok")
+
+
+class FakeFileClient:
+    def __init__(self):
+        self.deleted = []
+
+    def get_file(self, name):
+        return protos.File(name=name, state=protos.File.State.ACTIVE)
+
+    def delete_file(self, request):
+        self.deleted.append(request.name)
+
+
+def test_each_key_gets_its_own_configured_client_manager():
+    first, second = GeminiKeyClients("key-one"), GeminiKeyClients("key-two")
+
+    assert first._manager is not second._manager
+    assert first._manager.client_config["client_options"].api_key == "key-one"
+    assert second._manager.client_config["client_options"].api_key == "key-two"
+
+
+def test_sync_model_sends_requests_through_the_keys_client():
+    clients = GeminiKeyClients("key")
+    fake = FakeGenerativeClient()
+    clients._manager.clients["generative"] = fake
+
+    model = clients.model("gemini-2.5-flash", {"temperature": 0.0}, None)
+    response = model.generate_content("hello")
+
+    assert response.text == "ok"
+    assert len(fake.requests) == 1
+    assert clients.model("gemini-2.5-flash", {"temperature": 0.0}, None) is model
+
+
+def test_async_model_sends_requests_through_the_keys_async_client():
+    clients = GeminiKeyClients("key")
+    fake = FakeAsyncGenerativeClient()
+    clients._manager.clients["generative_async"] = fake
+
+    model = clients.model("gemini-2.5-flash", {"temperature": 0.0}, None, use_async=True)
+    response = asyncio.run(model.generate_content_async("hello"))
+
+    assert response.text == "ok"
+    assert len(fake.requests) == 1
+
+
+def test_file_calls_use_the_keys_file_client():
+    clients = GeminiKeyClients("key")
+    fake = FakeFileClient()
+    clients._manager.clients["file"] = fake
+
+    assert clients.get_file("abc").name == "files/abc"
+    clients.delete_file("abc")
+
+    assert fake.deleted == ["files/abc"]
@@ -0,0 +1,91 @@
+import asyncio
+import os
+
+import pytest
+
+from app.core.ingest import (
+    MAX_FIELD_BYTES,
+    InvalidUploadError,
+    UploadTooLargeError,
+    stream_multipart_to_dir,
+)
+
+BOUNDARY = "testboundary"
+
+
+def _body(parts):
+    chunks = []
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        chunks.append(f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n")
+    chunks.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(chunks)
+
+
+def _upload(tmp_path, body, max_file_bytes=1000, max_request_bytes=5000, content_length=None, chunk_size=64):
+    headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+    if content_length is not None:
+        headers["content-length"] = str(content_length)
+
+    async def stream():
+        for i in range(0, len(body), chunk_size):
+            yield body[i : i + chunk_size]
+
+    return asyncio.run(stream_multipart_to_dir(headers, stream(), str(tmp_path), max_file_bytes, max_request_bytes))
+
+
+def test_files_are_streamed_to_disk_and_fields_collected(tmp_path):
+    body = _body(
+        [
+            ("sheet_id", None, b"abc"),
+            ("files", "quote.pdf", b"x" * 300),
+            ("files", "../quote.pdf", b"y" * 200),
+        ]
+    )
+
+    fields, paths = _upload(tmp_path, body)
+
+    assert fields == {"sheet_id": "abc"}
+    assert [os.path.basename(p) for p in paths] == ["quote.pdf", "quote-1.pdf"]
+    assert all(os.path.dirname(p) == str(tmp_path) for p in paths)
+    assert [os.path.getsize(p) for p in paths] == [300, 200]
+
+
+def test_a_file_over_the_per_file_limit_is_rejected(tmp_path):
+    body = _body([("files", "big.pdf", b"x" * 1001)])
+
+    with pytest.raises(UploadTooLargeError, match="big.pdf"):
+        _upload(tmp_path, body, max_file_bytes=1000)
+
+
+def test_files_over_the_request_limit_together_are_rejected(tmp_path):
+    body = _body([("files", f"{i}.pdf", b"x" * 900) for i in range(3)])
+
+    with pytest.raises(UploadTooLargeError, match="in total"):
+        _upload(tmp_path, body, max_file_bytes=1000, max_request_bytes=2000)
+
+
+def test_content_length_over_the_limit_is_rejected_before_reading(tmp_path):
+    body = _body([("files", "a.pdf", b"x")])
+
+    with pytest.raises(UploadTooLargeError):
+        _upload(tmp_path, body, max_request_bytes=2000, content_length=2000 + MAX_FIELD_BYTES + 1)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_an_oversized_form_field_is_rejected(tmp_path):
+    body = _body([("sheet_id", None, b"x" * (MAX_FIELD_BYTES + 1))])
+
+    with pytest.raises(UploadTooLargeError, match="sheet_id"):
+        _upload(tmp_path, body, chunk_size=64 * 1024)
+
+
+def test_non_multipart_requests_are_rejected(tmp_path):
+    async def empty():
+        return
+        yield
+
+    with pytest.raises(InvalidUploadError):
+        asyncio.run(stream_multipart_to_dir({"content-type": "application/json"}, empty(), str(tmp_path), 1, 1))
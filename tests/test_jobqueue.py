@@ -0,0 +1,79 @@
+import pytest
+
+from app.core import jobqueue
+from app.core.jobqueue import SQLiteJobQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(jobqueue.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "queue.sqlite3"))
+
+
+def test_claim_returns_jobs_in_enqueue_order(queue, clock):
+    queue.enqueue("a", {"n": 1})
+    clock[0] += 1
+    queue.enqueue("b", {"n": 2})
+
+    assert queue.claim("w1", 60) == ("a", {"n": 1, "credentials": {}}, 1)
+    assert queue.claim("w1", 60) == ("b", {"n": 2, "credentials": {}}, 1)
+    assert queue.claim("w1", 60) is None
+
+
+def test_leased_job_is_not_claimed_again_until_the_lease_expires(queue, clock):
+    queue.enqueue("a", {})
+    queue.claim("w1", 60)
+
+    clock[0] += 59
+    assert queue.claim("w2", 60) is None
+    clock[0] += 2
+    job_id, _, attempts = queue.claim("w2", 60)
+    assert (job_id, attempts) == ("a", 2)
+
+
+def test_heartbeat_extends_only_the_owners_lease(queue, clock):
+    queue.enqueue("a", {})
+    queue.claim("w1", 60)
+
+    clock[0] += 50
+    assert queue.heartbeat("a", "w1", 60)
+    assert not queue.heartbeat("a", "w2", 60)
+    clock[0] += 50
+    assert queue.claim("w2", 60) is None
+
+    clock[0] += 11
+    assert queue.claim("w2", 60)[0] == "a"
+    assert not queue.heartbeat("a", "w1", 60)
+
+
+def test_ack_removes_the_job_and_its_credentials(queue, clock):
+    queue.enqueue("a", {"file_paths": []}, {"api_key": "secret", "gcp_json": ""})
+
+    _, payload, _ = queue.claim("w1", 60)
+    assert payload["credentials"] == {"api_key": "secret"}
+    queue.ack("a")
+
+    clock[0] += 120
+    assert queue.claim("w1", 60) is None
+    conn = queue._connect()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM job_credentials").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_credentials_stay_out_of_the_stored_payload(queue, clock):
+    queue.enqueue("a", {"sheet_id": "x"}, {"api_key": "secret"})
+
+    conn = queue._connect()
+    try:
+        (payload,) = conn.execute("SELECT payload FROM job_queue").fetchone()
+    finally:
+        conn.close()
+    assert "secret" not in payload
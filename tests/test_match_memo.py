@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+from app.core.match_memo import MatchMemo
+
+ITEMS = ["งานพื้น - กระเบื้อง 60x60", "Hood - EL 60", "Sink - double bowl"]
+
+
+def refs(names):
+    return [{"name": name} for name in names]
+
+
+@pytest.fixture
+def memo(tmp_path):
+    return MatchMemo(str(tmp_path / "memo.sqlite3"), max_entries=100, reject_score=0.2)
+
+
+def test_lookup_returns_recorded_decisions(memo):
+    memo.record("sheet", [("Hood EL60", "Hood - EL 60"), ("Oven built-in 60cm", None)], ITEMS)
+
+    result = memo.lookup("sheet", [{"name": "Hood EL60"}, {"name": "Oven built-in 60cm"}], refs(ITEMS), ITEMS)
+
+    assert [(t["name"], r["name"]) for t, r in result.matched] == [("Hood EL60", "Hood - EL 60")]
+    assert [t["name"] for t in result.unique] == ["Oven built-in 60cm"]
+    assert result.missing == []
+
+
+def test_lookup_is_scoped(memo):
+    memo.record("sheet", [("Hood EL60", "Hood - EL 60")], ITEMS)
+
+    result = memo.lookup("other", [{"name": "Hood EL60"}], refs(ITEMS), ITEMS)
+
+    assert len(result.missing) == 1
+
+
+def test_matched_decision_survives_while_its_row_is_taken(memo):
+    memo.record("sheet", [("Hood EL60", "Hood - EL 60")], ITEMS)
+    free = [name for name in ITEMS if name != "Hood - EL 60"]
+
+    taken = memo.lookup("sheet", [{"name": "Hood EL60"}], refs(free), ITEMS)
+    again = memo.lookup("sheet", [{"name": "Hood EL60"}], refs(ITEMS), ITEMS)
+
+    assert len(taken.missing) == 1 and taken.matched == []
+    assert len(again.matched) == 1 and again.missing == []
+
+
+def test_matched_decision_is_dropped_when_its_row_is_gone(memo):
+    memo.record("sheet", [("Hood EL60", "Hood - EL 60")], ITEMS)
+    remaining = [name for name in ITEMS if name != "Hood - EL 60"]
+
+    gone = memo.lookup("sheet", [{"name": "Hood EL60"}], refs(remaining), remaining)
+    back = memo.lookup("sheet", [{"name": "Hood EL60"}], refs(ITEMS), ITEMS)
+
+    assert len(gone.missing) == 1
+    assert len(back.missing) == 1
+
+
+def test_unique_decision_holds_until_a_similar_row_is_added(memo):
+    memo.record("sheet", [("Oven built-in 60cm", None)], ITEMS)
+    unrelated = ITEMS + ["Faucet chrome", "ท่อ PVC 4 นิ้ว"]
+    similar = unrelated + ["Oven built in 60 cm stainless"]
+
+    assert len(memo.lookup("sheet", [{"name": "Oven built-in 60cm"}], refs(unrelated), unrelated).unique) == 1
+    assert len(memo.lookup("sheet", [{"name": "Oven built-in 60cm"}], refs(similar), similar).missing) == 1
+    assert len(memo.lookup("sheet", [{"name": "Oven built-in 60cm"}], refs(unrelated), unrelated).missing) == 1
+
+
+def test_record_replaces_the_previous_decision(memo):
+    memo.record("sheet", [("Hood EL60", None)], ITEMS)
+    memo.record("sheet", [("Hood EL60", "Hood - EL 60")], ITEMS)
+
+    result = memo.lookup("sheet", [{"name": "Hood EL60"}], refs(ITEMS), ITEMS)
+
+    assert len(result.matched) == 1 and result.unique == []
+
+
+def test_record_evicts_least_recently_used_past_the_limit(tmp_path):
+    path = tmp_path / "memo.sqlite3"
+    memo = MatchMemo(str(path), max_entries=3, reject_score=0.2)
+    for i in range(5):
+        memo.record("sheet", [(f"product {i}", None)], ITEMS)
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM match_memo").fetchone()[0] == 3
+        assert conn.execute("SELECT COUNT(DISTINCT reference_set) FROM match_memo_reference_names").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_disabled_memo_reports_everything_missing(tmp_path):
+    memo = MatchMemo(str(tmp_path / "memo.sqlite3"), max_entries=100, reject_score=0.2, enabled=False)
+    memo.record("sheet", [("Hood EL60", "Hood - EL 60")], ITEMS)
+
+    result = memo.lookup("sheet", [{"name": "Hood EL60"}], refs(ITEMS), ITEMS)
+
+    assert len(result.missing) == 1
@@ -0,0 +1,109 @@
+import unicodedata
+
+from app.core.matching import (
+    LocalProductMatcher,
+    estimate_tokens,
+    normalize_product_text,
+    partition_for_matching,
+    split_group,
+)
+
+
+def test_normalize_product_text_unifies_units_and_dimensions():
+    assert normalize_product_text("1. กระเบื้อง 60 X 60 ซม.") == normalize_product_text("กระเบื้อง 60x60 cm")
+    assert normalize_product_text("พื้นที่ 1,200 ตร.ม.") == "พื้นที่ 1200 m2"
+    assert normalize_product_text("ท่อยาว 4.0 ม.") == "ท่อยาว 4 m"
+
+
+def test_normalize_product_text_keeps_thai_marks():
+    assert normalize_product_text("ก๊อกน้ำ ติดผนัง") == unicodedata.normalize("NFKC", "ก๊อกน้ำ ติดผนัง")
+
+
+def test_split_group():
+    assert split_group("1BR+2BR(57-70sqm.) - Hood - EL 60") == (
+        normalize_product_text("1BR+2BR(57-70sqm.)"),
+        normalize_product_text("Hood - EL 60"),
+    )
+    assert split_group("Hood EL 60") == ("", "hood el 60")
+
+
+REFERENCES = [
+    {"name": "1BR - Hood - EL 60"},
+    {"name": "1BR - Sink - BXX 210-45"},
+    {"name": "2BR - Hood - EL 90"},
+    {"name": "งานพื้น - กระเบื้อง 60x60 cm"},
+]
+
+
+def test_local_matcher_accepts_exact_and_near_exact_names():
+    matcher = LocalProductMatcher(REFERENCES)
+
+    result = matcher.match([{"name": "1BR - Hood - EL 60"}, {"name": "งานพื้น - กระเบื้อง 60 X 60 ซม."}])
+
+    assert [(t["name"], r["name"]) for t, r in result.matched] == [
+        ("1BR - Hood - EL 60", "1BR - Hood - EL 60"),
+        ("งานพื้น - กระเบื้อง 60 X 60 ซม.", "งานพื้น - กระเบื้อง 60x60 cm"),
+    ]
+
+
+def test_local_matcher_calls_unrelated_products_unique():
+    result = LocalProductMatcher(REFERENCES).match([{"name": "Water heater 4500W"}])
+
+    assert [t["name"] for t in result.unique] == ["Water heater 4500W"]
+    assert result.matched == []
+
+
+def test_local_matcher_defers_different_numbers_to_gemini():
+    result = LocalProductMatcher(REFERENCES).match([{"name": "1BR - Hood - EL 90"}])
+
+    assert result.matched == []
+    assert [t["name"] for t in result.ambiguous] == ["1BR - Hood - EL 90"]
+
+
+def test_local_matcher_maps_each_reference_once():
+    targets = [{"name": "1BR - Hood - EL 60"}, {"name": "1BR - Hood - EL 60"}]
+
+    result = LocalProductMatcher(REFERENCES).match(targets)
+
+    assert len(result.matched) == 1
+    assert len(result.ambiguous) == 1
+
+
+def test_local_matcher_without_references_marks_everything_unique():
+    targets = [{"name": "Hood"}, {"name": "Sink"}]
+
+    result = LocalProductMatcher([]).match(targets)
+
+    assert result.unique == targets
+
+
+def test_partition_sends_targets_with_their_own_group():
+    targets = [{"name": "1BR - Hood"}, {"name": "2BR - Hood"}, {"name": "Loose item"}]
+
+    partitions = partition_for_matching(targets, REFERENCES, max_tokens=100_000, max_targets=50)
+
+    by_target = {t["name"]: refs for chunk, refs in partitions for t in chunk}
+    assert [r["name"] for r in by_target["1BR - Hood"]] == ["1BR - Hood - EL 60", "1BR - Sink - BXX 210-45"]
+    assert [r["name"] for r in by_target["2BR - Hood"]] == ["2BR - Hood - EL 90"]
+    assert by_target["Loose item"] == REFERENCES
+
+
+def test_partition_chunks_by_target_count_and_budget():
+    targets = [{"name": f"1BR - Item {i}"} for i in range(7)]
+
+    by_count = partition_for_matching(targets, REFERENCES, max_tokens=100_000, max_targets=3)
+    by_tokens = partition_for_matching(
+        targets, REFERENCES, max_tokens=estimate_tokens(REFERENCES[:2]) + 2 * estimate_tokens(targets[:1]), max_targets=50
+    )
+
+    assert [len(chunk) for chunk, _ in by_count] == [3, 3, 1]
+    assert all(len(chunk) <= 2 for chunk, _ in by_tokens)
+    assert sum(len(chunk) for chunk, _ in by_tokens) == 7
+
+
+def test_partition_keeps_a_floor_for_targets_when_references_are_large():
+    targets = [{"name": f"Item {i}"} for i in range(4)]
+
+    partitions = partition_for_matching(targets, REFERENCES, max_tokens=10, max_targets=50)
+
+    assert sum(len(chunk) for chunk, _ in partitions) == 4
@@ -0,0 +1,47 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+from app.core import processing
+from app.core.processing import JobCancelledError, OrderedSheetMerger, process_files
+from app.core.sheet_mirror import MergePlan, SheetMirror
+
+
+class FinishedScheduler:
+    def __init__(self):
+        self.cancelled = []
+
+    def submit(self, job_id, api_key, fn, *args, tokens=None):
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+
+    def cancel_job(self, job_id):
+        self.cancelled.append(job_id)
+
+
+def _merger(cancel):
+    values = [["header"]]
+    return OrderedSheetMerger(SheetMirror(None, values, plan=MergePlan(values)), cancel=cancel)
+
+
+def test_flush_refuses_to_write_once_cancelled():
+    cancel = threading.Event()
+    merger = _merger(cancel)
+
+    merger.flush()
+    cancel.set()
+    with pytest.raises(JobCancelledError):
+        merger.flush()
+
+
+def test_process_files_stops_between_files_when_cancelled(monkeypatch):
+    scheduler = FinishedScheduler()
+    monkeypatch.setattr(processing, "extraction_scheduler", scheduler)
+    cancel = threading.Event()
+    cancel.set()
+
+    with pytest.raises(JobCancelledError):
+        process_files(["a.pdf", "b.pdf"], None, "key", "", job_id="job", output_format="Excel", cancel=cancel)
+    assert scheduler.cancelled == ["job"]
@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+
+from app.core import ratelimit
+from app.core.ratelimit import AdaptiveConcurrencyLimiter, KeyRateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", fake)
+    return fake
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(capacity=10, refill_per_second=2)
+    bucket.consume(10)
+
+    assert bucket.wait_time(4) == pytest.approx(2.0)
+    clock.now += 1
+    assert bucket.wait_time(4) == pytest.approx(1.0)
+    clock.now += 1
+    assert bucket.wait_time(4) == 0.0
+
+
+def test_token_bucket_caps_requests_at_capacity(clock):
+    bucket = TokenBucket(capacity=10, refill_per_second=1)
+
+    assert bucket.wait_time(50) == 0.0
+    bucket.consume(50)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+
+def test_key_rate_limiter_waits_for_the_slower_bucket(clock):
+    limiter = KeyRateLimiter(rpm=60, tpm=600)
+
+    assert limiter.try_acquire(1, 600) == 0.0
+    assert limiter.try_acquire(1, 300) == pytest.approx(30.0)
+    # A refused attempt charges neither bucket.
+    clock.now += 30
+    assert limiter.try_acquire(1, 300) == 0.0
+
+
+def test_key_rate_limiter_with_zero_limits_never_waits(clock):
+    limiter = KeyRateLimiter(rpm=0, tpm=0)
+
+    assert all(limiter.try_acquire(1, 10**6) == 0.0 for _ in range(100))
+
+
+def test_key_rate_limiter_never_overdraws_under_contention(clock):
+    limiter = KeyRateLimiter(rpm=50, tpm=0)
+    granted = []
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        for _ in range(20):
+            if limiter.try_acquire() == 0.0:
+                granted.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(granted) == 50
+
+
+def test_adaptive_limiter_hands_out_at_most_limit_slots():
+    limiter = AdaptiveConcurrencyLimiter(initial=2, min_limit=1, max_limit=8)
+
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+    assert limiter.in_flight == 2
+
+
+def test_adaptive_limiter_grows_only_near_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, min_limit=1, max_limit=8)
+
+    for _ in range(50):
+        limiter.on_success()
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        limiter.try_acquire()
+    for _ in range(5):
+        limiter.on_success()
+    assert limiter.limit == 5
+
+
+def test_adaptive_limiter_backs_off_once_per_cooldown(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial=8, min_limit=2, max_limit=8, cooldown_seconds=2)
+
+    limiter.on_overload()
+    limiter.on_overload()
+    assert limiter.limit == 4
+    clock.now += 3
+    limiter.on_overload()
+    limiter.on_overload()
+    clock.now += 3
+    limiter.on_overload()
+    assert limiter.limit == 2
+
+
+def test_blocked_acquire_goes_before_try_acquire_and_notifies_listeners():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, min_limit=1, max_limit=1)
+    released = []
+    limiter.add_release_listener(lambda: released.append(1))
+    assert limiter.try_acquire()
+
+    acquired = threading.Event()
+
+    def waiter():
+        with limiter.slot():
+            acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while limiter._waiting == 0:
+        time.sleep(0.001)
+    assert not limiter.try_acquire()
+
+    limiter.release()
+    thread.join(timeout=5)
+    assert acquired.is_set()
+    assert limiter.in_flight == 0
+    assert len(released) == 2
+
+    limiter.try_acquire()
+    limiter.release(notify_listeners=False)
+    assert len(released) == 2
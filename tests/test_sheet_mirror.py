@@ -0,0 +1,194 @@
+import pytest
+
+from app.core.sheet_mirror import MergePlan, SheetMirror, _cell_data
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, {}),
+        ("", {}),
+        (True, {"boolValue": True}),
+        (12, {"numberValue": 12}),
+        (1.5, {"numberValue": 1.5}),
+        ("1,250", {"numberValue": 1250}),
+        ("1,250.50", {"numberValue": 1250.5}),
+        ("7%", {"numberValue": 0.07}),
+        ("-3", {"numberValue": -3}),
+        ("false", {"boolValue": False}),
+        ("=SUM(A1:A3)", {"formulaValue": "=SUM(A1:A3)"}),
+        ("'0812345678", {"stringValue": "0812345678"}),
+        ("30 วัน", {"stringValue": "30 วัน"}),
+        ("15/11/2025", {"stringValue": "15/11/2025"}),
+        ("2025-11-15", {"stringValue": "2025-11-15"}),
+        ("%", {"stringValue": "%"}),
+    ],
+)
+def test_cell_data_parses_like_user_entered(value, expected):
+    cell = _cell_data(value)
+    assert cell.get("userEnteredValue", {}) == expected
+
+
+class FakeSpreadsheet:
+    def __init__(self, ws):
+        self.ws = ws
+        self.batches = []
+
+    def batch_update(self, body):
+        self.batches.append(body["requests"])
+        for request in body["requests"]:
+            if "appendDimension" in request:
+                grow = request["appendDimension"]
+                if grow["dimension"] == "ROWS":
+                    self.ws.row_count += grow["length"]
+                else:
+                    self.ws.col_count += grow["length"]
+            elif "insertDimension" in request:
+                span = request["insertDimension"]["range"]
+                self.ws.row_count += span["endIndex"] - span["startIndex"]
+
+    def get_worksheet_by_id(self, sheet_id):
+        assert sheet_id == self.ws.id
+        fresh = FakeWorksheet(self.ws.row_count, self.ws.col_count, self)
+        self.ws = fresh
+        return fresh
+
+
+class FakeWorksheet:
+    def __init__(self, row_count, col_count, spreadsheet=None):
+        self.id = 7
+        self.row_count = row_count
+        self.col_count = col_count
+        self.spreadsheet = spreadsheet or FakeSpreadsheet(self)
+
+
+def test_writes_and_inserts_become_batch_update_requests():
+    mirror = SheetMirror(FakeWorksheet(10, 5), [["Item"], ["Hood"]])
+
+    mirror.insert_rows([["", "Sink"]], row=2)
+    mirror.batch_update([{"range": "C3:D3", "values": [["1,000", "7%"]]}])
+
+    assert mirror.get_all_values() == [["Item"], ["", "Sink"], ["Hood", "", "1,000", "7%"]]
+    insert, write_sink, write_prices = mirror._requests
+    assert insert["insertDimension"]["range"] == {"sheetId": 7, "dimension": "ROWS", "startIndex": 1, "endIndex": 2}
+    assert write_sink["updateCells"]["start"] == {"sheetId": 7, "rowIndex": 1, "columnIndex": 0}
+    assert write_prices["updateCells"]["rows"] == [
+        {"values": [{"userEnteredValue": {"numberValue": 1000}}, {"userEnteredValue": {"numberValue": 0.07}}]}
+    ]
+    assert mirror.row_count == 11
+
+
+def test_writes_past_the_grid_append_rows_and_columns_once():
+    mirror = SheetMirror(FakeWorksheet(3, 2), [])
+
+    mirror.batch_update([{"range": "A5", "values": [["x"]]}, {"range": "D2", "values": [["y"]]}])
+
+    appends = [r["appendDimension"] for r in mirror._requests if "appendDimension" in r]
+    assert appends == [
+        {"sheetId": 7, "dimension": "ROWS", "length": 2},
+        {"sheetId": 7, "dimension": "COLUMNS", "length": 2},
+    ]
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda mirror: mirror.batch_update([{"range": "A20", "values": [["x"]]}]),
+        lambda mirror: mirror.insert_rows([[]], row=2),
+    ],
+)
+def test_flush_sends_one_batch_and_refreshes_the_handle_after_dimension_changes(change):
+    ws = FakeWorksheet(10, 5)
+    refreshed = []
+    mirror = SheetMirror(ws, [["Item"]], on_refresh=refreshed.append)
+
+    change(mirror)
+    sent = mirror.flush()
+
+    assert sent == len(ws.spreadsheet.batches[0])
+    assert mirror.pending_requests == 0
+    assert refreshed == [mirror.ws] and mirror.ws is not ws
+    assert mirror.ws.row_count == mirror.row_count
+
+
+def test_flush_keeps_requests_when_the_batch_fails():
+    ws = FakeWorksheet(10, 5)
+    mirror = SheetMirror(ws, [])
+    mirror.batch_update([{"range": "A1", "values": [["x"]]}])
+
+    def fail(body):
+        raise RuntimeError("quota")
+
+    ws.spreadsheet.batch_update = fail
+    with pytest.raises(RuntimeError):
+        mirror.flush()
+    assert mirror.pending_requests == 1
+
+
+def test_local_mirror_without_a_worksheet_only_records_the_plan():
+    plan = MergePlan([["Item"]])
+    mirror = SheetMirror(None, [["Item"]], plan=plan)
+
+    mirror.insert_rows([["Hood"]], row=2)
+
+    assert mirror.flush() == 0
+    assert plan.steps == [["insert", 2, 1], ["write", 2, 1, [["Hood"]]]]
+
+
+class RecordingWorksheet:
+    def __init__(self):
+        self.calls = []
+
+    def batch_update(self, requests):
+        self.calls.append(("write", [(r["range"], r["values"]) for r in requests]))
+
+    def insert_rows(self, rows, row):
+        self.calls.append(("insert", row, len(rows)))
+
+
+def test_replay_writes_label_and_own_headers_then_steps_in_order():
+    base = [
+        ["No.", "Item", "Old supplier", "", "", "", "New supplier"],
+        ["", "", "qty", "unit", "price", "total", "qty"],
+        [],
+        ["", "Hood"],
+    ]
+    plan = MergePlan(base, header_rows=3, name_col=2)
+    plan.record_insert(5, 1)
+    plan.record_write(5, 1, [["", "Sink"]])
+    plan.record_write(4, 7, [[1], [2]])
+    ws = RecordingWorksheet()
+
+    plan.replay(ws)
+
+    # Old supplier's header (columns 3-6) is left out: its prices are not in
+    # the plan. Column 7 was written by this job, so its header stays.
+    assert ws.calls == [
+        ("write", [("A1:B1", [["No.", "Item"]]), ("G1:G1", [["New supplier"]]), ("G2:G2", [["qty"]]), ("A4:B4", [["", "Hood"]])]),
+        ("insert", 5, 1),
+        ("write", [("A5:B5", [["", "Sink"]])]),
+        ("write", [("G4:G5", [[1], [2]])]),
+    ]
+
+
+def test_plan_round_trips_through_a_dict():
+    plan = MergePlan([["Item"]], header_rows=1, name_col=1)
+    plan.record_write(2, 1, [["Hood"]])
+
+    restored = MergePlan.from_dict(plan.to_dict())
+
+    assert (restored.base_values, restored.steps, restored.header_rows, restored.name_col) == (
+        [["Item"]],
+        [["write", 2, 1, [["Hood"]]]],
+        1,
+        1,
+    )
+
+
+def test_plans_without_header_rows_replay_every_base_cell():
+    restored = MergePlan.from_dict({"base": [["No.", "Item", "Old supplier"]], "steps": []})
+    ws = RecordingWorksheet()
+
+    restored.replay(ws)
+
+    assert ws.calls == [("write", [("A1:C1", [["No.", "Item", "Old supplier"]])])]